@@ -0,0 +1,77 @@
+from typing import Optional
+
+import numpy as np
+
+# Spherical k-means trains on at most this many rows per centroid
+TRAIN_ROWS_PER_CENTROID = 64
+# Rows scored per chunk when assigning a large matrix to centroids
+ASSIGN_CHUNK = 16384
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1.0)
+
+
+class IVFQuantizer:
+    """Coarse quantizer for an inverted-file (IVF) approximate search.
+
+    Centroids come from spherical k-means over L2-normalized encodings, so
+    cosine similarity is a dot product throughout. A query is scored only
+    against rows whose centroid is among its nprobe most similar ones.
+    Pure NumPy; fitting is deterministic for a given seed.
+    """
+
+    def __init__(self, centroids: np.ndarray):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @staticmethod
+    def default_nlist(count: int) -> int:
+        """About sqrt(count) lists"""
+        return max(1, int(round(np.sqrt(count))))
+
+    @classmethod
+    def fit(cls, matrix: np.ndarray, nlist: Optional[int] = None, iterations: int = 10,
+            seed: int = 0) -> "IVFQuantizer":
+        """Run spherical k-means over the rows of matrix"""
+        matrix = np.asarray(matrix, dtype=np.float32)
+        nlist = min(nlist or cls.default_nlist(len(matrix)), len(matrix))
+        rng = np.random.default_rng(seed)
+
+        train = matrix
+        if len(matrix) > nlist * TRAIN_ROWS_PER_CENTROID:
+            train = matrix[rng.choice(len(matrix), nlist * TRAIN_ROWS_PER_CENTROID, replace=False)]
+        train = _normalize_rows(train)
+
+        centroids = train[rng.choice(len(train), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(train @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, train)
+            counts = np.bincount(assignment, minlength=nlist)
+            empty = np.flatnonzero(counts == 0)
+            if len(empty):
+                # Reseed empty lists from random training rows
+                sums[empty] = train[rng.choice(len(train), len(empty), replace=False)]
+            centroids = _normalize_rows(sums)
+        return cls(centroids)
+
+    def assign(self, matrix: np.ndarray) -> np.ndarray:
+        """Nearest centroid of each row"""
+        matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float32))
+        assignment = np.empty(len(matrix), dtype=np.int32)
+        for start in range(0, len(matrix), ASSIGN_CHUNK):
+            chunk = matrix[start:start + ASSIGN_CHUNK]
+            assignment[start:start + len(chunk)] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return assignment
+
+    def probe(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """Ids of the nprobe centroids most similar to a normalized query"""
+        similarities = self.centroids @ query
+        if nprobe >= self.nlist:
+            return np.arange(self.nlist)
+        return np.argpartition(similarities, self.nlist - nprobe)[-nprobe:]
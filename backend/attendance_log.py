@@ -0,0 +1,317 @@
+import bisect
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Rewrite the journal once removal entries make up this share of it
+COMPACT_RATIO = 0.5
+
+
+def empty_summary() -> dict:
+    """Attendance summary of a user with no records"""
+    return {"total_days": 0, "total_records": 0, "latest_timestamp": None, "latest_date": None}
+
+
+class AttendanceLog:
+    """Append-only attendance journal with in-memory indexes.
+
+    Every line of the JSON Lines file is either an attendance record or a
+    removal entry ``{"removed": true, "username": u, "date": d}`` (without
+    "date" it removes every record of that user). The journal is replayed
+    once at startup into a (date, username) set plus per-user and per-date
+    record lists, so duplicate checks are O(1) and marking attendance costs
+    one appended line. fsync is batched to at most once per fsync_interval.
+    Records also get an in-memory sequence number (their position in the
+    replayed journal), used as the pagination cursor by query(), and each
+    user's totals are kept up to date for summary().
+    """
+
+    def __init__(self, path: str, fsync_interval: float = 1.0):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self._lock = threading.RLock()
+        self._file = None
+        self._last_fsync = 0.0
+        self._unsynced = 0
+        self._removal_entries = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        self._records: List[dict] = []
+        self._marked: Set[Tuple[str, str]] = set()
+        self._by_user: Dict[str, List[dict]] = defaultdict(list)
+        self._by_date: Dict[str, List[dict]] = defaultdict(list)
+        # Sorted keys of _by_date, so date ranges visit only the dates inside them
+        self._dates: List[str] = []
+        # id(record) -> sequence number; increases in insertion order
+        self._seqs: Dict[int, int] = {}
+        self._next_seq = 1
+        # username -> total_days, total_records, latest_timestamp, latest_date
+        self._summaries: Dict[str, dict] = {}
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def load(self) -> int:
+        """Replay the journal into memory, returning the number of live records"""
+        with self._lock:
+            self._reset()
+            self._removal_entries = 0
+            if self.exists():
+                with open(self.path, "r") as f:
+                    for line_number, line in enumerate(f, start=1):
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            logger.warning(f"Ignoring unreadable entry at {self.path}:{line_number}")
+                            continue
+                        if entry.get("removed"):
+                            self._remove(entry["username"], entry.get("date"))
+                            self._removal_entries += 1
+                        else:
+                            self._index(entry)
+            return len(self._records)
+
+    def import_records(self, records: List[dict]) -> int:
+        """Replace the journal with the given records (used for JSON migration)"""
+        with self._lock:
+            self._reset()
+            for record in records:
+                self._index(record)
+            self.compact()
+            return len(self._records)
+
+    def is_marked(self, username: str, date: str) -> bool:
+        return (date, username) in self._marked
+
+    def mark(self, record: dict) -> bool:
+        """Append an attendance record unless the user is already marked for that date"""
+        with self._lock:
+            if self.is_marked(record["username"], record["date"]):
+                return False
+            self._append(record)
+            self._index(record)
+            return True
+
+    def mark_many(self, records: List[dict]) -> List[bool]:
+        """Mark several records under one lock, syncing once at the end"""
+        with self._lock:
+            results = []
+            for record in records:
+                marked = not self.is_marked(record["username"], record["date"])
+                if marked:
+                    self._append(record, defer_sync=True)
+                    self._index(record)
+                results.append(marked)
+            if any(results):
+                self.flush()
+            return results
+
+    def all(self) -> List[dict]:
+        with self._lock:
+            return list(self._records)
+
+    def for_date(self, date: str) -> List[dict]:
+        with self._lock:
+            return list(self._by_date.get(date, []))
+
+    def for_user(self, username: str) -> List[dict]:
+        with self._lock:
+            return list(self._by_user.get(username, []))
+
+    def summary(self, username: str) -> dict:
+        with self._lock:
+            summary = self._summaries.get(username)
+            return dict(summary) if summary else empty_summary()
+
+    def summaries(self) -> Dict[str, dict]:
+        with self._lock:
+            return {username: dict(summary) for username, summary in self._summaries.items()}
+
+    def query(self, username: Optional[str] = None, usernames: Optional[Iterable[str]] = None,
+              date_from: Optional[str] = None, date_to: Optional[str] = None, method: Optional[str] = None,
+              after: Optional[int] = None, limit: int = 100) -> Tuple[List[dict], Optional[int]]:
+        """One page of matching records in insertion order; returns (records, next cursor or None).
+
+        A username filter scans only that user's records, and a date range
+        walks the sorted date index between its bounds.
+        """
+        with self._lock:
+            page = []
+            for record in self._matching(username, usernames, date_from, date_to, method, after):
+                if len(page) == limit:
+                    return page, self._seqs[id(page[-1])]
+                page.append(record)
+            return page, None
+
+    def count(self, username: Optional[str] = None, usernames: Optional[Iterable[str]] = None,
+              date_from: Optional[str] = None, date_to: Optional[str] = None, method: Optional[str] = None) -> int:
+        with self._lock:
+            return sum(1 for _ in self._matching(username, usernames, date_from, date_to, method, None))
+
+    def _matching(self, username, usernames, date_from, date_to, method, after):
+        if username is not None:
+            sources = [self._by_user.get(username, [])]
+        elif date_from is not None or date_to is not None:
+            first = bisect.bisect_left(self._dates, date_from) if date_from is not None else 0
+            last = bisect.bisect_right(self._dates, date_to) if date_to is not None else len(self._dates)
+            sources = [self._by_date[date] for date in self._dates[first:last]]
+        else:
+            sources = [self._records]
+        if usernames is not None:
+            usernames = set(usernames)
+
+        # Every source list is in insertion order: skip each to the cursor by binary search,
+        # then interleave the per-date lists back into insertion order
+        sources = [source[self._cursor_start(source, after):] for source in sources]
+        candidates = sources[0] if len(sources) == 1 else heapq.merge(*sources, key=lambda r: self._seqs[id(r)])
+        for record in candidates:
+            date = record.get("date")
+            if date_from is not None and (date is None or date < date_from):
+                continue
+            if date_to is not None and (date is None or date > date_to):
+                continue
+            if method is not None and record.get("method") != method:
+                continue
+            if usernames is not None and record.get("username") not in usernames:
+                continue
+            yield record
+
+    def _cursor_start(self, records: List[dict], after: Optional[int]) -> int:
+        """Index of the first record after the cursor in an insertion-ordered list"""
+        start, stop = 0, len(records)
+        if after is not None:
+            while start < stop:
+                middle = (start + stop) // 2
+                if self._seqs[id(records[middle])] <= after:
+                    start = middle + 1
+                else:
+                    stop = middle
+        return start
+
+    def remove(self, username: str, date: Optional[str] = None) -> int:
+        """Remove a user's records for one date (or all dates), returning how many were removed"""
+        with self._lock:
+            removed = self._remove(username, date)
+            if removed:
+                entry = {"removed": True, "username": username}
+                if date is not None:
+                    entry["date"] = date
+                self._append(entry, sync=True)
+                self._removal_entries += 1
+                if self._removal_entries > COMPACT_RATIO * max(1, len(self._records)):
+                    self.compact()
+            return removed
+
+    def compact(self) -> None:
+        """Rewrite the journal with only the live records"""
+        with self._lock:
+            self._close_file()
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                for record in self._records:
+                    f.write(json.dumps(record, default=str) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._removal_entries = 0
+
+    def flush(self) -> None:
+        """Force buffered appends to disk"""
+        with self._lock:
+            if self._file is not None and self._unsynced:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._unsynced = 0
+                self._last_fsync = time.monotonic()
+
+    def close(self) -> None:
+        with self._lock:
+            self.flush()
+            self._close_file()
+
+    def _append(self, entry: dict, sync: bool = False, defer_sync: bool = False) -> None:
+        if self._file is None:
+            self._file = open(self.path, "a")
+        self._file.write(json.dumps(entry, default=str) + "\n")
+        self._file.flush()
+        self._unsynced += 1
+        if defer_sync:
+            return
+        if sync or time.monotonic() - self._last_fsync >= self.fsync_interval:
+            self.flush()
+
+    def _close_file(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._unsynced = 0
+
+    def _index(self, record: dict) -> None:
+        username, date = record.get("username"), record.get("date")
+        summary = self._summaries.get(username)
+        if summary is None:
+            summary = self._summaries[username] = empty_summary()
+        summary["total_records"] += 1
+        summary["total_days"] += (date, username) not in self._marked
+        timestamp = record.get("timestamp")
+        if summary["latest_timestamp"] is None or (timestamp is not None and timestamp > summary["latest_timestamp"]):
+            summary["latest_timestamp"] = timestamp
+            summary["latest_date"] = date
+
+        self._records.append(record)
+        self._seqs[id(record)] = self._next_seq
+        self._next_seq += 1
+        self._marked.add((record.get("date"), record.get("username")))
+        self._by_user[record.get("username")].append(record)
+        if date not in self._by_date and isinstance(date, str):
+            bisect.insort(self._dates, date)
+        self._by_date[date].append(record)
+
+    def _remove(self, username: str, date: Optional[str]) -> int:
+        user_records = self._by_user.get(username, [])
+        doomed = [r for r in user_records if date is None or r.get("date") == date]
+        if not doomed:
+            return 0
+
+        doomed_ids = {id(r) for r in doomed}
+        for doomed_id in doomed_ids:
+            del self._seqs[doomed_id]
+        self._records = [r for r in self._records if id(r) not in doomed_ids]
+        remaining = [r for r in user_records if id(r) not in doomed_ids]
+        if remaining:
+            self._by_user[username] = remaining
+            latest = max(remaining, key=lambda r: r.get("timestamp") or "")
+            self._summaries[username] = {
+                "total_days": len({r.get("date") for r in remaining}),
+                "total_records": len(remaining),
+                "latest_timestamp": latest.get("timestamp"),
+                "latest_date": latest.get("date"),
+            }
+        else:
+            self._by_user.pop(username, None)
+            self._summaries.pop(username, None)
+
+        for record_date in {r.get("date") for r in doomed}:
+            kept = [r for r in self._by_date[record_date] if id(r) not in doomed_ids]
+            if kept:
+                self._by_date[record_date] = kept
+            else:
+                self._by_date.pop(record_date, None)
+                if isinstance(record_date, str):
+                    del self._dates[bisect.bisect_left(self._dates, record_date)]
+            self._marked.discard((record_date, username))
+        return len(doomed)
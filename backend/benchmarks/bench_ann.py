@@ -0,0 +1,95 @@
+"""Recall-vs-latency benchmark for the IVF approximate gallery search.
+
+Builds a synthetic clustered gallery (non-negative, histogram-like
+encodings grouped around shared centres), then compares exact top2 with
+IVF search at several probe counts. For each setting it reports the
+per-query latency, recall@1 (same best user as exact search) and how
+often the final accept/reject decision of the confidence-gap rule matches
+the exact decision.
+
+Usage (from the backend directory):
+    python benchmarks/bench_ann.py [--size 100000] [--nprobe 1,2,4,8,16,32] [--queries 200]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gallery import GalleryIndex  # noqa: E402
+
+DIM = 768
+CONFIDENCE_THRESHOLD = 0.65
+
+
+def decide(name, best, second, size):
+    """Accept/reject outcome of main.resolve_match plus the confidence threshold"""
+    if best <= 0.0 or best < CONFIDENCE_THRESHOLD:
+        return None
+    if size > 1 and best < 0.90 and best - second < 0.03:
+        return None
+    return name
+
+
+def synthetic_gallery(size, rng, centers=256):
+    """Users spread around shared centres, like faces sharing lighting and pose"""
+    base = rng.random((centers, DIM), dtype=np.float32) ** 4
+    groups = rng.integers(0, centers, size)
+    users = base[groups] + 0.6 * rng.random((size, DIM), dtype=np.float32) ** 4
+    return users / np.linalg.norm(users, axis=1, keepdims=True)
+
+
+def time_queries(index, queries):
+    start = time.perf_counter()
+    results = [index.top2(query) for query in queries]
+    return (time.perf_counter() - start) / len(queries), results
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--nprobe", default="1,2,4,8,16,32")
+    parser.add_argument("--nlist", type=int, default=0, help="IVF lists (0 = about sqrt(size))")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.25, help="query noise relative to the encoding")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    matrix = synthetic_gallery(args.size, rng)
+    usernames = [f"user_{i}" for i in range(args.size)]
+    picks = rng.integers(0, args.size, args.queries)
+    noise = rng.random((args.queries, DIM), dtype=np.float32) ** 4
+    noise *= args.noise / np.linalg.norm(noise, axis=1, keepdims=True)
+    queries = matrix[picks] + noise
+
+    index = GalleryIndex.from_matrix(usernames, matrix, ann="ivf", nlist=args.nlist, ann_min_size=0)
+    exact_time, exact = time_queries(index, queries)
+
+    start = time.perf_counter()
+    index.build_ann()
+    build_time = time.perf_counter() - start
+    nlist = index._quantizer.nlist
+
+    exact_correct = np.mean([result[0] == usernames[pick] for result, pick in zip(exact, picks)])
+    exact_decisions = [decide(*result, args.size) for result in exact]
+    print(f"{args.size} users, {DIM} dims, {nlist} lists, k-means build {build_time:.1f} s")
+    print(f"exact          {exact_time * 1e3:8.3f} ms/query  identity accuracy {exact_correct:.3f}")
+
+    for nprobe in (int(n) for n in args.nprobe.split(",")):
+        index.nprobe = nprobe
+        ann_time, approx = time_queries(index, queries)
+        recall = np.mean([a[0] == e[0] for a, e in zip(approx, exact)])
+        second_same = np.mean([abs(a[2] - e[2]) < 1e-5 for a, e in zip(approx, exact)])
+        decisions = np.mean([decide(*a, args.size) == d for a, d in zip(approx, exact_decisions)])
+        print(
+            f"ivf nprobe={nprobe:<3} {ann_time * 1e3:8.3f} ms/query  ({exact_time / ann_time:5.1f}x)  "
+            f"recall@1 {recall:.3f}  same runner-up {second_same:.3f}  same decision {decisions:.3f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_benchmark())
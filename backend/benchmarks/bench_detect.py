@@ -0,0 +1,81 @@
+"""Micro-benchmark for the face detection stage.
+
+Times detect_faces on a large photo under several detector settings
+(full-resolution Haar as before, downscaled Haar, tuned Haar parameters
+and optionally YuNet) and reports how many faces each finds and how well
+its largest box overlaps the largest full-resolution baseline box.
+
+Usage (from the backend directory):
+    python benchmarks/bench_detect.py image_path [--upscale-to 4032] [--repeat N]
+                                      [--yunet-model face_detection_yunet_2023mar.onnx]
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import features  # noqa: E402
+from streaming import box_iou  # noqa: E402
+
+
+def largest_box(boxes):
+    return boxes[(boxes[:, 2] * boxes[:, 3]).argmax()] if len(boxes) else None
+
+
+def time_per_call(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("image_path", help="photo containing at least one face")
+    parser.add_argument("--upscale-to", type=int, default=4032,
+                        help="resize so the longer side matches a phone photo (0 keeps the original)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--yunet-model", help="YuNet ONNX model file to include in the comparison")
+    args = parser.parse_args()
+
+    gray = features.load_grayscale(args.image_path)
+    if gray is None:
+        raise SystemExit(f"Could not read {args.image_path}")
+    if args.upscale_to:
+        scale = args.upscale_to / max(gray.shape)
+        gray = cv2.resize(gray, (round(gray.shape[1] * scale), round(gray.shape[0] * scale)),
+                          interpolation=cv2.INTER_CUBIC)
+    print(f"image: {gray.shape[1]}x{gray.shape[0]}")
+
+    configs = [
+        ("haar full-res 1.3/5 (before)", {"detector": "haar", "max_side": 0, "scale_factor": 1.3, "min_neighbors": 5}),
+        ("haar max_side=1024", {"detector": "haar", "max_side": 1024}),
+        ("haar max_side=640", {"detector": "haar", "max_side": 640}),
+        ("haar max_side=1024 1.1/5", {"detector": "haar", "max_side": 1024, "scale_factor": 1.1}),
+        ("haar max_side=1024 min 200px", {"detector": "haar", "max_side": 1024, "min_size": 200}),
+    ]
+    if args.yunet_model:
+        configs += [
+            ("yunet max_side=1024", {"detector": "yunet", "max_side": 1024, "yunet_model": args.yunet_model}),
+            ("yunet max_side=640", {"detector": "yunet", "max_side": 640, "yunet_model": args.yunet_model}),
+        ]
+
+    baseline_time = baseline_box = None
+    for label, kwargs in configs:
+        elapsed, boxes = time_per_call(lambda: features.detect_faces(gray, **kwargs), args.repeat)
+        if baseline_time is None:
+            baseline_time = elapsed
+            baseline_box = largest_box(boxes)
+        box = largest_box(boxes)
+        iou = box_iou(baseline_box, box) if box is not None and baseline_box is not None else 0.0
+        print(f"{label:32} {elapsed * 1e3:9.1f} ms  ({baseline_time / elapsed:5.1f}x)  "
+              f"faces={len(boxes)}  iou_vs_baseline={iou:.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_benchmark())
@@ -0,0 +1,99 @@
+"""Micro-benchmark for predict_face against galleries of increasing size.
+
+Compares the original per-user dict loop with the matrix-backed
+GalleryIndex and checks both pick the same match. With --templates N it
+also times galleries holding N templates per user under each per-user
+aggregation.
+
+Usage (from the backend directory):
+    python benchmarks/bench_gallery.py [--sizes 100,1000,10000] [--repeat N] [--templates N]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gallery import AGGREGATIONS, GalleryIndex, template_key  # noqa: E402
+
+DIM = 768
+
+
+def predict_reference(encodings_db, face_features):
+    """Original dict loop from predict_face, returning (best, top, second)"""
+    best_match = None
+    best_confidence = 0.0
+    all_similarities = []
+    for username, stored_features in encodings_db.items():
+        stored_array = np.array(stored_features)
+        similarity = np.dot(stored_array, face_features) / (
+            np.linalg.norm(stored_array) * np.linalg.norm(face_features)
+        )
+        all_similarities.append(similarity)
+        if similarity > best_confidence:
+            best_confidence = similarity
+            best_match = username
+    all_similarities.sort(reverse=True)
+    return best_match, all_similarities[0], all_similarities[1]
+
+
+def random_encodings(count, rng):
+    vectors = rng.random((count, DIM), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,10000")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--templates", type=int, default=3, help="templates per user for the multi-sample run")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    agree = True
+    for size in (int(s) for s in args.sizes.split(",")):
+        vectors = random_encodings(size, rng)
+        encodings_db = {f"user_{i}": vectors[i].tolist() for i in range(size)}
+        index = GalleryIndex.from_encodings(encodings_db)
+        query = vectors[size // 2] + 0.01 * rng.random(DIM, dtype=np.float32)
+        query /= np.linalg.norm(query)
+
+        loop_repeat = max(1, args.repeat * 100 // size)
+        start = time.perf_counter()
+        for _ in range(loop_repeat):
+            expected = predict_reference(encodings_db, query)
+        loop_time = (time.perf_counter() - start) / loop_repeat
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            result = index.top2(query)
+        index_time = (time.perf_counter() - start) / args.repeat
+
+        same = result[0] == expected[0] and abs(result[1] - expected[1]) < 1e-5
+        agree = agree and same
+        print(
+            f"{size:>7} users: dict loop {loop_time * 1e3:9.3f} ms  "
+            f"GalleryIndex {index_time * 1e3:7.3f} ms  ({loop_time / index_time:6.0f}x)  same match: {same}"
+        )
+
+        if args.templates > 1:
+            extra = random_encodings(size * (args.templates - 1), rng)
+            keys = [template_key(f"user_{i}", sample) for sample in range(args.templates) for i in range(size)]
+            matrix = np.concatenate([vectors, extra])
+            for aggregation in AGGREGATIONS:
+                multi = GalleryIndex.from_matrix(keys, matrix, aggregation=aggregation)
+                start = time.perf_counter()
+                for _ in range(args.repeat):
+                    multi.top2(query)
+                multi_time = (time.perf_counter() - start) / args.repeat
+                print(f"{'':>13}{args.templates} templates/user, {aggregation:9}: {multi_time * 1e3:7.3f} ms")
+
+    return 0 if agree else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main_benchmark())
@@ -0,0 +1,82 @@
+"""Memory, speed and accuracy of projected and quantized galleries.
+
+Accuracy comes from projection.accuracy_report on a gallery of synthetic
+faces described with the real pipeline (benchmarks/synthetic.py), or on
+the enrolled gallery with --dataset-dir. Latency and memory are measured
+on a --size template gallery built by jittering those descriptors.
+
+Usage (from the backend directory):
+    python benchmarks/bench_projection.py [--dims 0,64,128,256] [--users 400] [--size 100000]
+                                          [--dataset-dir dataset]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from features import FEATURE_VERSION, LEGACY_FEATURE_VERSION  # noqa: E402
+from gallery import DTYPES, GalleryIndex  # noqa: E402
+from projection import Projection, accuracy_report  # noqa: E402
+from storage import open_storage  # noqa: E402
+from synthetic import jittered_encodings, synthetic_gallery  # noqa: E402
+
+
+def load_dataset(dataset_dir, backend):
+    storage = open_storage(backend, dataset_dir, FEATURE_VERSION, LEGACY_FEATURE_VERSION)
+    keys, matrix = storage.encodings.load()
+    storage.close()
+    return keys, matrix
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dims", default="0,64,128,256", help="projection sizes (0 = raw descriptors)")
+    parser.add_argument("--dtypes", default=",".join(DTYPES))
+    parser.add_argument("--users", type=int, default=400, help="synthetic identities for the accuracy report")
+    parser.add_argument("--samples", type=int, default=3, help="synthetic samples per identity")
+    parser.add_argument("--size", type=int, default=100000, help="templates in the latency gallery")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--probes", type=int, default=1000)
+    parser.add_argument("--dataset-dir", help="report accuracy on this enrolled gallery instead")
+    parser.add_argument("--storage", default=os.environ.get("ATTEND_STORAGE", "sqlite"))
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.dataset_dir:
+        keys, matrix = load_dataset(args.dataset_dir, args.storage)
+    else:
+        keys, matrix, _ = synthetic_gallery(args.users, args.samples, rng)
+    large = jittered_encodings(matrix, args.size, rng)
+    large_keys = [f"user_{i}" for i in range(args.size)]
+    queries = large[rng.integers(0, args.size, args.queries)] * 1.01
+
+    print(f"accuracy: {len(keys)} templates, {matrix.shape[1]} raw dims; latency: {args.size} templates")
+    for dims in (int(d) for d in args.dims.split(",")):
+        projection = Projection.fit(matrix, dims, FEATURE_VERSION) if dims else None
+        for dtype in args.dtypes.split(","):
+            report = accuracy_report(keys, matrix, projection, dtype, max_probes=args.probes)
+            index = GalleryIndex.from_matrix(large_keys, large, projection=projection, dtype=dtype)
+            index.top2(queries[0])
+            start = time.perf_counter()
+            for query in queries:
+                index.top2(query)
+            query_time = (time.perf_counter() - start) / len(queries)
+            identity = report["identity_accuracy"]
+            print(
+                f"dims={report['dims']:<4} {dtype:8} {report['bytes_per_template']:5} B/template  "
+                f"{index.bytes_per_template * args.size / 2 ** 20:7.1f} MiB  {query_time * 1e3:7.2f} ms/query  "
+                f"same best {report['same_best_user']:.3f}  "
+                f"score err {report['mean_abs_best_score_error']:.5f}  "
+                f"identity {identity if identity is None else round(identity, 3)} "
+                f"(raw {report['raw_identity_accuracy'] if identity is None else round(report['raw_identity_accuracy'], 3)})  "
+                f"energy {report['retained_energy']:.5f}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_benchmark())
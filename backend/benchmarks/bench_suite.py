@@ -0,0 +1,217 @@
+"""Reproducible end-to-end benchmark suite for the recognition pipeline.
+
+Runs in-process against a scratch dataset directory (the real dataset is
+never touched) and measures:
+
+  extract_face_features   decode, detect and describe one uploaded JPEG
+  register_user           POST /register_user through the ASGI test client
+  train_model_async       full retrain of the registered users
+  predict_face            gallery match, per gallery size
+  recognize_face          POST /recognize_face, per gallery size
+
+Faces are synthetic (benchmarks/synthetic.py) and generated from --seed,
+so runs are comparable between commits. Galleries of 100 to 100k users
+are the registered users plus distractors jittered from other synthetic
+identities. Every result has count, throughput and mean/p50/p95/p99
+latency; the whole run is written as JSON, and --compare prints the
+change against an earlier run's JSON.
+
+Usage (from the backend directory):
+    python benchmarks/bench_suite.py [--sizes 100,1000,10000,100000] [--requests 200]
+                                     [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from synthetic import augment, encode_jpeg, jittered_encodings, synthetic_identity  # noqa: E402
+
+
+def latency_summary(name, durations, **extra):
+    """count, throughput and latency percentiles (ms) for one benchmark"""
+    durations = np.asarray(durations, dtype=np.float64)
+    total = durations.sum()
+    result = {"name": name, **extra, "count": len(durations),
+              "throughput_per_s": len(durations) / total if total > 0 else None}
+    for label, value in (("mean", durations.mean()), ("p50", np.percentile(durations, 50)),
+                         ("p95", np.percentile(durations, 95)), ("p99", np.percentile(durations, 99)),
+                         ("max", durations.max())):
+        result[f"{label}_ms"] = round(float(value) * 1e3, 4)
+    return result
+
+
+def timed(func, items):
+    """Call func on each item; returns (per-call durations, results)"""
+    durations, results = [], []
+    for item in items:
+        start = time.perf_counter()
+        results.append(func(item))
+        durations.append(time.perf_counter() - start)
+    return durations, results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_label(result):
+    return result["name"] + (f"[{result['gallery_users']}]" if result.get("gallery_users") else "")
+
+
+def report(result):
+    print(
+        f"{result_label(result):32} n={result['count']:<5} p50 {result['p50_ms']:9.3f} ms  "
+        f"p95 {result['p95_ms']:9.3f} ms  p99 {result['p99_ms']:9.3f} ms  "
+        f"{result['throughput_per_s'] or 0:9.1f}/s",
+        file=sys.stderr
+    )
+
+
+def compare(results, baseline_path):
+    """Print p50/p95 of each result relative to the same benchmark in a baseline run"""
+    with open(baseline_path) as f:
+        baseline = {result_label(result): result for result in json.load(f)["results"]}
+    print(f"\nchange vs {baseline_path} (ratio > 1 is slower):", file=sys.stderr)
+    for result in results:
+        before = baseline.get(result_label(result))
+        if before is None:
+            continue
+        ratios = [result[key] / before[key] if before[key] else float("nan") for key in ("p50_ms", "p95_ms")]
+        print(f"{result_label(result):32} p50 x{ratios[0]:6.2f}  p95 x{ratios[1]:6.2f}", file=sys.stderr)
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,10000,100000", help="gallery sizes in users")
+    parser.add_argument("--requests", type=int, default=200, help="timed calls per benchmark")
+    parser.add_argument("--register", type=int, default=50, help="users registered through the API")
+    parser.add_argument("--distractors", type=int, default=200,
+                        help="synthetic identities the filler gallery users are jittered from")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="-", help="JSON output file ('-' for stdout)")
+    parser.add_argument("--compare", help="earlier JSON output to compare against")
+    parser.add_argument("--cache", action="store_true", help="leave the recognition cache on (off by default)")
+    parser.add_argument("--workdir", help="scratch directory for the dataset (default: a new temporary one)")
+    args = parser.parse_args()
+
+    # main creates dataset/ and uploads/ in the working directory on import
+    os.chdir(args.workdir or tempfile.mkdtemp(prefix="attend-bench-"))
+    if not args.cache:
+        os.environ["ATTEND_RECOGNITION_CACHE_SIZE"] = "0"
+    from fastapi.testclient import TestClient
+    import main
+    from features import extract_face_features
+    from gallery import GalleryIndex
+    logging.getLogger().setLevel(logging.WARNING)
+    client = TestClient(main.app)
+
+    rng = np.random.default_rng(args.seed)
+    identities = [synthetic_identity(rng) for _ in range(args.register)]
+    probe_ids = rng.integers(0, args.register, args.requests)
+    probes = [encode_jpeg(augment(identities[i], rng)) for i in probe_ids]
+    results = []
+
+    def record(result):
+        results.append(result)
+        report(result)
+
+    # Feature extraction on its own (includes JPEG decode and detection)
+    extract_face_features(probes[0])
+    durations, _ = timed(extract_face_features, probes)
+    record(latency_summary("extract_face_features", durations))
+
+    # Registration through the API (validation, storage, image write, live gallery insert)
+    def register(i):
+        response = client.post("/register_user", data={"username": f"bench_user_{i}"},
+                               files={"file": ("face.jpg", encode_jpeg(identities[i]), "image/jpeg")})
+        if response.status_code != 200:
+            raise RuntimeError(f"register_user failed: {response.status_code} {response.text}")
+
+    durations, _ = timed(register, range(args.register))
+    record(latency_summary("register_user", durations))
+
+    # Full retrain of the registered users
+    start = time.perf_counter()
+    main.train_model_async()
+    record(latency_summary("train_model_async", [time.perf_counter() - start], users=args.register,
+                           train_workers=main.TRAIN_WORKERS))
+
+    registered = main.gallery
+    registered_keys, registered_matrix = registered.keys, registered.matrix.copy()
+    distractor_matrix = np.stack([
+        extract_face_features(encode_jpeg(synthetic_identity(rng))) for _ in range(args.distractors)
+    ])
+    probe_features = [extract_face_features(probe) for probe in probes]
+
+    for size in sorted(int(s) for s in args.sizes.split(",")):
+        fillers = max(0, size - len(registered))
+        keys = registered_keys + [f"filler_{i}" for i in range(fillers)]
+        matrix = np.concatenate([registered_matrix, jittered_encodings(distractor_matrix, fillers, rng)])
+        gallery = GalleryIndex.from_matrix(keys, matrix, **main.GALLERY_OPTIONS)
+        gallery.build_ann()
+        with main.gallery_lock:
+            main.gallery = gallery
+            main.gallery_generation += 1
+
+        main.predict_face(probe_features[0])
+        durations, predictions = timed(main.predict_face, probe_features)
+        correct = sum(name == f"bench_user_{i}" for (name, _), i in zip(predictions, probe_ids))
+        record(latency_summary("predict_face", durations, gallery_users=len(gallery),
+                               gallery_templates=gallery.template_count, accuracy=correct / len(probes)))
+
+        def recognize(contents):
+            return client.post("/recognize_face", files={"file": ("probe.jpg", contents, "image/jpeg")}).json()
+
+        durations, responses = timed(recognize, probes)
+        outcomes = {}
+        for response in responses:
+            outcomes[response.get("status")] = outcomes.get(response.get("status"), 0) + 1
+        record(latency_summary("recognize_face", durations, gallery_users=len(gallery), outcomes=outcomes))
+        del gallery, matrix
+
+    main.storage.close()
+    output = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "gallery_options": {k: v for k, v in main.GALLERY_OPTIONS.items() if k != "projection"},
+            "projection_dims": main.GALLERY_OPTIONS["projection"].dims if main.GALLERY_OPTIONS["projection"] else None,
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if args.output == "-":
+        json.dump(output, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_benchmark())
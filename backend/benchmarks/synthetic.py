@@ -0,0 +1,101 @@
+"""Synthetic face photos and descriptors for benchmarks.
+
+Each identity is a grayscale photo of a drawn face (hair, face oval,
+brows, eye sockets, nose, mouth) that the Haar cascade detects, with
+identity-specific proportions, tones and skin texture. Captures of an
+identity are augmented with small shifts, rotation, exposure changes and
+sensor noise, and are described with the real extraction pipeline, so
+descriptors have the same statistics (sparse edge histogram, LBP
+distribution) as real ones.
+"""
+import os
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import features  # noqa: E402
+from gallery import template_key  # noqa: E402
+
+SIZE = 240
+
+
+def synthetic_identity(rng: np.random.Generator, size: int = SIZE) -> np.ndarray:
+    """One identity's canonical size x size face photo"""
+    scale = size / SIZE
+    center = size // 2
+
+    def px(value):
+        return int(round(value * scale))
+
+    image = np.full((size, size), rng.uniform(30, 110), dtype=np.float32)
+    skin = float(rng.uniform(140, 210))
+    face_axes = (px(rng.uniform(56, 68)), px(rng.uniform(76, 88)))
+    cv2.ellipse(image, (center, center - px(10)), (face_axes[0] + px(16), face_axes[1] + px(18)), 0, 0, 360,
+                float(rng.uniform(20, 80)), -1)
+    cv2.ellipse(image, (center, center + px(5)), face_axes, 0, 0, 360, skin, -1)
+
+    eye_y = center - px(rng.uniform(14, 22))
+    eye_dx = px(rng.uniform(22, 30))
+    eye_width = rng.uniform(8, 12)
+    brow_height, brow_offset = rng.uniform(3, 6), rng.uniform(13, 18)
+    for side in (-1, 1):
+        eye_x = center + side * eye_dx
+        cv2.ellipse(image, (eye_x, eye_y), (px(20), px(12)), 0, 0, 360, skin - rng.uniform(40, 60), -1)
+        cv2.ellipse(image, (eye_x, eye_y - px(brow_offset)), (px(18), px(brow_height)), 0, 0, 360,
+                    skin - rng.uniform(90, 120), -1)
+        cv2.ellipse(image, (eye_x, eye_y), (px(eye_width), px(eye_width / 2)), 0, 0, 360,
+                    skin - rng.uniform(100, 130), -1)
+    cv2.ellipse(image, (center, center + px(rng.uniform(8, 16))), (px(rng.uniform(6, 12)), px(6)), 0, 0, 360,
+                skin - rng.uniform(30, 50), -1)
+    cv2.ellipse(image, (center, center + px(rng.uniform(36, 48))), (px(rng.uniform(16, 30)), px(rng.uniform(4, 8))),
+                0, 0, 360, skin - rng.uniform(70, 110), -1)
+
+    texture = cv2.GaussianBlur(rng.normal(0, 1, (size, size)).astype(np.float32), (0, 0), rng.uniform(2, 5))
+    image += rng.uniform(8, 20) * texture / (np.abs(texture).max() + 1e-6)
+    return np.clip(cv2.GaussianBlur(image, (0, 0), 1.5 * scale), 0, 255).astype(np.uint8)
+
+
+def augment(face: np.ndarray, rng: np.random.Generator, strength: float = 1.0) -> np.ndarray:
+    """Another capture of the same face: small shift/rotation, exposure change and noise"""
+    height, width = face.shape
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), rng.uniform(-4, 4) * strength, 1.0)
+    matrix[:, 2] += rng.uniform(-0.02, 0.02, 2) * strength * np.array([width, height])
+    moved = cv2.warpAffine(face, matrix, (width, height), borderMode=cv2.BORDER_REFLECT)
+    # The histogram descriptors are not lighting invariant; keep exposure changes small
+    gain = 1 + rng.uniform(-0.01, 0.01) * strength
+    bias = rng.uniform(-1, 1) * strength
+    noisy = moved.astype(np.float32) * gain + bias + rng.normal(0, 2 * strength, moved.shape)
+    return np.clip(noisy, 0, 255).astype(np.uint8)
+
+
+def encode_jpeg(image: np.ndarray, quality: int = 90) -> bytes:
+    """JPEG bytes, as a client would upload them"""
+    return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+
+def describe(face: np.ndarray) -> np.ndarray:
+    """Descriptor of a synthetic photo through the full pipeline (detection included)"""
+    features_vector = features.extract_face_features(face)
+    if features_vector is None:
+        raise ValueError("No face detected in a synthetic photo")
+    return features_vector
+
+
+def synthetic_gallery(users: int, samples: int, rng: np.random.Generator):
+    """Returns (template keys, descriptor matrix, identity photos) for users x samples templates"""
+    identities = [synthetic_identity(rng) for _ in range(users)]
+    keys, rows = [], []
+    for i, face in enumerate(identities):
+        for sample in range(samples):
+            keys.append(template_key(f"user_{i}", sample))
+            rows.append(describe(augment(face, rng)))
+    return keys, np.stack(rows), identities
+
+
+def jittered_encodings(matrix: np.ndarray, count: int, rng: np.random.Generator) -> np.ndarray:
+    """count descriptors jittered around the rows of matrix, for galleries too large to extract"""
+    rows = matrix[rng.integers(0, len(matrix), count)]
+    return rows * (1 + 0.05 * rng.standard_normal(rows.shape, dtype=np.float32))
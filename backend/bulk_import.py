@@ -0,0 +1,130 @@
+"""Bulk user enrollment from a ZIP archive or directory of photos.
+
+Every image file (.jpg, .jpeg or .png, at any depth) registers one user
+named after the file: ``Jane Doe.jpg`` becomes ``jane_doe``. An optional
+CSV with a ``username`` column and any of ``email``, ``department`` and
+``role`` fills in the users' details.
+
+The server takes the same input at POST /users/import. The CLI works on
+the dataset in the working directory, so stop the server first, or run it
+with ATTEND_SHARED_GALLERY=on so its workers pick up the new users.
+
+Usage (from the backend directory):
+    python bulk_import.py photos.zip|photos/ [--csv details.csv] [--output report.json]
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import zipfile
+from typing import Dict, Iterator, Optional, Tuple
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+METADATA_FIELDS = ("email", "department", "role")
+# Larger entries are reported instead of read (guards against archive bombs)
+MAX_IMAGE_BYTES = 20 * 2 ** 20
+
+
+def normalize_username(name: str) -> str:
+    """Username for a display name or file stem, as /register_user normalizes it"""
+    return name.strip().lower().replace(" ", "_")
+
+
+def is_image_entry(path: str) -> bool:
+    """Image files, skipping hidden files and macOS resource forks"""
+    parts = path.replace("\\", "/").split("/")
+    return (os.path.splitext(parts[-1])[1].lower() in IMAGE_EXTENSIONS
+            and not any(part.startswith(".") or part == "__MACOSX" for part in parts))
+
+
+def iter_images(source) -> Iterator[Tuple[str, Optional[bytes]]]:
+    """Yield (entry name, image bytes) one file at a time from a directory or a ZIP path/file object.
+
+    Entries over MAX_IMAGE_BYTES are yielded with None instead of their bytes.
+    """
+    if isinstance(source, str) and os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                entry = os.path.relpath(path, source)
+                if not is_image_entry(entry):
+                    continue
+                with open(path, "rb") as f:
+                    yield entry, read_capped(f)
+        return
+
+    with zipfile.ZipFile(source) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or not is_image_entry(info.filename):
+                continue
+            # file_size comes from the (uploaded) archive's header, so the inflated stream is capped itself
+            with archive.open(info) as f:
+                yield info.filename, read_capped(f)
+
+
+def read_capped(f) -> Optional[bytes]:
+    """Read a file object, or return None once it runs past MAX_IMAGE_BYTES"""
+    data = f.read(MAX_IMAGE_BYTES + 1)
+    return data if len(data) <= MAX_IMAGE_BYTES else None
+
+
+def entry_username(entry: str) -> str:
+    return normalize_username(os.path.splitext(os.path.basename(entry.replace("\\", "/")))[0])
+
+
+def read_metadata(source) -> Dict[str, dict]:
+    """{username: {email, department, role}} from a CSV path or text file object"""
+    if isinstance(source, str):
+        with open(source, newline="", encoding="utf-8-sig") as f:
+            return read_metadata(f)
+
+    reader = csv.DictReader(source)
+    # Header names are matched case-insensitively
+    columns = {field.strip().lower(): field for field in reader.fieldnames or []}
+    if "username" not in columns:
+        raise ValueError("Details CSV needs a 'username' column")
+    metadata = {}
+    for row in reader:
+        values = {field: (row.get(column) or "").strip() for field, column in columns.items()}
+        if values["username"]:
+            metadata[normalize_username(values["username"])] = {
+                field: values.get(field, "") for field in METADATA_FIELDS
+            }
+    return metadata
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="ZIP archive or directory of username.jpg photos")
+    parser.add_argument("--csv", help="user details: username plus any of email, department, role")
+    parser.add_argument("--output", default="-", help="JSON report file ('-' for stdout)")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.source) and not zipfile.is_zipfile(args.source):
+        parser.error(f"{args.source} is neither a directory nor a ZIP archive")
+    metadata = read_metadata(args.csv) if args.csv else {}
+
+    # Imported here: loading the server module opens the dataset in the working directory
+    import main as server
+
+    report = server.import_users(iter_images(args.source), metadata)
+    if server.job_scheduler.active("rebuild"):
+        # This process exits before the debounced rebuild would run
+        server.rebuild_gallery()
+    server.job_scheduler.shutdown()
+    server.storage.close()
+
+    print(f"Imported {report['imported']} of {report['files']} photos ({report['failed']} failed)", file=sys.stderr)
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0 if report["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
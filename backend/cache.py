@@ -0,0 +1,92 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+
+# (username or None, confidence) as returned by predict_face
+Match = Tuple[Optional[str], float]
+
+
+class RecognitionCache:
+    """Bounded LRU cache of recognition work, keyed by a hash of the uploaded bytes.
+
+    An entry holds the extracted features (None when no face was found
+    or the face failed the quality gate), the face's quality report and
+    the match computed against one gallery generation. Features do
+    not depend on the gallery, so after the gallery changes an entry
+    still saves decode, detection and extraction; only its match is
+    dropped and recomputed. Entries expire ttl seconds after insertion.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.feature_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def digest(contents: bytes) -> bytes:
+        return hashlib.blake2b(contents, digest_size=16).digest()
+
+    def get(self, digest: bytes, generation: int) -> Optional[Tuple[Optional[np.ndarray], Optional[dict], Optional[Match]]]:
+        """Return (features, quality, match) for a cached upload, or None on a miss.
+
+        match is None when it was computed against another gallery generation.
+        """
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._entries[digest]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            _, features, quality, entry_generation, match = entry
+            if features is not None and entry_generation != generation:
+                self.feature_hits += 1
+                return features, quality, None
+            self.hits += 1
+            return features, quality, match
+
+    def put(self, digest: bytes, generation: int, features: Optional[np.ndarray], match: Optional[Match],
+            quality: Optional[dict] = None) -> None:
+        if not self.enabled:
+            return
+        if features is not None:
+            features = np.array(features, dtype=np.float32)
+            features.flags.writeable = False
+        with self._lock:
+            self._entries[digest] = (time.monotonic(), features, quality, generation, match)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.feature_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "feature_hits": self.feature_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.feature_hits) / lookups if lookups else 0.0
+            }
@@ -0,0 +1,314 @@
+import argparse
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STORE_FORMAT = "attend-encodings"
+STORE_VERSION = 1
+
+# Rewrite the store once tombstoned rows outnumber live ones (and at least this many)
+COMPACT_MIN_TOMBSTONES = 64
+
+
+class EncodingStore:
+    """Binary on-disk store for face encodings.
+
+    The store is two files in the dataset directory:
+
+    - ``{name}.{generation}.npy``: float32 matrix of shape (capacity, dim),
+      opened as a memory map so startup never parses encodings.
+    - ``{name}.rows.jsonl``: a versioned header line followed by a row log.
+      ``{"row": i, "username": u}`` assigns a matrix row to a user and
+      ``{"row": i, "username": u, "deleted": true}`` tombstones it.
+
+    Single-user changes append one matrix row and one log line. Full rewrites
+    (retrain, compaction, growth) write a new matrix generation first and then
+    atomically replace the row log, which is the commit point.
+
+    The header records the feature_version the encodings were extracted
+    with, so callers can tell when a full re-extraction is needed.
+    """
+
+    def __init__(self, directory: str, name: str = "face_encodings", feature_version: Optional[str] = None):
+        self.directory = directory
+        self.name = name
+        self.feature_version = feature_version
+        self.index_path = os.path.join(directory, f"{name}.rows.jsonl")
+        # Why the last load() failed; the store is read-only until it loads or is moved aside
+        self.load_error: Optional[str] = None
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._header: Optional[dict] = None
+        self._matrix: Optional[np.ndarray] = None
+        self._rows: Dict[str, int] = {}
+        self._next_row = 0
+        self._tombstones = 0
+
+    def exists(self) -> bool:
+        return os.path.exists(self.index_path)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @property
+    def header(self) -> Optional[dict]:
+        return dict(self._header) if self._header else None
+
+    @property
+    def read_only(self) -> bool:
+        """True when the store on disk failed to load, so writing would discard its rows"""
+        return self.load_error is not None and self.exists()
+
+    def _check_writable(self) -> None:
+        if self.read_only:
+            raise RuntimeError(f"Encoding store {self.index_path} failed to load ({self.load_error}); refusing to write")
+
+    @property
+    def stored_feature_version(self) -> Optional[str]:
+        """Feature version recorded in the loaded header, if any"""
+        return self._header.get("feature_version") if self._header else None
+
+    def load(self) -> Tuple[List[str], np.ndarray]:
+        """Map the matrix and replay the row log; returns live usernames and their rows"""
+        with self._lock:
+            try:
+                loaded = self._load()
+            except Exception as e:
+                self._reset()
+                self.load_error = str(e)
+                raise
+            self.load_error = None
+            return loaded
+
+    def _load(self) -> Tuple[List[str], np.ndarray]:
+        self._reset()
+        if not self.exists():
+            return [], np.zeros((0, 0), dtype=np.float32)
+
+        truncated = False
+        with open(self.index_path, "r") as f:
+            header = json.loads(f.readline())
+            if header.get("format") != STORE_FORMAT:
+                raise ValueError(f"{self.index_path} is not an encoding store")
+            if header.get("version", 0) > STORE_VERSION:
+                raise ValueError(
+                    f"{self.index_path} has store version {header['version']}, "
+                    f"this build reads up to {STORE_VERSION}"
+                )
+
+            for line_number, line in enumerate(f, start=2):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn final write from a crash; everything before it is intact
+                    logger.warning(f"Ignoring truncated entry at {self.index_path}:{line_number}")
+                    truncated = True
+                    break
+                self._apply(entry)
+
+        self._header = header
+        self._matrix = np.load(os.path.join(self.directory, header["matrix"]), mmap_mode="r+")
+        self._next_row = min(self._next_row, self._matrix.shape[0])
+        self._rows = {u: r for u, r in self._rows.items() if r < self._next_row}
+        if truncated:
+            # Rewrite so later appends do not land after the torn line
+            self.compact()
+
+        usernames = list(self._rows)
+        rows = np.fromiter(self._rows.values(), dtype=np.int64, count=len(usernames))
+        return usernames, np.asarray(self._matrix[rows])
+
+    def _apply(self, entry: dict) -> None:
+        """Replay one row-log entry into the in-memory row map"""
+        username, row = entry["username"], entry["row"]
+        if entry.get("deleted"):
+            if self._rows.get(username) == row:
+                del self._rows[username]
+            self._tombstones += 1
+        else:
+            if username in self._rows:
+                self._tombstones += 1
+            self._rows[username] = row
+        self._next_row = max(self._next_row, row + 1)
+
+    def append(self, username: str, encoding) -> None:
+        """Store a new encoding for username, superseding any previous row"""
+        self.append_many({username: encoding})
+
+    def append_many(self, encodings: Dict[str, np.ndarray]) -> None:
+        """Store several encodings with one row-log write, superseding any previous rows"""
+        vectors = [(u, np.asarray(e, dtype=np.float32).ravel()) for u, e in encodings.items()]
+        if not vectors:
+            return
+        with self._lock:
+            if self._header is None:
+                if self.exists():
+                    # Starting from empty here would replace every stored row with these
+                    self._check_writable()
+                    raise RuntimeError(f"Encoding store {self.index_path} was not loaded; refusing to write")
+                dim = vectors[0][1].shape[0]
+                self._rewrite([], np.zeros((0, dim), dtype=np.float32), feature_version=self.feature_version)
+            for _, vector in vectors:
+                if vector.shape[0] != self._header["dim"]:
+                    raise ValueError(f"Encoding has {vector.shape[0]} dims, store expects {self._header['dim']}")
+            if self._next_row + len(vectors) > self._matrix.shape[0]:
+                self.compact(capacity=max(64, 2 * (len(self._rows) + len(vectors))))
+
+            entries = []
+            for row, (username, vector) in enumerate(vectors, start=self._next_row):
+                self._matrix[row] = vector
+                entries.append({"row": row, "username": username})
+            self._matrix.flush()
+            self._append_log(*entries)
+            for entry in entries:
+                self._apply(entry)
+
+    def remove(self, username: str) -> bool:
+        """Tombstone the row for username, returning False if it is not stored"""
+        with self._lock:
+            row = self._rows.get(username)
+            if row is None:
+                return False
+
+            entry = {"row": row, "username": username, "deleted": True}
+            self._append_log(entry)
+            self._apply(entry)
+
+            if self._tombstones >= max(COMPACT_MIN_TOMBSTONES, len(self._rows)):
+                self.compact()
+            return True
+
+    def replace_all(self, encodings: Dict[str, np.ndarray], feature_version: Optional[str] = None) -> None:
+        """Atomically replace the whole store, e.g. after a full retrain"""
+        usernames = list(encodings)
+        if usernames:
+            matrix = np.stack([np.asarray(encodings[u], dtype=np.float32).ravel() for u in usernames])
+        else:
+            dim = self._header["dim"] if self._header else 0
+            matrix = np.zeros((0, dim), dtype=np.float32)
+        with self._lock:
+            self._check_writable()
+            if self._header is None and self.exists():
+                # The next generation number comes from the loaded header; guessing it could
+                # overwrite the live matrix file
+                raise RuntimeError(f"Encoding store {self.index_path} was not loaded; refusing to replace it")
+            self._rewrite(usernames, matrix, feature_version=feature_version or self.feature_version)
+
+    def compact(self, capacity: Optional[int] = None) -> None:
+        """Rewrite the store without tombstoned rows"""
+        with self._lock:
+            if self._header is None:
+                return
+            usernames = list(self._rows)
+            rows = np.fromiter(self._rows.values(), dtype=np.int64, count=len(usernames))
+            self._rewrite(usernames, np.asarray(self._matrix[rows]), capacity, self.stored_feature_version)
+
+    def to_dict(self) -> Dict[str, list]:
+        """Export live encodings as a {username: encoding list} mapping"""
+        with self._lock:
+            return {u: self._matrix[r].tolist() for u, r in self._rows.items()}
+
+    def export_json(self, json_path: str) -> int:
+        """Write live encodings in the legacy face_encodings.json layout"""
+        encodings = self.to_dict()
+        with open(json_path, "w") as f:
+            json.dump(encodings, f, indent=2)
+        return len(encodings)
+
+    def import_json(self, json_path: str, feature_version: Optional[str] = None) -> int:
+        """Replace the store with encodings from a legacy face_encodings.json"""
+        with open(json_path, "r") as f:
+            encodings = json.load(f)
+        self.replace_all(encodings, feature_version)
+        return len(encodings)
+
+    def _append_log(self, *entries: dict) -> None:
+        with open(self.index_path, "a") as f:
+            f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _rewrite(
+        self,
+        usernames: List[str],
+        matrix: np.ndarray,
+        capacity: Optional[int] = None,
+        feature_version: Optional[str] = None,
+    ) -> None:
+        """Write a new matrix generation plus row log and switch to it"""
+        count, dim = matrix.shape
+        capacity = max(capacity or 0, 64, count)
+        generation = (self._header["generation"] + 1) if self._header else 1
+        matrix_name = f"{self.name}.{generation}.npy"
+        matrix_path = os.path.join(self.directory, matrix_name)
+
+        new_matrix = np.lib.format.open_memmap(matrix_path, mode="w+", dtype=np.float32, shape=(capacity, dim))
+        new_matrix[:count] = matrix
+        new_matrix.flush()
+
+        header = {
+            "format": STORE_FORMAT,
+            "version": STORE_VERSION,
+            "dtype": "float32",
+            "dim": dim,
+            "generation": generation,
+            "matrix": matrix_name,
+            "feature_version": feature_version,
+        }
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps(header) + "\n")
+            for row, username in enumerate(usernames):
+                f.write(json.dumps({"row": row, "username": username}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_path)
+
+        old_header = self._header
+        self._matrix = new_matrix
+        self._header = header
+        self._rows = {username: row for row, username in enumerate(usernames)}
+        self._next_row = count
+        self._tombstones = 0
+
+        if old_header and old_header["matrix"] != matrix_name:
+            try:
+                os.remove(os.path.join(self.directory, old_header["matrix"]))
+            except OSError as e:
+                # Still mapped elsewhere (Windows); it is unreferenced and safe to delete later
+                logger.warning(f"Could not remove old encoding matrix {old_header['matrix']}: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate face encodings between JSON and the binary store")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("json_path", help="legacy face_encodings.json file")
+    parser.add_argument("--dataset-dir", default="dataset")
+    args = parser.parse_args()
+
+    store = EncodingStore(args.dataset_dir)
+    try:
+        store.load()
+    except Exception as e:
+        raise SystemExit(f"Could not load the encoding store in {args.dataset_dir}: {e}")
+    if args.command == "import":
+        count = store.import_json(args.json_path)
+        print(f"Imported {count} encodings into {store.index_path}")
+    else:
+        count = store.export_json(args.json_path)
+        print(f"Exported {count} encodings to {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import contextlib
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from features import extract_face_with_quality
+
+# Process-pool entry points for feature extraction.
+# Workers import only this module and features: never main.py and its startup
+# (storage open, journal replay, gallery load).
+
+
+def init_extraction_worker():
+    """Process-pool initializer: one OpenCV thread per worker process to avoid oversubscription"""
+    cv2.setNumThreads(1)
+
+
+def extract_user_batch(batch: List[Tuple[str, str]], gate: bool = False) -> List[Tuple[str, Optional[np.ndarray], Optional[str]]]:
+    """Extract features for a chunk of (username, image_path) pairs.
+
+    Returns (username, features, error) triples; features is None when error is set.
+    New photos pass gate=True; retrains leave it off so stored enrollments are never dropped.
+    """
+    results = []
+    for username, image_path in batch:
+        if not os.path.exists(image_path):
+            results.append((username, None, "image not found"))
+            continue
+
+        face_features, quality = extract_face_with_quality(image_path, gate=gate)
+        if quality is None:
+            results.append((username, None, "no face detected"))
+        elif face_features is None:
+            results.append((username, None, f"low quality: {', '.join(quality['issues'])}"))
+        else:
+            results.append((username, face_features, None))
+    return results
+
+
+@contextlib.contextmanager
+def _spawning_workers():
+    """Stand in for __main__ while pool workers are spawned.
+
+    spawn re-runs the parent's __main__ module in every child; under `python main.py`
+    that would be the whole API module.
+    """
+    main_module = sys.modules["__main__"]
+    sys.modules["__main__"] = sys.modules[__name__]
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main_module
+
+
+def extract_parallel(jobs: List[tuple], collect: Callable, workers: int, chunk_size: int, gate: bool = False):
+    """Extract (key, image_path) jobs in chunks across up to workers processes.
+
+    Each chunk's (key, features, error) results are passed to collect as it completes.
+    gate applies the face quality gate (see extract_user_batch).
+    """
+    chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+    if workers <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            collect(extract_user_batch(chunk, gate))
+        return
+
+    # spawn rather than fork: forking a threaded server process can deadlock in the child
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=context, initializer=init_extraction_worker) as executor:
+        # The executor starts a spawn worker per submit until the pool is full
+        with _spawning_workers():
+            futures = [executor.submit(extract_user_batch, chunk, gate) for chunk in chunks]
+        for future in as_completed(futures):
+            collect(future.result())
@@ -0,0 +1,406 @@
+import logging
+import os
+import threading
+from typing import List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+from metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Face pipeline shared by the API process and the retrain worker processes.
+# Keep this module free of app state so process-pool workers can import it cheaply.
+face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+
+# LBP neighbours as (row offset, column offset, bit), clockwise from top-left
+LBP_NEIGHBORS = (
+    (-1, -1, 7),
+    (-1, 0, 6),
+    (-1, 1, 5),
+    (0, 1, 4),
+    (1, 1, 3),
+    (1, 0, 2),
+    (1, -1, 1),
+    (0, -1, 0),
+)
+
+def _rotate_right_8(code: int, shift: int) -> int:
+    """Rotate an 8-bit code right by shift positions"""
+    return ((code >> shift) | (code << (8 - shift))) & 0xFF
+
+def _bit_transitions(code: int) -> int:
+    """Count 0/1 transitions in a circular 8-bit pattern"""
+    return bin(code ^ _rotate_right_8(code, 1)).count("1")
+
+def _build_lbp_lookup(method: str) -> Optional[np.ndarray]:
+    """Build a 256-entry code mapping for the requested LBP variant"""
+    if method == "default":
+        return None
+    
+    codes = range(256)
+    if method == "uniform":
+        # 58 uniform patterns get their own label, everything else shares label 58
+        uniform_codes = [code for code in codes if _bit_transitions(code) <= 2]
+        lookup = np.full(256, len(uniform_codes), dtype=np.uint8)
+        for label, code in enumerate(uniform_codes):
+            lookup[code] = label
+        return lookup
+    if method == "ror":
+        # Rotation invariant: smallest value over all circular rotations
+        return np.array(
+            [min(_rotate_right_8(code, shift) for shift in range(8)) for code in codes],
+            dtype=np.uint8
+        )
+    if method == "riu2":
+        # Rotation invariant uniform: number of set bits, non-uniform patterns map to 9
+        return np.array(
+            [bin(code).count("1") if _bit_transitions(code) <= 2 else 9 for code in codes],
+            dtype=np.uint8
+        )
+    raise ValueError(f"Unknown LBP method: {method}")
+
+LBP_METHODS = ("default", "uniform", "ror", "riu2")
+LBP_LOOKUPS = {method: _build_lbp_lookup(method) for method in LBP_METHODS}
+
+# Changing the LBP variant changes every encoding (see FEATURE_VERSION below)
+LBP_METHOD = os.environ.get("ATTEND_LBP_METHOD", "default")
+if LBP_METHOD not in LBP_LOOKUPS:
+    raise ValueError(f"ATTEND_LBP_METHOD must be one of {LBP_METHODS}, got {LBP_METHOD!r}")
+
+# Optional CLAHE (contrast limited adaptive histogram equalization) of the face crop before
+# the histograms are computed, evening out uneven or dim lighting. Like the LBP variant it
+# changes every encoding. CLAHE_TILES is the grid size over the 100x100 crop.
+FACE_CLAHE = os.environ.get("ATTEND_FACE_CLAHE", "off") == "on"
+CLAHE_CLIP_LIMIT = float(os.environ.get("ATTEND_CLAHE_CLIP_LIMIT", "2.0"))
+CLAHE_TILES = int(os.environ.get("ATTEND_CLAHE_TILES", "4"))
+
+# Which face a single-face extraction describes when the detector finds several: "first" (the
+# detector's first box) or "largest" (by box area). "largest" changes which face some stored
+# photos were described from, so it changes the feature version too.
+FACE_SELECT = os.environ.get("ATTEND_FACE_SELECT", "first")
+if FACE_SELECT not in ("first", "largest"):
+    raise ValueError(f"ATTEND_FACE_SELECT must be 'first' or 'largest', got {FACE_SELECT!r}")
+
+# Identifies the feature pipeline; bump the prefix whenever extract_face_features changes output.
+# Stored encodings with a different version are re-extracted by a full retrain.
+FEATURE_VERSION = (
+    f"1-lbp-{LBP_METHOD}"
+    + (f"-clahe{CLAHE_CLIP_LIMIT:g}x{CLAHE_TILES}" if FACE_CLAHE else "")
+    + ("-largest" if FACE_SELECT == "largest" else "")
+)
+LEGACY_FEATURE_VERSION = "1-lbp-default"
+
+def compute_lbp(image: np.ndarray, method: str = "default") -> np.ndarray:
+    """Compute the 8-neighbour LBP code image using shifted array slices.
+    
+    Border pixels are left at 0, matching the original per-pixel loop, so the
+    "default" histogram is bit-identical to encodings stored by older versions.
+    """
+    height, width = image.shape
+    lbp = np.zeros_like(image, dtype=np.uint8)
+    if height < 3 or width < 3:
+        return lbp
+    
+    center = image[1:-1, 1:-1]
+    codes = lbp[1:-1, 1:-1]
+    for dy, dx, bit in LBP_NEIGHBORS:
+        neighbor = image[1 + dy:height - 1 + dy, 1 + dx:width - 1 + dx]
+        codes |= (neighbor >= center).astype(np.uint8) << bit
+    
+    lookup = LBP_LOOKUPS[method]
+    if lookup is not None:
+        codes[...] = lookup[codes]
+    
+    return lbp
+
+# An image path, encoded image bytes (e.g. an upload buffer) or a decoded BGR/grayscale array
+ImageSource = Union[str, bytes, bytearray, memoryview, np.ndarray]
+
+def describe_image(image: ImageSource) -> str:
+    """Short label for log messages"""
+    if isinstance(image, str):
+        return image
+    if isinstance(image, np.ndarray):
+        return f"<array {image.shape}>"
+    return f"<{len(image)} bytes>"
+
+def load_grayscale(image: ImageSource) -> Optional[np.ndarray]:
+    """Decode an image source to an 8-bit grayscale array without touching disk for in-memory input"""
+    if isinstance(image, np.ndarray):
+        if image.ndim == 2:
+            return image
+        img = image
+    elif isinstance(image, str):
+        img = cv2.imread(image)
+    else:
+        # Wraps the upload buffer without copying; imdecode reads it directly
+        buffer = np.frombuffer(image, dtype=np.uint8)
+        img = cv2.imdecode(buffer, cv2.IMREAD_COLOR) if buffer.size else None
+    
+    if img is None:
+        return None
+    
+    # Decode in color then convert, exactly like cv2.imread + cvtColor, so encodings stay comparable
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+# Face detection: "haar" (the bundled cascade) or "yunet" (OpenCV's DNN face detector,
+# loaded from a local ONNX file given by ATTEND_YUNET_MODEL; needs OpenCV >= 4.5.4).
+# Images are downscaled so their longer side is at most DETECT_MAX_SIDE (0 disables)
+# before detection and the boxes are mapped back to full resolution for description.
+DETECTORS = ("haar", "yunet")
+DETECTOR = os.environ.get("ATTEND_DETECTOR", "haar")
+if DETECTOR not in DETECTORS:
+    raise ValueError(f"ATTEND_DETECTOR must be one of {DETECTORS}, got {DETECTOR!r}")
+DETECT_MAX_SIDE = int(os.environ.get("ATTEND_DETECT_MAX_SIDE", "1024"))
+# Haar settings; DETECT_MIN_SIZE is in full-resolution pixels (0 uses the cascade window)
+DETECT_SCALE_FACTOR = float(os.environ.get("ATTEND_DETECT_SCALE_FACTOR", "1.3"))
+DETECT_MIN_NEIGHBORS = int(os.environ.get("ATTEND_DETECT_MIN_NEIGHBORS", "5"))
+DETECT_MIN_SIZE = int(os.environ.get("ATTEND_DETECT_MIN_SIZE", "0"))
+# YuNet settings
+YUNET_MODEL = os.environ.get("ATTEND_YUNET_MODEL", "")
+YUNET_SCORE_THRESHOLD = float(os.environ.get("ATTEND_YUNET_SCORE_THRESHOLD", "0.9"))
+YUNET_NMS_THRESHOLD = float(os.environ.get("ATTEND_YUNET_NMS_THRESHOLD", "0.3"))
+if DETECTOR == "yunet" and not os.path.exists(YUNET_MODEL):
+    raise ValueError(f"ATTEND_DETECTOR=yunet needs ATTEND_YUNET_MODEL to point at the ONNX model, got {YUNET_MODEL!r}")
+
+# FaceDetectorYN keeps its input size as state, so each thread gets its own instance
+_yunet_local = threading.local()
+
+def _yunet_detector(model_path: str):
+    detector = getattr(_yunet_local, "detector", None)
+    if detector is None or _yunet_local.model_path != model_path:
+        detector = cv2.FaceDetectorYN.create(
+            model_path, "", (320, 320), YUNET_SCORE_THRESHOLD, YUNET_NMS_THRESHOLD
+        )
+        _yunet_local.detector = detector
+        _yunet_local.model_path = model_path
+    return detector
+
+def _detect_haar(gray: np.ndarray, scale: float, scale_factor: float, min_neighbors: int,
+                 min_size: int) -> np.ndarray:
+    kwargs = {}
+    if min_size > 0:
+        scaled_min = max(1, int(round(min_size * scale)))
+        kwargs["minSize"] = (scaled_min, scaled_min)
+    faces = face_cascade.detectMultiScale(gray, scale_factor, min_neighbors, **kwargs)
+    return np.asarray(faces, dtype=np.float32).reshape(-1, 4)
+
+def _detect_yunet(gray: np.ndarray, model_path: str) -> np.ndarray:
+    detector = _yunet_detector(model_path)
+    height, width = gray.shape
+    detector.setInputSize((width, height))
+    _, faces = detector.detect(cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR))
+    if faces is None:
+        return np.zeros((0, 4), dtype=np.float32)
+    # Rows are x, y, w, h, five landmarks and a score, best first
+    return faces[:, :4].astype(np.float32)
+
+def detect_faces(gray: np.ndarray, detector: Optional[str] = None, max_side: Optional[int] = None,
+                 scale_factor: Optional[float] = None, min_neighbors: Optional[int] = None,
+                 min_size: Optional[int] = None, yunet_model: Optional[str] = None) -> np.ndarray:
+    """Detect face boxes as an (n, 4) array of x, y, w, h in full-resolution coordinates.
+    
+    Arguments left as None use the ATTEND_DETECT_* / ATTEND_DETECTOR configuration.
+    """
+    detector = detector or DETECTOR
+    max_side = DETECT_MAX_SIDE if max_side is None else max_side
+    
+    height, width = gray.shape
+    scale = 1.0
+    small = gray
+    if max_side and max(height, width) > max_side:
+        scale = max_side / max(height, width)
+        small = cv2.resize(gray, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    
+    if detector == "yunet":
+        boxes = _detect_yunet(small, yunet_model or YUNET_MODEL)
+    else:
+        boxes = _detect_haar(
+            small,
+            scale,
+            DETECT_SCALE_FACTOR if scale_factor is None else scale_factor,
+            DETECT_MIN_NEIGHBORS if min_neighbors is None else min_neighbors,
+            DETECT_MIN_SIZE if min_size is None else min_size
+        )
+    
+    if scale != 1.0:
+        boxes = boxes / scale
+    # Map back and clip so every box slices a non-empty region of the full image
+    boxes = np.rint(boxes).astype(np.int32)
+    x0 = np.clip(boxes[:, 0], 0, width - 1)
+    y0 = np.clip(boxes[:, 1], 0, height - 1)
+    x1 = np.clip(boxes[:, 0] + boxes[:, 2], x0 + 1, width)
+    y1 = np.clip(boxes[:, 1] + boxes[:, 3], y0 + 1, height)
+    return np.stack([x0, y0, x1 - x0, y1 - y0], axis=1).astype(np.int32)
+
+# Face quality gate, applied before description so poor frames are turned away without
+# describing or matching them. Size is the shorter side of the face box in image pixels;
+# sharpness (variance of the Laplacian) and brightness (mean gray level) are measured on
+# the 100x100 crop the descriptor is built from. The measurements are always reported; only
+# ATTEND_QUALITY_GATE=on turns faces away. Descriptors are the same either way.
+QUALITY_GATE = os.environ.get("ATTEND_QUALITY_GATE", "off") == "on"
+QUALITY_MIN_FACE = int(os.environ.get("ATTEND_QUALITY_MIN_FACE", "48"))
+QUALITY_MIN_SHARPNESS = float(os.environ.get("ATTEND_QUALITY_MIN_SHARPNESS", "25"))
+QUALITY_MIN_BRIGHTNESS = float(os.environ.get("ATTEND_QUALITY_MIN_BRIGHTNESS", "40"))
+QUALITY_MAX_BRIGHTNESS = float(os.environ.get("ATTEND_QUALITY_MAX_BRIGHTNESS", "215"))
+
+FACE_SIZE = (100, 100)
+
+# CLAHE objects keep working buffers, so each thread gets its own instance
+_clahe_local = threading.local()
+
+def _clahe():
+    clahe = getattr(_clahe_local, "clahe", None)
+    if clahe is None:
+        clahe = cv2.createCLAHE(clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=(CLAHE_TILES, CLAHE_TILES))
+        _clahe_local.clahe = clahe
+    return clahe
+
+def crop_face(gray: np.ndarray, box) -> np.ndarray:
+    """Cut one face box out of the image, resized to the standard 100x100 descriptor input"""
+    (x, y, w, h) = box
+    return cv2.resize(gray[y:y+h, x:x+w], FACE_SIZE)
+
+def assess_face_quality(face_resized: np.ndarray, face_size: int) -> dict:
+    """Score a face crop on size, sharpness and exposure.
+    
+    Each measure maps to 0..1 with 0.5 at its threshold and 1 at twice the margin;
+    score is the weakest of them, so a face passes exactly when score >= 0.5.
+    """
+    laplacian = cv2.Laplacian(face_resized, cv2.CV_32F)
+    sharpness = float(cv2.meanStdDev(laplacian)[1][0, 0]) ** 2
+    brightness = float(cv2.mean(face_resized)[0])
+    
+    mid = (QUALITY_MIN_BRIGHTNESS + QUALITY_MAX_BRIGHTNESS) / 2
+    half_range = max((QUALITY_MAX_BRIGHTNESS - QUALITY_MIN_BRIGHTNESS) / 2, 1e-7)
+    scores = np.clip([
+        face_size / (2 * QUALITY_MIN_FACE) if QUALITY_MIN_FACE > 0 else 1.0,
+        sharpness / (2 * QUALITY_MIN_SHARPNESS) if QUALITY_MIN_SHARPNESS > 0 else 1.0,
+        1 - abs(brightness - mid) / (2 * half_range),
+    ], 0.0, 1.0)
+    
+    issues = []
+    if face_size < QUALITY_MIN_FACE:
+        issues.append("face too small")
+    if sharpness < QUALITY_MIN_SHARPNESS:
+        issues.append("too blurry")
+    if brightness < QUALITY_MIN_BRIGHTNESS:
+        issues.append("too dark")
+    elif brightness > QUALITY_MAX_BRIGHTNESS:
+        issues.append("too bright")
+    
+    return {
+        "score": round(float(scores.min()), 3),
+        "passed": not issues,
+        "issues": issues,
+        "face_size": int(face_size),
+        "sharpness": round(sharpness, 1),
+        "brightness": round(brightness, 1)
+    }
+
+def describe_crop(face_resized: np.ndarray) -> np.ndarray:
+    """Build the normalized 768-d descriptor for one 100x100 face crop"""
+    with stage_timer("histogram"):
+        if FACE_CLAHE:
+            face_resized = _clahe().apply(face_resized)
+        
+        # 1. Histogram features
+        hist = cv2.calcHist([face_resized], [0], None, [256], [0, 256])
+        
+        # 3. Edge features
+        edges = cv2.Canny(face_resized, 50, 150)
+        edge_hist = cv2.calcHist([edges], [0], None, [256], [0, 256])
+    
+    with stage_timer("lbp"):
+        # 2. LBP (Local Binary Pattern) features
+        lbp = compute_lbp(face_resized, LBP_METHOD)
+        lbp_hist = cv2.calcHist([lbp], [0], None, [256], [0, 256])
+    
+    # Concatenate into a single vector and normalize
+    feature_vector = np.concatenate(
+        [hist.ravel(), lbp_hist.ravel(), edge_hist.ravel()]
+    ).astype(np.float32)
+    return feature_vector / (np.linalg.norm(feature_vector) + 1e-7)
+
+def describe_face(gray: np.ndarray, box) -> np.ndarray:
+    """Build the normalized 768-d descriptor for one face box"""
+    return describe_crop(crop_face(gray, box))
+
+def extract_face_with_quality(image: ImageSource, gate: bool = QUALITY_GATE) -> Tuple[Optional[np.ndarray], Optional[dict]]:
+    """Extract features for one detected face (see FACE_SELECT) along with its quality report.
+    
+    Returns (features, quality). quality is None when no face is found; features
+    is also None when gate is set and the face fails the quality check, which
+    happens before the descriptor is computed.
+    """
+    try:
+        # Read image and convert to grayscale
+        with stage_timer("decode"):
+            gray = load_grayscale(image)
+        if gray is None:
+            return None, None
+        
+        # Detect faces
+        with stage_timer("detect"):
+            faces = detect_faces(gray)
+        
+        if len(faces) == 0:
+            logger.debug(f"No faces detected in {describe_image(image)}")
+            return None, None
+        
+        # Detectors do not order their boxes by size
+        box = faces[np.argmax(faces[:, 2] * faces[:, 3])] if FACE_SELECT == "largest" else faces[0]
+        with stage_timer("quality"):
+            face_resized = crop_face(gray, box)
+            quality = assess_face_quality(face_resized, min(box[2], box[3]))
+        if gate and not quality["passed"]:
+            logger.debug(f"Face in {describe_image(image)} failed the quality gate: {', '.join(quality['issues'])}")
+            return None, quality
+        
+        return describe_crop(face_resized), quality
+    
+    except Exception as e:
+        logger.error(f"Error extracting face features from {describe_image(image)}: {e}")
+        return None, None
+
+def extract_face_features(image: ImageSource) -> Optional[np.ndarray]:
+    """Extract face features for one detected face (see FACE_SELECT), without the quality gate"""
+    return extract_face_with_quality(image, gate=False)[0]
+
+def extract_all_face_features(image: ImageSource) -> Tuple[np.ndarray, np.ndarray]:
+    """Extract descriptors for every detected face (e.g. a classroom group photo).
+    
+    Returns (boxes, features): an (n, 4) box array and an (n, 768) feature matrix.
+    Raises ValueError if the image cannot be decoded.
+    """
+    boxes, _, _, features = extract_all_faces_with_quality(image, gate=False)
+    return boxes, features
+
+def extract_all_faces_with_quality(image: ImageSource, gate: bool = QUALITY_GATE
+                                   ) -> Tuple[np.ndarray, List[dict], np.ndarray, np.ndarray]:
+    """Extract descriptors for every detected face that passes the quality gate.
+    
+    Returns (boxes, qualities, accepted, features): the (n, 4) boxes, a quality report
+    per box, a boolean mask of the boxes that were described (all of them unless gate
+    is set) and a feature matrix with one row per accepted box, in box order.
+    Raises ValueError if the image cannot be decoded.
+    """
+    with stage_timer("decode"):
+        gray = load_grayscale(image)
+    if gray is None:
+        raise ValueError(f"Could not decode image {describe_image(image)}")
+    
+    with stage_timer("detect"):
+        boxes = detect_faces(gray)
+    
+    with stage_timer("quality"):
+        crops = [crop_face(gray, box) for box in boxes]
+        qualities = [assess_face_quality(crop, min(box[2], box[3])) for crop, box in zip(crops, boxes)]
+    accepted = np.array([quality["passed"] or not gate for quality in qualities], dtype=bool)
+    
+    described = [describe_crop(crop) for crop, ok in zip(crops, accepted) if ok]
+    features = np.stack(described) if described else np.zeros((0, 768), dtype=np.float32)
+    return boxes, qualities, accepted, features
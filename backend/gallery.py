@@ -0,0 +1,604 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ann import IVFQuantizer
+
+# A user's extra enrollment samples are stored under "username#k" (k >= 1); the first
+# sample keeps the bare username, so single-sample galleries and stores stay unchanged
+TEMPLATE_SEPARATOR = "#"
+AGGREGATIONS = ("max", "mean_topk")
+ANN_BACKENDS = ("none", "ivf")
+DTYPES = ("float32", "float16", "int8")
+# Quantized galleries are dequantized this many rows at a time while scoring
+SCORE_CHUNK = 8192
+
+
+def template_key(username: str, sample: int = 0) -> str:
+    """Gallery/store key for one enrollment sample of username"""
+    return username if sample == 0 else f"{username}{TEMPLATE_SEPARATOR}{sample}"
+
+
+def template_owner(key: str) -> str:
+    """Username a template key belongs to"""
+    return key.split(TEMPLATE_SEPARATOR, 1)[0]
+
+
+def template_sample(key: str) -> int:
+    """Sample number encoded in a template key"""
+    _, _, sample = key.partition(TEMPLATE_SEPARATOR)
+    return int(sample) if sample else 0
+
+
+class GalleryIndex:
+    """In-memory face gallery backed by one contiguous float32 matrix.
+
+    Row i of the matrix holds the L2-normalized encoding of template keys[i];
+    a user owns one or more templates (see template_key). Adds append into
+    spare capacity (amortized O(1)) and removes move the last row into the
+    freed slot (O(1)), so the live rows always stay packed in matrix[:size]
+    and matching is a single matrix-vector product.
+
+    A (users, width) slot table lists each user's template rows (-1 padded),
+    so per-user aggregation of template similarities is one gather plus a
+    max (or mean of the top_k) along the slot axis. Scores and top-2 results
+    are per user, never per template.
+
+    With ann="ivf", build_ann() clusters the templates (once there are at
+    least ann_min_size) and reorders the rows so each list is a contiguous
+    block; top2 then scores only the blocks of the nprobe closest lists.
+    Rows added after the build form an always-scanned tail and rows that a
+    removal moved out of their block are tracked separately, so nothing is
+    missed until the next build. When the probed rows cover fewer than two
+    users the search falls back to exact, so the runner-up used by the
+    confidence-gap rule always comes from a real candidate.
+
+    An optional projection (see projection.Projection) maps raw descriptors
+    to fewer dimensions before they are stored or matched, and dtype
+    "float16" or "int8" (symmetric, one scale per row) shrinks the stored
+    rows further. Face descriptors all lie close to one common direction,
+    so quantized galleries store each row's residual from the gallery
+    mean, which keeps the small differences that separate identities
+    (int8 residuals are also divided by their per-dimension spread);
+    residuals are dequantized in chunks while scoring.
+    """
+
+    def __init__(self, dim: Optional[int] = None, capacity: int = 64, aggregation: str = "max", top_k: int = 2,
+                 ann: str = "none", nprobe: int = 8, nlist: int = 0, ann_min_size: int = 20000,
+                 projection=None, dtype: str = "float32"):
+        if aggregation not in AGGREGATIONS:
+            raise ValueError(f"Unknown template aggregation {aggregation!r} (expected one of {AGGREGATIONS})")
+        if ann not in ANN_BACKENDS:
+            raise ValueError(f"Unknown ANN backend {ann!r} (expected one of {ANN_BACKENDS})")
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown gallery dtype {dtype!r} (expected one of {DTYPES})")
+        self.projection = projection
+        self.dtype = dtype
+        self.dim = projection.dims if projection is not None else dim
+        self.aggregation = aggregation
+        self.top_k = max(1, top_k)
+        self.ann = ann
+        self.nprobe = max(1, nprobe)
+        self.nlist = nlist
+        self.ann_min_size = ann_min_size
+        self._quantizer: Optional[IVFQuantizer] = None
+        # List blocks of the rows sorted at build time, and sorted rows now outside their block
+        self._ivf_offsets = np.zeros(1, dtype=np.int64)
+        self._ivf_sorted = 0
+        self._ivf_misplaced = set()
+        self._capacity = capacity
+        self._matrix = np.zeros((capacity, self.dim), dtype=dtype) if self.dim else None
+        self._inv_scales = np.ones(capacity, dtype=np.float32)
+        self._center: Optional[np.ndarray] = None
+        self._spread: Optional[np.ndarray] = None
+        self._keys: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._row_users = np.zeros(capacity, dtype=np.int64)
+        self._row_clusters = np.zeros(capacity, dtype=np.int32)
+        self._usernames: List[str] = []
+        self._user_ids: Dict[str, int] = {}
+        self._slots = np.full((capacity, 1), -1, dtype=np.int64)
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_encodings(cls, encodings: Dict[str, list], **options) -> "GalleryIndex":
+        """Build an index from a {template key: encoding} mapping"""
+        if encodings:
+            # One pass, so quantized galleries get the mean of all rows as their residual base
+            rows = [np.asarray(encoding, dtype=np.float32).ravel() for encoding in encodings.values()]
+            return cls.from_matrix(list(encodings), np.stack(rows), **options)
+        return cls(**options)
+
+    @classmethod
+    def from_matrix(cls, keys: List[str], matrix: np.ndarray, **options) -> "GalleryIndex":
+        """Build an index from parallel template-key and encoding-row arrays"""
+        matrix = np.asarray(matrix, dtype=np.float32)
+        index = cls(dim=matrix.shape[1] if len(keys) else None, capacity=max(64, len(keys)), **options)
+        if len(keys):
+            prepared = index._prepare(matrix)
+            if index.dtype != "float32":
+                index._center = prepared.mean(axis=0)
+            if index.dtype == "int8":
+                index._spread = np.maximum((prepared - index._center).std(axis=0), 1e-6)
+            index._matrix[:len(keys)], index._inv_scales[:len(keys)] = index._encode(prepared)
+            for row, key in enumerate(keys):
+                index._keys.append(key)
+                index._rows[key] = row
+                index._attach(row, template_owner(key))
+        return index
+
+    @classmethod
+    def from_state(cls, keys: List[str], arrays: Dict[str, np.ndarray], **options) -> "GalleryIndex":
+        """Rebuild an index from state() output without copying its rows.
+
+        The row arrays may be read-only memory maps; they are copied into
+        private memory only if the index is changed.
+        """
+        index = cls(capacity=max(1, len(keys)), **options)
+        if not len(keys):
+            return index
+        matrix = arrays["matrix"]
+        if matrix.dtype != np.dtype(index.dtype) or (index.dim is not None and matrix.shape[1] != index.dim):
+            raise ValueError(
+                f"Stored gallery rows are {matrix.dtype} x {matrix.shape[1]}, "
+                f"expected {index.dtype} x {index.dim}"
+            )
+        index.dim = matrix.shape[1]
+        index._capacity = len(keys)
+        index._matrix = matrix
+        index._inv_scales = arrays["inv_scales"]
+        index._center = arrays.get("center")
+        index._spread = arrays.get("spread")
+        for row, key in enumerate(keys):
+            index._keys.append(key)
+            index._rows[key] = row
+            index._attach(row, template_owner(key))
+        index._row_clusters[:len(keys)] = arrays["row_clusters"]
+        if "centroids" in arrays:
+            index._quantizer = IVFQuantizer(arrays["centroids"])
+            index._ivf_offsets = np.array(arrays["ivf_offsets"])
+            index._ivf_sorted = int(arrays["ivf_sorted"])
+            index._ivf_misplaced = set(arrays["ivf_misplaced"].tolist())
+        return index
+
+    def state(self) -> Tuple[List[str], Dict[str, np.ndarray]]:
+        """Template keys and the arrays from_state() needs (stored rows, residual base, IVF lists)"""
+        with self._lock:
+            size = len(self._keys)
+            matrix = self._matrix if self._matrix is not None else np.zeros((0, self.dim or 0), dtype=self.dtype)
+            arrays = {
+                "matrix": matrix[:size],
+                "inv_scales": self._inv_scales[:size],
+                "row_clusters": self._row_clusters[:size],
+            }
+            if self._center is not None:
+                arrays["center"] = self._center
+            if self._spread is not None:
+                arrays["spread"] = self._spread
+            if self._quantizer is not None:
+                arrays["centroids"] = self._quantizer.centroids
+                arrays["ivf_offsets"] = self._ivf_offsets
+                arrays["ivf_sorted"] = np.array(self._ivf_sorted)
+                arrays["ivf_misplaced"] = np.array(sorted(self._ivf_misplaced), dtype=np.int64)
+            return list(self._keys), arrays
+
+    def __len__(self) -> int:
+        """Number of enrolled users"""
+        return len(self._usernames)
+
+    def __contains__(self, username: str) -> bool:
+        return username in self._user_ids
+
+    @property
+    def usernames(self) -> List[str]:
+        return list(self._usernames)
+
+    @property
+    def keys(self) -> List[str]:
+        """Template key of every live row"""
+        return list(self._keys)
+
+    @property
+    def template_count(self) -> int:
+        return len(self._keys)
+
+    @property
+    def ann_active(self) -> bool:
+        return self._quantizer is not None
+
+    @property
+    def bytes_per_template(self) -> int:
+        """Memory per stored template row"""
+        itemsize = np.dtype(self.dtype).itemsize
+        return (self.dim or 0) * itemsize + (4 if self.dtype == "int8" else 0)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Live template rows as float32 (a view, unless quantized; do not mutate)"""
+        if self._matrix is None:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        size = len(self._keys)
+        if self.dtype == "float32" or size == 0:
+            return self._matrix[:size].astype(np.float32, copy=False)
+        return self._dequantize(self._matrix[:size], self._inv_scales[:size, None])
+
+    def templates(self, username: str) -> List[str]:
+        """Template keys enrolled for username, in sample order"""
+        with self._lock:
+            user_id = self._user_ids.get(username)
+            if user_id is None:
+                return []
+            rows = self._slots[user_id]
+            return sorted((self._keys[row] for row in rows[rows >= 0]), key=template_sample)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Return a copy of the stored (projected, dequantized) encoding for a template key"""
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                return None
+            if self.dtype == "float32":
+                return self._matrix[row].copy()
+            return self._dequantize(self._matrix[row], self._inv_scales[row])
+
+    def template_scores(self, username: str, face_features: np.ndarray) -> Dict[str, float]:
+        """Similarity of a raw descriptor to each of username's templates"""
+        with self._lock:
+            keys = self.templates(username)
+            if not keys:
+                return {}
+            rows = np.array([self._rows[key] for key in keys])
+            similarities = self._dot_rows(rows, self._prepare(face_features)[0])
+            return {key: float(similarity) for key, similarity in zip(keys, similarities)}
+
+    def add(self, key: str, encoding) -> None:
+        """Insert or replace the encoding for a template key"""
+        vector = self._prepare(encoding)[0]
+
+        with self._lock:
+            if self._matrix is None:
+                self.dim = vector.shape[0]
+                self._matrix = np.zeros((self._capacity, self.dim), dtype=self.dtype)
+            self._make_writable()
+            if self._center is None and self.dtype != "float32":
+                # Residual base for an index built empty; from_matrix uses the gallery mean
+                self._center = vector.copy()
+            elif vector.shape[0] != self.dim:
+                raise ValueError(f"Encoding has {vector.shape[0]} dims, gallery expects {self.dim}")
+
+            row = self._rows.get(key)
+            if row is None:
+                row = len(self._keys)
+                if row == self._matrix.shape[0]:
+                    self._grow()
+                self._keys.append(key)
+                self._rows[key] = row
+                self._attach(row, template_owner(key))
+            self._matrix[row], self._inv_scales[row] = self._encode(vector[None, :])
+            if self._quantizer is not None:
+                self._row_clusters[row] = self._quantizer.assign(vector)[0]
+                self._ivf_place(row)
+
+    def remove_template(self, key: str) -> bool:
+        """Remove one template, dropping its user once no templates remain"""
+        with self._lock:
+            if key not in self._rows:
+                return False
+            self._make_writable()
+            row = self._rows.pop(key)
+
+            user_id = self._row_users[row]
+            user_slots = self._slots[user_id]
+            user_slots[user_slots == row] = -1
+
+            last = len(self._keys) - 1
+            if row != last:
+                moved = self._keys[last]
+                moved_user = self._row_users[last]
+                self._matrix[row] = self._matrix[last]
+                self._inv_scales[row] = self._inv_scales[last]
+                self._keys[row] = moved
+                self._rows[moved] = row
+                self._row_users[row] = moved_user
+                self._row_clusters[row] = self._row_clusters[last]
+                self._ivf_place(row)
+                moved_slots = self._slots[moved_user]
+                moved_slots[moved_slots == last] = row
+            self._keys.pop()
+            self._ivf_misplaced.discard(last)
+
+            if not (user_slots >= 0).any():
+                self._detach_user(user_id)
+            return True
+
+    def remove(self, username: str) -> bool:
+        """Remove username and all of its templates, returning False if it was not enrolled"""
+        with self._lock:
+            keys = self.templates(username)
+            for key in keys:
+                self.remove_template(key)
+            return bool(keys)
+
+    def build_ann(self) -> bool:
+        """Fit the IVF lists over the current templates; returns whether ANN search is active"""
+        with self._lock:
+            if self.ann != "ivf" or self.template_count < max(2, self.ann_min_size):
+                self._quantizer = None
+                return False
+            self._make_writable()
+            quantizer = IVFQuantizer.fit(self.matrix, self.nlist or None)
+            assignment = quantizer.assign(self.matrix)
+
+            # Sort rows by list so probing a list scores one contiguous block
+            size = self.template_count
+            order = np.argsort(assignment, kind="stable")
+            self._matrix[:size] = self._matrix[order]
+            self._inv_scales[:size] = self._inv_scales[order]
+            self._keys = [self._keys[row] for row in order]
+            self._rows = {key: row for row, key in enumerate(self._keys)}
+            self._row_users[:size] = self._row_users[order]
+            self._row_clusters[:size] = assignment[order]
+            new_rows = np.empty(size, dtype=np.int64)
+            new_rows[order] = np.arange(size)
+            used = self._slots >= 0
+            self._slots[used] = new_rows[self._slots[used]]
+
+            self._ivf_offsets = np.searchsorted(self._row_clusters[:size], np.arange(quantizer.nlist + 1))
+            self._ivf_sorted = size
+            self._ivf_misplaced = set()
+            self._quantizer = quantizer
+            return True
+
+    def _ivf_place(self, row: int) -> None:
+        """Track whether a sorted-region row still holds a template of its block's list"""
+        if row >= self._ivf_sorted:
+            return
+        block = np.searchsorted(self._ivf_offsets, row, side="right") - 1
+        if self._row_clusters[row] == block:
+            self._ivf_misplaced.discard(row)
+        else:
+            self._ivf_misplaced.add(row)
+
+    def user_scores(self, similarities: np.ndarray) -> np.ndarray:
+        """Aggregate per-template similarities (rows first) into per-user scores"""
+        size = len(self._usernames)
+        slots = self._slots[:size]
+        if slots.shape[1] == 1:
+            # Every user has exactly one template
+            return similarities[slots[:, 0]]
+
+        # Padding slots (-1) pick the appended -inf row
+        padding = np.full((1,) + similarities.shape[1:], -np.inf, dtype=similarities.dtype)
+        gathered = np.concatenate([similarities, padding])[slots]  # (users, width[, queries])
+        if self.aggregation == "max":
+            return gathered.max(axis=1)
+
+        k = min(self.top_k, slots.shape[1])
+        top = -np.partition(-gathered, k - 1, axis=1)[:, :k]
+        valid = np.isfinite(top)
+        return np.where(valid, top, 0.0).sum(axis=1) / valid.sum(axis=1)
+
+    def scores(self, face_features: np.ndarray) -> np.ndarray:
+        """Cosine similarity of face_features against every enrolled user"""
+        query = self._prepare(face_features)[0]
+        return self.user_scores(self._dot(0, len(self._keys), query))
+
+    def top2(self, face_features: np.ndarray) -> Tuple[Optional[str], float, float]:
+        """Return (best username, best similarity, second-best user's similarity)"""
+        with self._lock:
+            size = len(self._usernames)
+            if size == 0:
+                return None, 0.0, 0.0
+
+            if self._quantizer is not None and self.nprobe < self._quantizer.nlist:
+                result = self._top2_ann(face_features)
+                if result is not None:
+                    return result
+
+            similarities = self.scores(face_features)
+            if size == 1:
+                return self._usernames[0], float(similarities[0]), 0.0
+
+            top = np.argpartition(similarities, size - 2)[-2:]
+            first, second = (top[1], top[0]) if similarities[top[1]] >= similarities[top[0]] else (top[0], top[1])
+            return self._usernames[first], float(similarities[first]), float(similarities[second])
+
+    def top2_batch(self, queries: np.ndarray) -> Tuple[List[Optional[str]], np.ndarray, np.ndarray]:
+        """Match many faces at once with one matrix-matrix product.
+
+        Returns (best usernames, best similarities, second-best similarities),
+        one entry per query row.
+        """
+        with self._lock:
+            queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+            size = len(self._usernames)
+            count = len(queries)
+            if size == 0 or count == 0:
+                return [None] * count, np.zeros(count, dtype=np.float32), np.zeros(count, dtype=np.float32)
+
+            if self._quantizer is not None and self.nprobe < self._quantizer.nlist:
+                # Every query probes its own lists
+                names, best, second = zip(*(self.top2(query) for query in queries))
+                return list(names), np.array(best, dtype=np.float32), np.array(second, dtype=np.float32)
+
+            similarities = self.user_scores(self._dot(0, len(self._keys), self._prepare(queries).T))  # (size, count)
+            if size == 1:
+                return [self._usernames[0]] * count, similarities[0].copy(), np.zeros(count, dtype=np.float32)
+
+            top = np.argpartition(similarities, size - 2, axis=0)[-2:]  # (2, count)
+            top_scores = np.take_along_axis(similarities, top, axis=0)
+            order = np.argsort(-top_scores, axis=0)
+            top = np.take_along_axis(top, order, axis=0)
+            top_scores = np.take_along_axis(top_scores, order, axis=0)
+            return [self._usernames[row] for row in top[0]], top_scores[0], top_scores[1]
+
+    def _top2_ann(self, face_features: np.ndarray) -> Optional[Tuple[str, float, float]]:
+        """top2 over the rows in the probed IVF lists, or None to fall back to exact search"""
+        query = self._prepare(face_features)[0]
+        if not query.any():
+            return None
+
+        clusters = self._quantizer.probe(query, self.nprobe)
+        size = self.template_count
+        rows, similarities = [], []
+        for cluster in clusters:
+            start, stop = self._ivf_offsets[cluster], min(self._ivf_offsets[cluster + 1], size)
+            if start < stop:
+                rows.append(np.arange(start, stop))
+                similarities.append(self._dot(start, stop, query))
+        if size > self._ivf_sorted:
+            rows.append(np.arange(self._ivf_sorted, size))
+            similarities.append(self._dot(self._ivf_sorted, size, query))
+        if self._ivf_misplaced:
+            # Moved rows whose list is probed but whose block is not
+            moved = np.fromiter(self._ivf_misplaced, dtype=np.int64, count=len(self._ivf_misplaced))
+            blocks = np.searchsorted(self._ivf_offsets, moved, side="right") - 1
+            moved = moved[np.isin(self._row_clusters[moved], clusters) & ~np.isin(blocks, clusters)]
+            rows.append(moved)
+            similarities.append(self._dot_rows(moved, query))
+        if not rows:
+            return None
+
+        candidates = np.concatenate(rows)
+        if len(candidates) == 0:
+            return None
+        users, scores = self._aggregate_rows(self._row_users[candidates], np.concatenate(similarities))
+        if len(users) < 2:
+            return None
+
+        top = np.argpartition(scores, len(scores) - 2)[-2:]
+        first, second = (top[1], top[0]) if scores[top[1]] >= scores[top[0]] else (top[0], top[1])
+        return self._usernames[users[first]], float(scores[first]), float(scores[second])
+
+    def _aggregate_rows(self, owners: np.ndarray, similarities: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Per-user aggregate of a subset of template similarities; returns (user ids, scores)"""
+        order = np.lexsort((-similarities, owners))
+        owners, similarities = owners[order], similarities[order]
+        starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+        if self.aggregation == "max":
+            return owners[starts], similarities[starts]
+
+        # Rank within each user's run (sorted best first) and average the top_k
+        lengths = np.diff(np.r_[starts, len(owners)])
+        ranks = np.arange(len(owners)) - np.repeat(starts, lengths)
+        keep = ranks < self.top_k
+        totals = np.add.reduceat(np.where(keep, similarities, 0.0), starts)
+        return owners[starts], totals / np.add.reduceat(keep.astype(np.int64), starts)
+
+    def to_dict(self) -> Dict[str, list]:
+        """Export as a {template key: stored encoding list} mapping"""
+        with self._lock:
+            return {key: self.get(key).tolist() for key in self._rows}
+
+    def _prepare(self, vectors) -> np.ndarray:
+        """Project (if configured) and L2-normalize raw descriptors, one per row"""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if self.projection is not None:
+            if vectors.shape[1] != self.projection.input_dim:
+                raise ValueError(
+                    f"Encoding has {vectors.shape[1]} dims, projection expects {self.projection.input_dim}"
+                )
+            vectors = self.projection.transform(vectors)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1.0)
+
+    def _encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Convert normalized rows to the storage dtype; returns (rows, per-row inverse scales)"""
+        if self.dtype == "float32":
+            return vectors, np.ones(len(vectors), dtype=np.float32)
+        vectors = vectors - self._center
+        if self.dtype == "int8":
+            if self._spread is not None:
+                vectors = vectors / self._spread
+            peaks = np.abs(vectors).max(axis=1)
+            scales = 127.0 / np.where(peaks > 0, peaks, 1.0)
+            return np.rint(vectors * scales[:, None]).astype(np.int8), (1.0 / scales).astype(np.float32)
+        return vectors.astype(self.dtype), np.ones(len(vectors), dtype=np.float32)
+
+    def _dequantize(self, rows: np.ndarray, inv_scales) -> np.ndarray:
+        """Float32 encodings from stored residual rows"""
+        residuals = rows.astype(np.float32) * inv_scales
+        if self._spread is not None:
+            residuals *= self._spread
+        return residuals + self._center
+
+    def _residual_queries(self, queries: np.ndarray) -> np.ndarray:
+        """Queries with the per-dimension int8 spread folded in, so stored rows are used as-is"""
+        if self._spread is None:
+            return queries
+        return queries * (self._spread if queries.ndim == 1 else self._spread[:, None])
+
+    def _dot(self, start: int, stop: int, queries: np.ndarray) -> np.ndarray:
+        """Similarities of rows start:stop to normalized queries ((dim,) or (dim, count))"""
+        if self.dtype == "float32":
+            return self._matrix[start:stop] @ queries
+        residual_queries = self._residual_queries(queries)
+        parts = []
+        for chunk in range(start, stop, SCORE_CHUNK):
+            end = min(chunk + SCORE_CHUNK, stop)
+            scales = self._inv_scales[chunk:end]
+            similarities = self._matrix[chunk:end].astype(np.float32) @ residual_queries
+            parts.append(similarities * (scales if queries.ndim == 1 else scales[:, None]))
+        if not parts:
+            return np.zeros((0,) + queries.shape[1:], dtype=np.float32)
+        return np.concatenate(parts) + self._center @ queries
+
+    def _dot_rows(self, rows: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """Similarities of selected rows to normalized queries"""
+        if self.dtype == "float32":
+            return self._matrix[rows] @ queries
+        similarities = self._matrix[rows].astype(np.float32) @ self._residual_queries(queries)
+        scales = self._inv_scales[rows] if queries.ndim == 1 else self._inv_scales[rows][:, None]
+        return similarities * scales + self._center @ queries
+
+    def _attach(self, row: int, username: str) -> None:
+        """Record row as one of username's templates, registering the user if new"""
+        if row >= len(self._row_users):
+            self._row_users = np.concatenate([self._row_users, np.zeros(len(self._row_users), dtype=np.int64)])
+            self._row_clusters = np.concatenate([self._row_clusters, np.zeros(len(self._row_clusters), dtype=np.int32)])
+
+        user_id = self._user_ids.get(username)
+        if user_id is None:
+            user_id = len(self._usernames)
+            if user_id == self._slots.shape[0]:
+                self._slots = np.concatenate([self._slots, np.full_like(self._slots, -1)])
+            self._usernames.append(username)
+            self._user_ids[username] = user_id
+
+        free = np.flatnonzero(self._slots[user_id] < 0)
+        if len(free) == 0:
+            widened = np.full((self._slots.shape[0], self._slots.shape[1] + 1), -1, dtype=np.int64)
+            widened[:, :-1] = self._slots
+            self._slots = widened
+            free = [self._slots.shape[1] - 1]
+        self._slots[user_id, free[0]] = row
+        self._row_users[row] = user_id
+
+    def _detach_user(self, user_id: int) -> None:
+        """Drop a user with no templates left, moving the last user into its id"""
+        removed = self._usernames[user_id]
+        last = len(self._usernames) - 1
+        if user_id != last:
+            moved = self._usernames[last]
+            self._slots[user_id] = self._slots[last]
+            self._usernames[user_id] = moved
+            self._user_ids[moved] = user_id
+            moved_rows = self._slots[user_id]
+            self._row_users[moved_rows[moved_rows >= 0]] = user_id
+        self._slots[last] = -1
+        self._usernames.pop()
+        del self._user_ids[removed]
+
+    def _make_writable(self) -> None:
+        """Copy rows adopted from read-only memory maps before changing them"""
+        if self._matrix is not None and not self._matrix.flags.writeable:
+            self._matrix = np.array(self._matrix)
+            self._inv_scales = np.array(self._inv_scales)
+
+    def _grow(self) -> None:
+        capacity = self._matrix.shape[0]
+        grown = np.zeros((capacity * 2, self.dim), dtype=self.dtype)
+        grown[:capacity] = self._matrix
+        self._matrix = grown
+        self._inv_scales = np.concatenate([self._inv_scales, np.ones(capacity, dtype=np.float32)])
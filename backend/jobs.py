@@ -0,0 +1,170 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """One scheduled run of a maintenance task"""
+
+    def __init__(self, job_id: int, kind: str, func: Callable, run_at: float, deadline: float):
+        self.id = job_id
+        self.kind = kind
+        self.func = func
+        self.state = "queued"
+        # Submissions coalesced into this run
+        self.requests = 1
+        self.submitted_at = time.time()
+        # Monotonic time the job may start at; debouncing pushes it back, never past deadline
+        self.run_at = run_at
+        self.deadline = deadline
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result = None
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        now = time.monotonic()
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "requests": self.requests,
+            "submitted_at": self.submitted_at,
+            "starts_in_seconds": round(max(0.0, self.run_at - now), 1) if self.state == "queued" else None,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "duration_seconds": (
+                round(self.finished_at - self.started_at, 3) if self.finished_at and self.started_at else None
+            ),
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobScheduler:
+    """Runs maintenance jobs (retrains, rebuilds, imports, compaction) one at a time.
+
+    Jobs run in start-time order on one background thread, so they never
+    overlap each other. Submitting a kind that already has a queued job
+    coalesces into it: the queued job runs the newest function, and a
+    delay (debounce) pushes its start back, but never past max_delay
+    after its first submission. Submitting while that kind is running
+    queues a fresh job for after it, so a request is never dropped.
+    """
+
+    def __init__(self, history: int = 50):
+        self._queue: List[Job] = []
+        self._running: Optional[Job] = None
+        self._history: deque = deque(maxlen=history)
+        self._next_id = 1
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self.completed: Dict[str, int] = {state: 0 for state in ("succeeded", "failed", "cancelled")}
+
+    def submit(self, kind: str, func: Callable, delay: float = 0.0, max_delay: Optional[float] = None,
+               coalesce: bool = True) -> Job:
+        """Queue func as a kind job starting delay seconds from now, or coalesce into a queued one.
+
+        Jobs that each carry their own input (e.g. an uploaded archive) pass coalesce=False.
+        """
+        now = time.monotonic()
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("Job scheduler is shut down")
+            job = next((job for job in self._queue if job.kind == kind), None) if coalesce else None
+            if job is None:
+                deadline = now + max(delay, max_delay) if max_delay is not None else float("inf")
+                job = Job(self._next_id, kind, func, now + delay, deadline)
+                self._next_id += 1
+                self._queue.append(job)
+            else:
+                job.func = func
+                job.requests += 1
+                job.run_at = min(max(job.run_at, now + delay), job.deadline)
+            if self._thread is None:
+                # Started on first use, so importing the module never spawns threads
+                self._thread = threading.Thread(target=self._work, name="jobs", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+            return job
+
+    def get(self, job_id: int) -> Optional[Job]:
+        with self._cond:
+            for job in self._jobs():
+                if job.id == job_id:
+                    return job
+        return None
+
+    def active(self, kind: str) -> bool:
+        """True while a kind job is queued or running"""
+        with self._cond:
+            return any(job.kind == kind for job in self._queue) or (
+                self._running is not None and self._running.kind == kind
+            )
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "running": self._running.to_dict() if self._running else None,
+                "queue_depth": len(self._queue),
+                "queued": [job.to_dict() for job in sorted(self._queue, key=lambda job: job.run_at)],
+                "completed": dict(self.completed),
+                "history": [job.to_dict() for job in self._history],
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Cancel queued jobs and stop the worker after the running job"""
+        with self._cond:
+            self._stopping = True
+            for job in self._queue:
+                self._finish(job, "cancelled")
+            self._queue = []
+            self._cond.notify()
+            thread = self._thread
+        if wait and thread is not None:
+            thread.join()
+
+    def _jobs(self) -> List[Job]:
+        return self._queue + ([self._running] if self._running else []) + list(self._history)
+
+    def _finish(self, job: Job, state: str) -> None:
+        job.state = state
+        job.finished_at = time.time()
+        self.completed[state] += 1
+        self._history.appendleft(job)
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopping:
+                        return
+                    now = time.monotonic()
+                    due = min(self._queue, key=lambda job: job.run_at, default=None)
+                    if due is not None and due.run_at <= now:
+                        break
+                    self._cond.wait(timeout=due.run_at - now if due is not None else None)
+                self._queue.remove(due)
+                due.state = "running"
+                due.started_at = time.time()
+                self._running = due
+
+            state = "succeeded"
+            try:
+                due.result = due.func()
+            except Exception as e:
+                logger.error(f"Job {due.kind} #{due.id} failed: {e}")
+                due.error = str(e)
+                state = "failed"
+            with self._cond:
+                self._running = None
+                self._finish(due, state)
@@ -1,14 +1,41 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Query, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-import cv2
+from fastapi.responses import Response, StreamingResponse
 import numpy as np
-import json
 import os
-from datetime import datetime
+import csv
+import io
+import json
+from datetime import date as Date, datetime
 import logging
 from typing import List, Dict, Optional
 import threading
+import multiprocessing
 import time
+import asyncio
+import functools
+import itertools
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from bulk_import import entry_username, iter_images, read_metadata
+from cache import RecognitionCache
+from extraction import extract_parallel
+from features import (
+    FEATURE_VERSION,
+    LEGACY_FEATURE_VERSION,
+    QUALITY_GATE,
+    extract_all_faces_with_quality,
+    extract_face_with_quality,
+)
+from jobs import JobScheduler
+from gallery import GalleryIndex, template_key, template_owner, template_sample
+from metrics import CONTENT_TYPE, REGISTRY, TRAINING_BUCKETS, Callback, Counter, Histogram, stage_timer
+from projection import load_projection
+from storage import ATTENDANCE_FIELDS, empty_summary, open_storage
+from streaming import StreamSession
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -25,242 +52,1040 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global variables
-face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-face_encodings_db = {}
-is_training = False
-training_thread = None
-
 # Directories
 UPLOAD_DIR = "uploads"
 DATASET_DIR = "dataset"
+# Extra enrollment samples live in uploads/samples/{username}/{sample}.jpg
+SAMPLES_DIR = os.path.join(UPLOAD_DIR, "samples")
 
 # Ensure directories exist
-for directory in [UPLOAD_DIR, DATASET_DIR]:
+for directory in [UPLOAD_DIR, DATASET_DIR, SAMPLES_DIR]:
     os.makedirs(directory, exist_ok=True)
 
-# Data storage files
-USERS_FILE = os.path.join(DATASET_DIR, "users.json")
-ATTENDANCE_FILE = os.path.join(DATASET_DIR, "attendance.json")
+# Multi-sample enrollment: each user keeps at most MAX_TEMPLATES encodings (the registration
+# photo plus extra samples) and matching aggregates a face's similarity to them per user
+MAX_TEMPLATES = int(os.environ.get("ATTEND_MAX_TEMPLATES", "5"))
+# Optional approximate search for very large galleries: ATTEND_ANN=ivf clusters the templates
+# into ATTEND_ANN_NLIST lists (0 = about sqrt(templates)) and scores only the ATTEND_ANN_NPROBE
+# closest ones per face. Galleries smaller than ATTEND_ANN_MIN_SIZE templates stay exact.
+GALLERY_OPTIONS = {
+    "aggregation": os.environ.get("ATTEND_TEMPLATE_AGGREGATION", "max"),
+    "top_k": int(os.environ.get("ATTEND_TEMPLATE_TOP_K", "2")),
+    "ann": os.environ.get("ATTEND_ANN", "none"),
+    "nprobe": int(os.environ.get("ATTEND_ANN_NPROBE", "8")),
+    "nlist": int(os.environ.get("ATTEND_ANN_NLIST", "0")),
+    "ann_min_size": int(os.environ.get("ATTEND_ANN_MIN_SIZE", "20000")),
+    # Reduced-dimension projection fitted offline (python projection.py) and kept in the dataset
+    # directory; ATTEND_PROJECTION=off matches on raw descriptors
+    "projection": (
+        load_projection(DATASET_DIR, FEATURE_VERSION) if os.environ.get("ATTEND_PROJECTION", "on") != "off" else None
+    ),
+    # "float16" or "int8" stores the gallery quantized: less memory per user, slower scoring
+    "dtype": os.environ.get("ATTEND_GALLERY_DTYPE", "float32"),
+}
+
+# Global variables
+# The live gallery is replaced wholesale by retrains; gallery_generation increases on every change
+gallery = GalleryIndex(**GALLERY_OPTIONS)
+gallery_generation = 0
+gallery_lock = threading.Lock()
+# Incremental changes made while a retrain or rebuild is building its index, replayed before the swap
+pending_gallery_changes = None
+# Serializes picking sample slots so concurrent uploads for one user do not collide
+samples_lock = threading.Lock()
+is_training = False
+training_progress = {}
+# Why the stored encodings failed to load at startup; while set, nothing may overwrite them
+encodings_load_error: Optional[str] = None
+
+# Data storage: "sqlite" (dataset/attend.db, migrated from the JSON files on first start)
+# or "json" (users.json, attendance.jsonl and the binary encoding store)
+STORAGE_BACKEND = os.environ.get("ATTEND_STORAGE", "sqlite")
+storage = open_storage(STORAGE_BACKEND, DATASET_DIR, FEATURE_VERSION, LEGACY_FEATURE_VERSION)
+encoding_store = storage.encodings
+# Legacy JSON encodings, imported into the encoding store on first startup
 ENCODINGS_FILE = os.path.join(DATASET_DIR, "face_encodings.json")
 
-def load_json_file(file_path: str, default_data=None):
-    """Load JSON file with error handling"""
-    if default_data is None:
-        default_data = []
+# Multi-worker serving (uvicorn main:app --workers N) needs ATTEND_SHARED_GALLERY=on: the gallery is
+# published as a snapshot in dataset/shared that every worker memory-maps read-only, enrollments and
+# deletions are appended to its change log for the other workers to replay (folded into a new snapshot
+# like a rebuild, after REBUILD_DELAY), and retrains run only in the worker holding the training lock
+SHARED_GALLERY = os.environ.get("ATTEND_SHARED_GALLERY", "off") == "on"
+if SHARED_GALLERY and STORAGE_BACKEND != "sqlite":
+    raise RuntimeError("ATTEND_SHARED_GALLERY=on needs ATTEND_STORAGE=sqlite; the JSON files are single-process")
+shared_gallery = None
+if SHARED_GALLERY:
+    from shared_gallery import SharedGallery
+    shared_gallery = SharedGallery(os.path.join(DATASET_DIR, "shared"))
+
+# Maintenance work (retrains, gallery rebuilds, compaction) runs one job at a time on a background
+# scheduler; GET /jobs shows the running job, the queue and recent history
+job_scheduler = JobScheduler(history=int(os.environ.get("ATTEND_JOB_HISTORY", "50")))
+# Enrollment changes are coalesced into one gallery rebuild ATTEND_REBUILD_DELAY seconds after the
+# last one (at most ATTEND_REBUILD_MAX_DELAY after the first), deletions into one storage compaction
+REBUILD_DELAY = float(os.environ.get("ATTEND_REBUILD_DELAY", "60"))
+REBUILD_MAX_DELAY = float(os.environ.get("ATTEND_REBUILD_MAX_DELAY", "600"))
+COMPACT_DELAY = float(os.environ.get("ATTEND_COMPACT_DELAY", "300"))
+
+# Attendance listings are paginated with an opaque cursor; exports stream EXPORT_BATCH_SIZE rows per query
+ATTENDANCE_PAGE_SIZE = int(os.environ.get("ATTEND_ATTENDANCE_PAGE_SIZE", "500"))
+ATTENDANCE_MAX_PAGE_SIZE = 5000
+EXPORT_BATCH_SIZE = 1000
+
+# Full retrain fans feature extraction out over a process pool
+TRAIN_WORKERS = int(os.environ.get("ATTEND_TRAIN_WORKERS", os.cpu_count() or 1))
+TRAIN_CHUNK_SIZE = int(os.environ.get("ATTEND_TRAIN_CHUNK_SIZE", "16"))
+
+# Minimum similarity for a match to count as recognized (65% for better user experience)
+CONFIDENCE_THRESHOLD = 0.65
+
+# Decode, detection, extraction and storage writes for register/recognize run on a bounded
+# thread pool (OpenCV and NumPy release the GIL) so the event loop stays responsive.
+# Requests beyond MAX_PENDING_JOBS (running + queued) get 503 with Retry-After.
+RECOGNITION_WORKERS = int(os.environ.get("ATTEND_RECOGNITION_WORKERS", os.cpu_count() or 1))
+MAX_PENDING_JOBS = int(os.environ.get("ATTEND_MAX_PENDING_JOBS", RECOGNITION_WORKERS * 4))
+RETRY_AFTER_SECONDS = 1
+recognition_executor = ThreadPoolExecutor(max_workers=RECOGNITION_WORKERS, thread_name_prefix="recognition")
+pending_blocking_jobs = 0
+
+# Streaming recognition runs face detection every Nth frame and tracks faces in between;
+# each track is matched until identified or STREAM_MAX_ATTEMPTS detections pass
+STREAM_DETECT_EVERY = int(os.environ.get("ATTEND_STREAM_DETECT_EVERY", "5"))
+STREAM_MAX_ATTEMPTS = int(os.environ.get("ATTEND_STREAM_MAX_ATTEMPTS", "3"))
+
+# Resubmissions of the exact same upload to /recognize_face reuse the cached features and,
+# while the gallery generation is unchanged, the cached match (size 0 disables the cache)
+recognition_cache = RecognitionCache(
+    max_entries=int(os.environ.get("ATTEND_RECOGNITION_CACHE_SIZE", "256")),
+    ttl=float(os.environ.get("ATTEND_RECOGNITION_CACHE_TTL", "30"))
+)
+
+# Prometheus metrics served at /metrics. Pipeline stages (read, decode, detect, quality, histogram,
+# lbp, match, attendance_write) are timed into attend_stage_seconds here and in features.
+RECOGNITIONS = REGISTRY.register(Counter(
+    "attend_recognitions_total", "Recognized faces by endpoint and outcome", labels=("endpoint", "outcome")
+))
+QUALITY_REJECTIONS = REGISTRY.register(Counter(
+    "attend_quality_rejections_total", "Faces turned away by the quality gate, by endpoint and issue",
+    labels=("endpoint", "issue")
+))
+AMBIGUOUS_MATCHES = REGISTRY.register(Counter(
+    "attend_ambiguous_matches_total", "Matches rejected by the top-2 confidence-gap rule"
+))
+TRAINING_SECONDS = REGISTRY.register(Histogram(
+    "attend_training_seconds", "Duration of completed full retrains", buckets=TRAINING_BUCKETS
+))
+REGISTRY.register(Callback("attend_gallery_users", "Users in the live gallery", lambda: len(gallery)))
+REGISTRY.register(Callback("attend_gallery_templates", "Templates in the live gallery", lambda: gallery.template_count))
+REGISTRY.register(Callback("attend_gallery_generation", "Live gallery generation", lambda: gallery_generation))
+REGISTRY.register(Callback("attend_pending_jobs", "Running and queued recognition jobs", lambda: pending_blocking_jobs))
+REGISTRY.register(Callback(
+    "attend_maintenance_jobs_queued", "Queued maintenance jobs", lambda: job_scheduler.queue_depth
+))
+REGISTRY.register(Callback(
+    "attend_recognition_cache_hits_total", "Cache hits that reused the match", lambda: recognition_cache.hits, "counter"
+))
+REGISTRY.register(Callback(
+    "attend_recognition_cache_feature_hits_total", "Cache hits that reused only the features",
+    lambda: recognition_cache.feature_hits, "counter"
+))
+REGISTRY.register(Callback(
+    "attend_recognition_cache_misses_total", "Cache misses", lambda: recognition_cache.misses, "counter"
+))
+
+def _update_training_progress(processed: int, failures: List[Dict]):
+    """Record retrain progress and a linear ETA for /model_status"""
+    elapsed = time.monotonic() - training_progress["started"]
+    remaining = training_progress["total"] - processed
+    training_progress.update({
+        "processed": processed,
+        "failed": len(failures),
+        "failures": failures[-20:],
+        "elapsed_seconds": round(elapsed, 1),
+        "eta_seconds": round(elapsed / processed * remaining, 1) if processed else None
+    })
+
+def extract_features_parallel(jobs: List[tuple], collect, gate: bool = False):
+    """Extract (template key, image_path) jobs across TRAIN_WORKERS processes (see extraction.extract_parallel)"""
+    extract_parallel(jobs, collect, TRAIN_WORKERS, TRAIN_CHUNK_SIZE, gate)
+
+def extract_all_features(jobs: List[tuple]) -> Dict[str, np.ndarray]:
+    """Extract features for (template key, image_path) pairs across TRAIN_WORKERS processes"""
+    global training_progress
+    training_progress = {"processed": 0, "total": len(jobs), "started": time.monotonic()}
     
-    if not os.path.exists(file_path):
-        with open(file_path, 'w') as f:
-            json.dump(default_data, f)
-        return default_data
+    encodings_db = {}
+    failures = []
+    processed = 0
     
-    try:
-        with open(file_path, 'r') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, Exception) as e:
-        logger.error(f"Error loading {file_path}: {e}")
-        return default_data
-
-def save_json_file(file_path: str, data):
-    """Save JSON file with error handling"""
-    try:
-        with open(file_path, 'w') as f:
-            json.dump(data, f, indent=2, default=str)
-    except Exception as e:
-        logger.error(f"Error saving {file_path}: {e}")
-
-def extract_face_features(image_path: str) -> Optional[np.ndarray]:
-    """Extract face features using OpenCV and basic image processing"""
-    try:
-        # Read image
-        img = cv2.imread(image_path)
-        if img is None:
-            return None
-        
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Detect faces
-        faces = face_cascade.detectMultiScale(gray, 1.3, 5)
-        
-        if len(faces) == 0:
-            logger.warning(f"No faces detected in {image_path}")
-            return None
-        
-        # Use the first (largest) face
-        (x, y, w, h) = faces[0]
-        face = gray[y:y+h, x:x+w]
-        
-        # Resize to standard size (100x100)
-        face_resized = cv2.resize(face, (100, 100))
-        
-        # Normalize pixel values
-        face_normalized = face_resized.astype('float32') / 255.0
-        
-        # Create feature vector using multiple methods
-        features = []
-        
-        # 1. Histogram features
-        hist = cv2.calcHist([face_resized], [0], None, [256], [0, 256])
-        features.extend(hist.flatten())
-        
-        # 2. LBP (Local Binary Pattern) features
-        def lbp_features(image):
-            lbp = np.zeros_like(image)
-            for i in range(1, image.shape[0]-1):
-                for j in range(1, image.shape[1]-1):
-                    center = image[i, j]
-                    code = 0
-                    code |= (image[i-1, j-1] >= center) << 7
-                    code |= (image[i-1, j] >= center) << 6
-                    code |= (image[i-1, j+1] >= center) << 5
-                    code |= (image[i, j+1] >= center) << 4
-                    code |= (image[i+1, j+1] >= center) << 3
-                    code |= (image[i+1, j] >= center) << 2
-                    code |= (image[i+1, j-1] >= center) << 1
-                    code |= (image[i, j-1] >= center) << 0
-                    lbp[i, j] = code
-            return lbp
-        
-        lbp = lbp_features(face_resized)
-        lbp_hist = cv2.calcHist([lbp], [0], None, [256], [0, 256])
-        features.extend(lbp_hist.flatten())
-        
-        # 3. Edge features
-        edges = cv2.Canny(face_resized, 50, 150)
-        edge_hist = cv2.calcHist([edges], [0], None, [256], [0, 256])
-        features.extend(edge_hist.flatten())
-        
-        # Convert to numpy array and normalize
-        feature_vector = np.array(features, dtype=np.float32)
-        feature_vector = feature_vector / (np.linalg.norm(feature_vector) + 1e-7)
-        
-        return feature_vector
+    def collect(results):
+        nonlocal processed
+        for username, face_features, error in results:
+            if face_features is None:
+                failures.append({"username": username, "error": error})
+            else:
+                encodings_db[username] = face_features
+        processed += len(results)
+        _update_training_progress(processed, failures)
     
-    except Exception as e:
-        logger.error(f"Error extracting face features from {image_path}: {e}")
-        return None
+    extract_features_parallel(jobs, collect)
+    
+    if failures:
+        logger.warning(f"Feature extraction failed for {len(failures)} of {len(jobs)} images")
+    return encodings_db
+
+def sync_shared_gallery():
+    """Catch the live gallery up with the shared snapshot and change log (gallery lock held)"""
+    global gallery, gallery_generation
+    loaded = shared_gallery.refresh(gallery, **GALLERY_OPTIONS)
+    if loaded is not None:
+        gallery_generation, gallery = loaded
 
-def cosine_similarity_simple(a, b):
-    """Calculate cosine similarity between two vectors"""
-    dot_product = np.dot(a, b)
-    norm_a = np.linalg.norm(a)
-    norm_b = np.linalg.norm(b)
+def publish_shared_change(change):
+    """Run change(index) against the up-to-date gallery and log the gallery changes it returns.
     
-    if norm_a == 0 or norm_b == 0:
-        return 0.0
+    change writes the store and returns ("add", key, features) / ("remove", username, None)
+    changes; only those are written to the shared change log, never the whole gallery.
+    """
+    global gallery_generation
+    with gallery_lock, shared_gallery.locked():
+        sync_shared_gallery()
+        gallery_generation = shared_gallery.append(gallery, change(gallery))
+    job_scheduler.submit("compact_gallery", compact_shared_gallery, delay=REBUILD_DELAY, max_delay=REBUILD_MAX_DELAY)
+
+def compact_shared_gallery() -> dict:
+    """Fold the shared change log into a new snapshot, so workers map every row again (runs as a "compact_gallery" job)"""
+    global gallery, gallery_generation
+    with gallery_lock, shared_gallery.locked():
+        sync_shared_gallery()
+        if not shared_gallery.pending_changes():
+            # Published meanwhile by a retrain, a rebuild or another worker's compaction
+            return {"skipped": "no logged changes"}
+        shared_gallery.publish(gallery, stored_feature_version())
+        gallery_generation, gallery = shared_gallery.load(**GALLERY_OPTIONS)
+    return {"templates": gallery.template_count, "generation": gallery_generation}
+
+def refresh_gallery():
+    """Pick up snapshots and changes other workers published"""
+    if shared_gallery is None or not shared_gallery.changed():
+        return
+    with gallery_lock:
+        if shared_gallery.changed():
+            sync_shared_gallery()
+
+def enroll_encoding(key: str, face_features: np.ndarray):
+    """Add or replace one template encoding in the live gallery and persist it"""
+    enroll_encodings({key: face_features})
+
+def enroll_encodings(encodings: Dict[str, np.ndarray]):
+    """Add or replace template encodings in the live gallery and persist them as one batch"""
+    global gallery_generation
+    check_encodings_writable()
+    if shared_gallery is not None:
+        def change(index):
+            encoding_store.append_many(encodings)
+            return [("add", key, face_features) for key, face_features in encodings.items()]
+        publish_shared_change(change)
+    else:
+        with gallery_lock:
+            encoding_store.append_many(encodings)
+            for key, face_features in encodings.items():
+                gallery.add(key, face_features)
+            gallery_generation += 1
+            if pending_gallery_changes is not None:
+                pending_gallery_changes.extend(("add", key, face_features) for key, face_features in encodings.items())
+    schedule_rebuild()
+
+def remove_encoding(username: str):
+    """Remove all of a user's template encodings from the live gallery and the store"""
+    global gallery_generation
+    if shared_gallery is not None:
+        def change(index):
+            for key in index.templates(username) or [username]:
+                encoding_store.remove(key)
+            return [("remove", username, None)]
+        publish_shared_change(change)
+    else:
+        with gallery_lock:
+            keys = gallery.templates(username) or [username]
+            gallery.remove(username)
+            for key in keys:
+                encoding_store.remove(key)
+            gallery_generation += 1
+            if pending_gallery_changes is not None:
+                pending_gallery_changes.append(("remove", username, None))
+    schedule_rebuild()
+    job_scheduler.submit("compact", storage.compact, delay=COMPACT_DELAY)
+
+def replay_gallery_changes(index: GalleryIndex, changes: list, encodings_db: Optional[Dict[str, np.ndarray]] = None):
+    """Apply recorded ("add", key, features) / ("remove", username, None) changes to a new index.
     
-    return dot_product / (norm_a * norm_b)
+    Replaying a change the index already reflects is harmless: adds replace, removes of
+    absent users do nothing.
+    """
+    for op, key, face_features in changes:
+        if op == "add":
+            if encodings_db is not None:
+                encodings_db[key] = face_features
+            index.add(key, face_features)
+        else:
+            if encodings_db is not None:
+                for stale in [k for k in encodings_db if template_owner(k) == key]:
+                    del encodings_db[stale]
+            index.remove(key)
 
-def train_model_async():
-    """Train model using face encodings"""
-    global face_encodings_db, is_training
+def swap_gallery(encodings_db: Dict[str, np.ndarray], baseline: Optional[Dict[str, np.ndarray]] = None):
+    """Persist a freshly built gallery and make it live in one step"""
+    global gallery, gallery_generation
+    # Build (and cluster, with ANN enabled) the new index before taking the lock
+    new_gallery = GalleryIndex.from_encodings(encodings_db, **GALLERY_OPTIONS)
+    new_gallery.build_ann()
+    
+    if shared_gallery is not None:
+        with gallery_lock, shared_gallery.locked():
+            # Any worker may have enrolled or deleted since the retrain began: diff the stored
+            # encodings against the baseline read then
+            keys, matrix = encoding_store.load()
+            for key, face_features in zip(keys, matrix):
+                if key not in baseline or not np.array_equal(baseline[key], face_features):
+                    encodings_db[key] = face_features
+                    new_gallery.add(key, face_features)
+            for key in baseline.keys() - set(keys):
+                encodings_db.pop(key, None)
+                new_gallery.remove_template(key)
+            
+            encoding_store.replace_all(encodings_db, FEATURE_VERSION)
+            shared_gallery.publish(new_gallery, FEATURE_VERSION)
+            gallery_generation, gallery = shared_gallery.load(**GALLERY_OPTIONS)
+        return
     
-    is_training = True
-    logger.info("Starting model training...")
+    with gallery_lock:
+        # Enrollments and deletions that happened while the snapshot was being built
+        replay_gallery_changes(new_gallery, pending_gallery_changes or [], encodings_db)
+        
+        encoding_store.replace_all(encodings_db, FEATURE_VERSION)
+        gallery = new_gallery
+        gallery_generation += 1
+
+def train_model_async(if_outdated: bool = False) -> Optional[dict]:
+    """Re-extract every enrollment image and swap in the new gallery (runs as a "retrain" job)"""
+    global is_training, pending_gallery_changes
     
     try:
-        users = load_json_file(USERS_FILE, [])
+        if shared_gallery is not None:
+            # One worker process retrains at a time; wait for any other to finish
+            shared_gallery.acquire_training(blocking=True)
+        if if_outdated and not encodings_outdated():
+            # Re-extracted meanwhile, e.g. by another worker while this one waited
+            return None
+        check_encodings_writable()
+        
+        is_training = True
+        started = time.perf_counter()
+        logger.info("Starting model training...")
+        
+        # Recognition keeps using the current gallery until the new snapshot is swapped in
+        with gallery_lock:
+            pending_gallery_changes = []
+        # Shared galleries merge concurrent changes from the store instead (see swap_gallery)
+        baseline = dict(zip(*encoding_store.load())) if shared_gallery is not None else None
+        users = storage.list_users()
         
         if len(users) < 1:
             logger.warning("Need at least 1 user to train model")
-            is_training = False
-            return
-        
-        # Prepare training data
-        encodings_db = {}
+            return None
         
-        for user in users:
-            username = user['username']
-            image_path = os.path.join(UPLOAD_DIR, f"{username}.jpg")
-            
-            if os.path.exists(image_path):
-                face_features = extract_face_features(image_path)
-                if face_features is not None:
-                    encodings_db[username] = face_features.tolist()
-                    logger.info(f"Extracted features for user: {username}")
+        # Prepare training data; the live gallery is only replaced once everything is extracted
+        jobs = [job for user in users for job in enrollment_jobs(user['username'])]
+        encodings_db = extract_all_features(jobs)
         
         if len(encodings_db) < 1:
             logger.warning("Not enough valid face images for training")
-            is_training = False
-            return
-        
-        # Save encodings to file
-        save_json_file(ENCODINGS_FILE, encodings_db)
+            return None
         
-        # Update global encodings database
-        face_encodings_db = encodings_db
+        # Save encodings to the binary store and swap in the new gallery index
+        swap_gallery(encodings_db, baseline)
+        TRAINING_SECONDS.observe(time.perf_counter() - started)
         
-        logger.info(f"Model training completed with {len(encodings_db)} users!")
+        logger.info(
+            f"Model training completed with {len(gallery)} users, {len(encodings_db)} templates "
+            f"(generation {gallery_generation})!"
+        )
+        return {
+            "users": len(gallery),
+            "templates": gallery.template_count,
+            "failed": training_progress.get("failed", 0),
+            "generation": gallery_generation
+        }
         
-    except Exception as e:
-        logger.error(f"Error during model training: {e}")
     finally:
+        with gallery_lock:
+            pending_gallery_changes = None
         is_training = False
+        if shared_gallery is not None:
+            shared_gallery.release_training()
+
+def sample_image_path(username: str, sample: int) -> str:
+    """Where an enrollment image is kept; sample 0 is the registration photo"""
+    if sample == 0:
+        return os.path.join(UPLOAD_DIR, f"{username}.jpg")
+    return os.path.join(SAMPLES_DIR, username, f"{sample}.jpg")
+
+def enrollment_jobs(username: str) -> List[tuple]:
+    """(template key, image path) pairs for every enrollment image kept for a user"""
+    jobs = [(username, sample_image_path(username, 0))]
+    user_dir = os.path.join(SAMPLES_DIR, username)
+    if os.path.isdir(user_dir):
+        for name in sorted(os.listdir(user_dir)):
+            stem, ext = os.path.splitext(name)
+            if ext == ".jpg" and stem.isdigit() and int(stem) > 0:
+                jobs.append((template_key(username, int(stem)), os.path.join(user_dir, name)))
+    return jobs
+
+def stored_feature_version() -> str:
+    """Feature version of the persisted encodings (legacy stores predate versioning)"""
+    return encoding_store.stored_feature_version or LEGACY_FEATURE_VERSION
+
+def encodings_outdated() -> bool:
+    """True when stored encodings were extracted by a different feature pipeline"""
+    return (encodings_load_error is None and encoding_store.exists()
+            and stored_feature_version() != FEATURE_VERSION)
+
+def check_encodings_writable():
+    """Refuse changes that would overwrite stored encodings this process failed to load"""
+    if encodings_load_error is not None:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Face encodings could not be loaded ({encodings_load_error}); enrollment is disabled"
+        )
+
+def schedule_retrain(if_outdated: bool = False):
+    """Queue a full retrain; requests made before it starts share it, later ones queue the next"""
+    return job_scheduler.submit("retrain", functools.partial(train_model_async, if_outdated=if_outdated))
+
+def schedule_rebuild():
+    """Coalesce enrollment changes into one debounced rebuild, for galleries with fitted state"""
+    if GALLERY_OPTIONS["ann"] != "none" or GALLERY_OPTIONS["dtype"] != "float32":
+        job_scheduler.submit("rebuild", rebuild_gallery, delay=REBUILD_DELAY, max_delay=REBUILD_MAX_DELAY)
+
+def rebuild_gallery() -> dict:
+    """Rebuild the live index from the stored encodings, refitting quantization and IVF lists.
+    
+    Enrollments made since the last build leave the residual base and IVF lists fitted to
+    older rows; no features are re-extracted. The index is built without holding the gallery
+    lock, like a retrain's, so recognition and enrollment carry on meanwhile.
+    """
+    global gallery, gallery_generation, pending_gallery_changes
+    if shared_gallery is not None:
+        # Changes published meanwhile by any worker are diffed in from the store, as in swap_gallery
+        keys, matrix = encoding_store.load()
+        baseline = dict(zip(keys, matrix))
+        new_gallery = GalleryIndex.from_matrix(keys, matrix, **GALLERY_OPTIONS)
+        new_gallery.build_ann()
+        with gallery_lock, shared_gallery.locked():
+            keys, matrix = encoding_store.load()
+            for key, face_features in zip(keys, matrix):
+                if key not in baseline or not np.array_equal(baseline[key], face_features):
+                    new_gallery.add(key, face_features)
+            for key in baseline.keys() - set(keys):
+                new_gallery.remove_template(key)
+            shared_gallery.publish(new_gallery, stored_feature_version())
+            gallery_generation, gallery = shared_gallery.load(**GALLERY_OPTIONS)
+    else:
+        with gallery_lock:
+            if pending_gallery_changes is not None:
+                # A retrain is building a fresh index already
+                return {"skipped": "retrain in progress"}
+            pending_gallery_changes = []
+        try:
+            # Changes recorded from here on are replayed into the new index; any the load
+            # below already picked up replay harmlessly
+            keys, matrix = encoding_store.load()
+            new_gallery = GalleryIndex.from_matrix(keys, matrix, **GALLERY_OPTIONS)
+            new_gallery.build_ann()
+            with gallery_lock:
+                replay_gallery_changes(new_gallery, pending_gallery_changes)
+                gallery = new_gallery
+                gallery_generation += 1
+        finally:
+            with gallery_lock:
+                pending_gallery_changes = None
+    return {
+        "templates": gallery.template_count,
+        "approximate_search": gallery.ann_active,
+        "generation": gallery_generation
+    }
+
+def training_in_progress() -> bool:
+    """True while this process, or with a shared gallery any worker, is retraining"""
+    return is_training or (shared_gallery is not None and shared_gallery.training_active())
+
+def publish_from_store():
+    """Publish a shared snapshot built from the stored encodings and map it (locks held)"""
+    global gallery, gallery_generation
+    keys, matrix = encoding_store.load()
+    index = GalleryIndex.from_matrix(keys, matrix, **GALLERY_OPTIONS)
+    index.build_ann()
+    shared_gallery.publish(index, stored_feature_version())
+    gallery_generation, gallery = shared_gallery.load(**GALLERY_OPTIONS)
+
+def load_shared_gallery():
+    """Map the shared snapshot, first publishing it from the store if it is missing or stale"""
+    global gallery, gallery_generation
+    with gallery_lock, shared_gallery.locked():
+        try:
+            loaded = shared_gallery.load(**GALLERY_OPTIONS)
+        except ValueError as e:
+            logger.warning(f"Rebuilding the shared gallery: {e}")
+            loaded = None
+        if (loaded is None or set(loaded[1].keys) != set(encoding_store.load()[0])
+                or shared_gallery.stored_feature_version() != stored_feature_version()):
+            publish_from_store()
+        else:
+            gallery_generation, gallery = loaded
 
 def load_trained_encodings():
     """Load pre-trained face encodings"""
-    global face_encodings_db
+    global gallery, gallery_generation, encodings_load_error
     
     try:
-        encodings_db = load_json_file(ENCODINGS_FILE, {})
-        face_encodings_db = encodings_db
-        logger.info(f"Loaded face encodings for {len(encodings_db)} users")
-        return len(encodings_db) > 0
+        if not encoding_store.exists() and os.path.exists(ENCODINGS_FILE):
+            imported = encoding_store.import_json(ENCODINGS_FILE, LEGACY_FEATURE_VERSION)
+            logger.info(f"Migrated {imported} face encodings from {ENCODINGS_FILE} to binary store")
+        
+        if shared_gallery is not None:
+            load_shared_gallery()
+        else:
+            keys, matrix = encoding_store.load()
+            gallery = GalleryIndex.from_matrix(keys, matrix, **GALLERY_OPTIONS)
+            if gallery.build_ann():
+                logger.info(f"Approximate search enabled over {gallery.template_count} templates")
+            gallery_generation += 1
+        logger.info(f"Loaded {gallery.template_count} face encodings for {len(gallery)} users")
+        
+        if encodings_outdated():
+            logger.warning(
+                f"Stored encodings use feature version {stored_feature_version()}, "
+                f"current is {FEATURE_VERSION}; a full retrain is required"
+            )
+        return len(gallery) > 0
     except Exception as e:
-        logger.error(f"Error loading face encodings: {e}")
+        encodings_load_error = str(e)
+        logger.error(
+            f"Error loading face encodings: {e}. The encoding store is read-only: enrollments and "
+            f"retrains are refused until it is repaired or moved aside and the server restarted"
+        )
     
     return False
 
+def resolve_match(best_match: Optional[str], best_confidence: float, second_similarity: float,
+                  gallery_size: int) -> tuple:
+    """Apply the top-2 confidence-gap rule to a raw match"""
+    if best_confidence <= 0.0:
+        return None, 0.0
+    
+    # Additional validation: Check if the best match is significantly better than others
+    # Only apply this validation if confidence is below 90% to avoid rejecting high-confidence matches
+    if gallery_size > 1 and best_confidence < 0.90:
+        # If the difference between top two matches is too small, reject
+        confidence_gap = best_confidence - second_similarity
+        if confidence_gap < 0.03:  # Require at least 3% difference (less strict)
+            AMBIGUOUS_MATCHES.inc()
+            logger.debug(f"Ambiguous match: top={best_confidence:.3f}, second={second_similarity:.3f}, gap={confidence_gap:.3f}")
+            return None, best_confidence
+    
+    return best_match, best_confidence
+
 def predict_face(face_features: np.ndarray) -> tuple:
     """Predict face using similarity comparison with stricter validation"""
-    global face_encodings_db
-    
-    if not face_encodings_db:
+    # Take one snapshot so a concurrent retrain swap cannot change it mid-prediction
+    index = gallery
+    if len(index) == 0:
         return None, 0.0
     
     try:
-        best_match = None
-        best_confidence = 0.0
-        all_similarities = []
-        
-        # Compare with all stored encodings
-        for username, stored_features in face_encodings_db.items():
-            stored_array = np.array(stored_features)
-            
-            # Calculate cosine similarity
-            similarity = cosine_similarity_simple(stored_array, face_features)
-            all_similarities.append(similarity)
-            
-            if similarity > best_confidence:
-                best_confidence = similarity
-                best_match = username
-        
-        # Additional validation: Check if the best match is significantly better than others
-        # Only apply this validation if confidence is below 90% to avoid rejecting high-confidence matches
-        if len(all_similarities) > 1 and best_confidence < 0.90:
-            all_similarities.sort(reverse=True)
-            top_similarity = all_similarities[0]
-            second_similarity = all_similarities[1] if len(all_similarities) > 1 else 0.0
-            
-            # If the difference between top two matches is too small, reject
-            confidence_gap = top_similarity - second_similarity
-            if confidence_gap < 0.03:  # Require at least 3% difference (less strict)
-                logger.info(f"Ambiguous match: top={top_similarity:.3f}, second={second_similarity:.3f}, gap={confidence_gap:.3f}")
-                return None, top_similarity
+        # Single matrix-vector product against the whole gallery
+        with stage_timer("match"):
+            best_match, best_confidence, second_similarity = index.top2(face_features)
+        best_match, best_confidence = resolve_match(best_match, best_confidence, second_similarity, len(index))
         
         # Log the prediction for debugging
-        logger.info(f"Best match: {best_match} with confidence {best_confidence:.3f}")
+        if best_match is not None:
+            logger.debug(f"Best match: {best_match} with confidence {best_confidence:.3f}")
         
-        return best_match, float(best_confidence)
+        return best_match, best_confidence
     
     except Exception as e:
         logger.error(f"Error predicting face: {e}")
         return None, 0.0
 
-# Load existing encodings on startup
-load_trained_encodings()
-logger.info("Attend-II Face Recognition System initialized")
+def predict_faces(features_matrix: np.ndarray) -> List[tuple]:
+    """Predict many faces with one matrix-matrix product; same rules as predict_face"""
+    index = gallery
+    if len(index) == 0:
+        return [(None, 0.0)] * len(features_matrix)
+    
+    with stage_timer("match"):
+        names, best, second = index.top2_batch(features_matrix)
+    return [
+        resolve_match(name, float(top), float(runner_up), len(index))
+        for name, top, runner_up in zip(names, best, second)
+    ]
+
+async def run_blocking(func, *args):
+    """Run blocking work on the bounded recognition executor, or reject with 503 when saturated"""
+    global pending_blocking_jobs
+    if pending_blocking_jobs >= MAX_PENDING_JOBS:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy processing other faces. Please try again shortly.",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+        )
+    
+    # Only touched from the event loop thread, so no lock is needed
+    pending_blocking_jobs += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(recognition_executor, functools.partial(func, *args))
+    finally:
+        pending_blocking_jobs -= 1
+
+def quality_message(quality: dict) -> str:
+    """Why a face failed the quality gate, phrased for the person retaking the photo"""
+    return (f"Face image quality too low ({', '.join(quality['issues'])}). "
+            "Please face the camera in even light, hold still and move closer.")
+
+def record_quality_rejection(endpoint: str, quality: dict):
+    for issue in quality["issues"]:
+        QUALITY_REJECTIONS.inc(endpoint=endpoint, issue=issue)
+
+def register_and_enroll(username: str, images: List[bytes], email: Optional[str], department: Optional[str],
+                        role: Optional[str]) -> dict:
+    """Validate the face, add the user and keep the enrollment images (runs on the executor).
+    
+    The first image is the registration photo; any others become extra samples.
+    """
+    contents = images[0]
+    check_encodings_writable()
+    # Check if user already exists
+    if storage.get_user(username) is not None:
+        raise HTTPException(status_code=400, detail="User already exists")
+    
+    # Validate face in image straight from the upload buffer
+    face_features, quality = extract_face_with_quality(contents)
+    if quality is None:
+        raise HTTPException(status_code=400, detail="No face detected in the image. Please upload a clear face photo.")
+    if face_features is None:
+        record_quality_rejection("register_user", quality)
+        raise HTTPException(status_code=400, detail=quality_message(quality))
+    
+    # Add user to database
+    image_path = os.path.join(UPLOAD_DIR, f"{username}.jpg")
+    new_user = {
+        "username": username,
+        "registered_date": datetime.now().isoformat(),
+        "image_path": image_path,
+        "email": email if email else "",
+        "department": department if department else "",
+        "role": role if role else ""
+    }
+    
+    if not storage.add_user(new_user):
+        # Registered concurrently under the same name
+        raise HTTPException(status_code=400, detail="User already exists")
+    
+    # Keep the enrollment image for future retrains
+    with open(image_path, "wb") as f:
+        f.write(contents)
+    
+    # Insert the validated encoding straight into the live gallery; no retrain needed
+    enroll_encoding(username, face_features)
+    samples = enroll_samples(username, images[1:], first_image=1)
+    
+    logger.info(f"User {username} registered successfully")
+    
+    return {
+        "message": f"User '{username}' registered successfully! Face recognition is ready.",
+        "username": username,
+        "total_users": storage.count_users(),
+        "templates": len(gallery.templates(username)),
+        "quality": quality,
+        "samples": samples
+    }
+
+def enroll_samples(username: str, images: List[bytes], first_image: int = 0) -> List[dict]:
+    """Add extra enrollment samples for a user, keeping at most MAX_TEMPLATES templates.
+    
+    Once the set is full, a new sample replaces the extra sample most similar to it,
+    so the kept templates stay diverse. The registration photo is never replaced.
+    """
+    results = []
+    for image_index, contents in enumerate(images, start=first_image):
+        face_features, quality = extract_face_with_quality(contents)
+        if quality is None:
+            results.append({"image": image_index, "status": "no_face"})
+            continue
+        if face_features is None:
+            record_quality_rejection("enroll_samples", quality)
+            results.append({"image": image_index, "status": "low_quality", "quality": quality})
+            continue
+        
+        with samples_lock:
+            index = gallery
+            keys = index.templates(username)
+            if len(keys) < MAX_TEMPLATES:
+                used = {template_sample(key) for key in keys}
+                sample = next(k for k in itertools.count(1) if k not in used)
+                status = "added"
+            else:
+                extras = [key for key in keys if template_sample(key) > 0]
+                if not extras:
+                    results.append({"image": image_index, "status": "limit_reached", "quality": quality})
+                    continue
+                similarities = index.template_scores(username, face_features)
+                sample = template_sample(max(extras, key=similarities.get))
+                status = "replaced"
+            
+            image_path = sample_image_path(username, sample)
+            os.makedirs(os.path.dirname(image_path), exist_ok=True)
+            with open(image_path, "wb") as f:
+                f.write(contents)
+            enroll_encoding(template_key(username, sample), face_features)
+        
+        results.append({"image": image_index, "status": status, "sample": sample, "quality": quality})
+    return results
+
+def add_user_samples(username: str, images: List[bytes]) -> dict:
+    """Enroll extra samples for an existing user (runs on the executor)"""
+    if storage.get_user(username) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    check_encodings_writable()
+    
+    results = enroll_samples(username, images)
+    enrolled = sum(1 for result in results if result["status"] in ("added", "replaced"))
+    logger.info(f"Enrolled {enrolled} of {len(images)} samples for {username}")
+    
+    return {
+        "message": f"Enrolled {enrolled} of {len(images)} samples for {username.replace('_', ' ').title()}",
+        "username": username,
+        "enrolled": enrolled,
+        "templates": len(gallery.templates(username)),
+        "max_templates": MAX_TEMPLATES,
+        "results": results
+    }
+
+def import_users(entries, metadata: Dict[str, dict]) -> dict:
+    """Register one user per (file name, image bytes) entry, committing them as one batch.
+    
+    Photos are staged as the entries stream in and their features are extracted across
+    TRAIN_WORKERS processes. Users, images and encodings that passed are then committed
+    together, so galleries with fitted state get a single rebuild. Returns a per-file report.
+    """
+    check_encodings_writable()
+    existing = {user["username"] for user in storage.list_users()}
+    results = []
+    staged = {}
+    staging_dir = tempfile.mkdtemp(prefix=".import-", dir=UPLOAD_DIR)
+    try:
+        for entry, contents in entries:
+            username = entry_username(entry)
+            result = {"file": entry, "username": username, "status": "failed"}
+            results.append(result)
+            if contents is None:
+                result["error"] = "image too large"
+            elif not username or "#" in username:
+                result["error"] = "invalid username"
+            elif username in staged:
+                result["error"] = f"duplicate of {staged[username][0]['file']}"
+            elif username in existing:
+                result["error"] = "user already exists"
+            else:
+                path = os.path.join(staging_dir, f"{len(staged)}.jpg")
+                with open(path, "wb") as f:
+                    f.write(contents)
+                staged[username] = (result, path)
+        
+        encodings = {}
+        
+        def collect(batch):
+            for username, face_features, error in batch:
+                if face_features is None:
+                    staged[username][0]["error"] = error
+                else:
+                    encodings[username] = face_features
+        
+        extract_features_parallel(
+            [(username, path) for username, (_, path) in staged.items()], collect, gate=QUALITY_GATE
+        )
+        
+        registered_date = datetime.now().isoformat()
+        users = [{
+            "username": username,
+            "registered_date": registered_date,
+            "image_path": os.path.join(UPLOAD_DIR, f"{username}.jpg"),
+            **{field: metadata.get(username, {}).get(field) or "" for field in ("email", "department", "role")}
+        } for username in encodings]
+        committed = {}
+        for user, added in zip(users, storage.add_users(users)):
+            result, path = staged[user["username"]]
+            if not added:
+                # Registered concurrently under the same name
+                result["error"] = "user already exists"
+                continue
+            os.replace(path, user["image_path"])
+            committed[user["username"]] = encodings[user["username"]]
+            result["status"] = "imported"
+        if committed:
+            enroll_encodings(committed)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    
+    logger.info(f"Bulk import registered {len(committed)} of {len(results)} users")
+    return {
+        "files": len(results),
+        "imported": len(committed),
+        "failed": len(results) - len(committed),
+        "results": results
+    }
+
+def recognize_and_mark(contents: bytes) -> dict:
+    """Extract, match and mark attendance for one uploaded image (runs on the executor)"""
+    # Read the generation before matching, so a concurrent gallery change leaves the entry stale
+    generation = gallery_generation
+    digest = recognition_cache.digest(contents) if recognition_cache.enabled else None
+    cached = recognition_cache.get(digest, generation) if digest is not None else None
+    if cached is not None:
+        face_features, quality, match = cached
+    else:
+        # Extract face features, decoding straight from the upload buffer; poor frames
+        # are turned away by the quality gate before description and matching
+        face_features, quality = extract_face_with_quality(contents)
+        match = None
+    
+    if face_features is None:
+        if cached is None and digest is not None:
+            recognition_cache.put(digest, generation, None, None, quality)
+        if quality is not None:
+            RECOGNITIONS.inc(endpoint="recognize_face", outcome="low_quality")
+            record_quality_rejection("recognize_face", quality)
+            return {
+                "status": "low_quality",
+                "message": quality_message(quality),
+                "quality": quality
+            }
+        RECOGNITIONS.inc(endpoint="recognize_face", outcome="no_face")
+        return {
+            "status": "error",
+            "message": "No face detected in the image. Please ensure your face is clearly visible."
+        }
+    
+    # Predict user
+    if match is None:
+        match = predict_face(face_features)
+        if digest is not None:
+            recognition_cache.put(digest, generation, face_features, match, quality)
+    predicted_user, confidence = match
+    
+    # Confidence threshold for recognition
+    confidence_threshold = CONFIDENCE_THRESHOLD
+    
+    logger.debug(f"Recognition attempt: user={predicted_user}, confidence={confidence:.3f}, threshold={confidence_threshold}")
+    
+    if predicted_user is None or confidence < confidence_threshold:
+        RECOGNITIONS.inc(endpoint="recognize_face", outcome="unknown")
+        return {
+            "status": "unknown",
+            "message": f"Face not recognized (confidence: {confidence:.1%}). Please register as a new student first.",
+            "confidence": confidence,
+            "quality": quality
+        }
+    
+    # Format username for display (replace underscores with spaces and capitalize)
+    display_name = predicted_user.replace('_', ' ').title()
+    already_marked = {
+        "status": "already_marked",
+        "user": predicted_user,
+        "message": f"Attendance already marked for {display_name} today!",
+        "confidence": confidence,
+        "quality": quality
+    }
+    
+    # Check if attendance already marked today
+    today = datetime.now().date().isoformat()
+    if storage.is_marked(predicted_user, today):
+        RECOGNITIONS.inc(endpoint="recognize_face", outcome="already_marked")
+        return already_marked
+    
+    # Mark attendance
+    attendance_record = {
+        "username": predicted_user,
+        "timestamp": datetime.now().isoformat(),
+        "date": today,
+        "confidence": confidence,
+        "method": "face_recognition"
+    }
+    
+    with stage_timer("attendance_write"):
+        marked = storage.mark_attendance(attendance_record)
+    if not marked:
+        # A concurrent request marked this user first
+        RECOGNITIONS.inc(endpoint="recognize_face", outcome="already_marked")
+        return already_marked
+    
+    RECOGNITIONS.inc(endpoint="recognize_face", outcome="success")
+    logger.info(f"Attendance marked for {predicted_user} with {confidence:.1%} confidence")
+    
+    return {
+        "status": "success",
+        "user": predicted_user,
+        "message": f"Welcome {display_name}! Attendance marked successfully.",
+        "confidence": confidence,
+        "quality": quality,
+        "timestamp": attendance_record["timestamp"]
+    }
+
+def recognize_batch_and_mark(images: List[bytes]) -> dict:
+    """Recognize every face in one or more images and mark all confident matches together"""
+    faces_per_image = []
+    features_per_image = []
+    errors = []
+    for image_index, contents in enumerate(images):
+        try:
+            # Faces failing the quality gate are reported but never described or matched
+            boxes, qualities, accepted, features_matrix = extract_all_faces_with_quality(contents)
+        except ValueError:
+            errors.append({"image": image_index, "message": "Could not decode image"})
+            continue
+        if len(boxes) == 0:
+            errors.append({"image": image_index, "message": "No face detected"})
+            continue
+        faces_per_image.append((image_index, boxes, qualities, accepted))
+        features_per_image.append(features_matrix)
+    if errors:
+        RECOGNITIONS.inc(len(errors), endpoint="recognize_batch", outcome="no_face")
+    
+    if not faces_per_image:
+        return {"status": "error", "total_faces": 0, "marked": 0, "faces": [], "errors": errors}
+    
+    # One matrix-matrix product for every accepted face in the request
+    features_matrix = np.concatenate(features_per_image)
+    predictions = predict_faces(features_matrix) if len(features_matrix) else []
+    
+    today = datetime.now().date().isoformat()
+    timestamp = datetime.now().isoformat()
+    faces = []
+    to_mark = {}
+    position = 0
+    for image_index, boxes, qualities, accepted in faces_per_image:
+        for box, quality, ok in zip(boxes, qualities, accepted):
+            face = {
+                "image": image_index,
+                "box": [int(v) for v in box],
+                "user": None,
+                "confidence": None,
+                "quality": quality
+            }
+            if not ok:
+                record_quality_rejection("recognize_batch", quality)
+                face["status"] = "low_quality"
+                faces.append(face)
+                continue
+            predicted_user, confidence = predictions[position]
+            position += 1
+            face["confidence"] = confidence
+            if predicted_user is None or confidence < CONFIDENCE_THRESHOLD:
+                face["status"] = "unknown"
+            else:
+                face["user"] = predicted_user
+                face["display_name"] = predicted_user.replace('_', ' ').title()
+                # The same person can appear in several photos; keep their most confident face
+                if predicted_user not in to_mark or confidence > faces[to_mark[predicted_user]]["confidence"]:
+                    if predicted_user in to_mark:
+                        faces[to_mark[predicted_user]]["status"] = "duplicate"
+                    to_mark[predicted_user] = len(faces)
+                    face["status"] = "pending"
+                else:
+                    face["status"] = "duplicate"
+            faces.append(face)
+    
+    records = [
+        {
+            "username": username,
+            "timestamp": timestamp,
+            "date": today,
+            "confidence": faces[position]["confidence"],
+            "method": "face_recognition_batch"
+        }
+        for username, position in to_mark.items()
+    ]
+    # All confident matches are written in a single storage transaction
+    with stage_timer("attendance_write"):
+        marked = storage.mark_attendance_many(records)
+    for (username, position), was_marked in zip(to_mark.items(), marked):
+        faces[position]["status"] = "success" if was_marked else "already_marked"
+    for face in faces:
+        RECOGNITIONS.inc(endpoint="recognize_batch", outcome=face["status"])
+    
+    logger.debug(f"Batch recognition: {len(faces)} faces, {sum(marked)} newly marked")
+    
+    return {
+        "status": "ok",
+        "date": today,
+        "total_faces": len(faces),
+        "marked": sum(marked),
+        "faces": faces,
+        "errors": errors
+    }
+
+def identify_stream_face(face_features: np.ndarray) -> tuple:
+    """Match one tracked face, returning (username or None, confidence)"""
+    refresh_gallery()
+    predicted_user, confidence = predict_face(face_features)
+    if predicted_user is None or confidence < CONFIDENCE_THRESHOLD:
+        return None, confidence
+    return predicted_user, confidence
+
+def mark_stream_attendance(username: str, confidence: float) -> str:
+    """Mark attendance for a face identified in a stream, returning the status"""
+    attendance_record = {
+        "username": username,
+        "timestamp": datetime.now().isoformat(),
+        "date": datetime.now().date().isoformat(),
+        "confidence": confidence,
+        "method": "face_recognition_stream"
+    }
+    with stage_timer("attendance_write"):
+        marked = storage.mark_attendance(attendance_record)
+    if not marked:
+        RECOGNITIONS.inc(endpoint="recognize_stream", outcome="already_marked")
+        return "already_marked"
+    
+    RECOGNITIONS.inc(endpoint="recognize_stream", outcome="success")
+    logger.info(f"Attendance marked for {username} from stream with {confidence:.1%} confidence")
+    return "success"
+
+# Load existing encodings on startup, re-extracting them if the feature pipeline changed.
+# Retrain workers import extraction only; the guard keeps any other child process from training.
+if multiprocessing.current_process().name == "MainProcess":
+    load_trained_encodings()
+    if encodings_outdated():
+        schedule_retrain(if_outdated=True)
+    logger.info("Attend-II Face Recognition System initialized")
+
+if SHARED_GALLERY:
+    @app.middleware("http")
+    async def refresh_shared_gallery(request, call_next):
+        """Pick up gallery changes published by other workers before handling a request"""
+        if shared_gallery.changed():
+            await asyncio.get_running_loop().run_in_executor(None, refresh_gallery)
+        return await call_next(request)
+
+@app.on_event("shutdown")
+def close_storage():
+    """Flush batched writes and close database connections"""
+    job_scheduler.shutdown(wait=True)
+    recognition_executor.shutdown(wait=True)
+    storage.close()
 
 @app.get("/")
 async def root():
@@ -269,7 +1094,8 @@ async def root():
 @app.post("/register_user")
 async def register_user(
     username: str = Form(...), 
-    file: UploadFile = File(...),
+    # One or more images under the same "file" field; extras become enrollment samples
+    files: List[UploadFile] = File(..., alias="file"),
     email: str = Form(None),
     department: str = Form(None),
     role: str = Form(None)
@@ -281,155 +1107,86 @@ async def register_user(
             raise HTTPException(status_code=400, detail="Username cannot be empty")
         
         username = username.strip().lower().replace(" ", "_")
+        if "#" in username:
+            raise HTTPException(status_code=400, detail="Username cannot contain '#'")
         
-        # Check if user already exists
-        users = load_json_file(USERS_FILE, [])
-        existing_usernames = [user['username'] for user in users]
-        
-        if username in existing_usernames:
-            raise HTTPException(status_code=400, detail="User already exists")
-        
-        # Validate image file
-        if not file.content_type.startswith('image/'):
+        # Validate image files
+        if not all(file.content_type.startswith('image/') for file in files):
             raise HTTPException(status_code=400, detail="File must be an image")
         
-        # Save image
-        image_path = os.path.join(UPLOAD_DIR, f"{username}.jpg")
-        
-        contents = await file.read()
-        with open(image_path, "wb") as f:
-            f.write(contents)
-        
-        # Validate face in image
-        face_features = extract_face_features(image_path)
-        if face_features is None:
-            os.remove(image_path)  # Clean up
-            raise HTTPException(status_code=400, detail="No face detected in the image. Please upload a clear face photo.")
-        
-        # Add user to database
-        new_user = {
-            "username": username,
-            "registered_date": datetime.now().isoformat(),
-            "image_path": image_path,
-            "email": email if email else "",
-            "department": department if department else "",
-            "role": role if role else ""
-        }
-        
-        users.append(new_user)
-        save_json_file(USERS_FILE, users)
-        
-        # Start model retraining in background
-        global training_thread
-        if training_thread is None or not training_thread.is_alive():
-            training_thread = threading.Thread(target=train_model_async)
-            training_thread.start()
+        images = [await file.read() for file in files]
+        return await run_blocking(register_and_enroll, username, images, email, department, role)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error registering user: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.post("/user/{username}/samples")
+async def add_samples(username: str, files: List[UploadFile] = File(...)):
+    """Add extra face samples for a registered user to reduce false rejections"""
+    try:
+        username = username.lower().replace(" ", "_")
         
-        logger.info(f"User {username} registered successfully")
+        if not all(file.content_type.startswith('image/') for file in files):
+            raise HTTPException(status_code=400, detail="File must be an image")
         
-        return {
-            "message": f"User '{username}' registered successfully! AI model is retraining automatically.",
-            "username": username,
-            "total_users": len(users)
-        }
+        images = [await file.read() for file in files]
+        return await run_blocking(add_user_samples, username, images)
     
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error registering user: {e}")
+        logger.error(f"Error adding samples: {e}")
+        raise HTTPException(status_code=500, detail="Error adding face samples")
+
+@app.post("/users/import", status_code=202)
+def import_users_archive(archive: UploadFile = File(...), details: UploadFile = File(None)):
+    """Register users in bulk from a ZIP of username.jpg photos plus an optional details CSV.
+    
+    Runs as an "import" job; GET /jobs/{id} returns its per-file report.
+    """
+    try:
+        if not zipfile.is_zipfile(archive.file):
+            raise HTTPException(status_code=400, detail="Archive must be a ZIP file")
+        try:
+            metadata = read_metadata(io.TextIOWrapper(details.file, encoding="utf-8-sig")) if details else {}
+        except (ValueError, UnicodeDecodeError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid details CSV: {e}")
+        
+        # The job reads the archive after this request has finished
+        archive.file.seek(0)
+        with tempfile.NamedTemporaryFile(prefix=".import-", suffix=".zip", dir=UPLOAD_DIR, delete=False) as f:
+            shutil.copyfileobj(archive.file, f)
+            archive_path = f.name
+        
+        def run():
+            try:
+                return import_users(iter_images(archive_path), metadata)
+            finally:
+                os.remove(archive_path)
+        
+        job = job_scheduler.submit("import", run, coalesce=False)
+        return {"message": "Bulk import queued", "status": "queued", "job": job.to_dict()}
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error queueing bulk import: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.post("/recognize_face")
 async def recognize_face(file: UploadFile = File(...)):
     """Recognize face and mark attendance"""
-    global face_encodings_db
-    
     try:
         # Check if model is trained
-        if not face_encodings_db:
+        if len(gallery) == 0:
             raise HTTPException(status_code=400, detail="AI model not trained yet. Please register at least 1 user first.")
         
-        if is_training:
-            raise HTTPException(status_code=400, detail="Model is currently training. Please wait a moment.")
-        
-        # Save uploaded image temporarily
-        temp_path = os.path.join(UPLOAD_DIR, "temp_recognition.jpg")
-        contents = await file.read()
-        
-        with open(temp_path, "wb") as f:
-            f.write(contents)
-        
-        # Extract face features
-        face_features = extract_face_features(temp_path)
-        
-        # Clean up temp file
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-        
-        if face_features is None:
-            return {
-                "status": "error",
-                "message": "No face detected in the image. Please ensure your face is clearly visible."
-            }
-        
-        # Predict user
-        predicted_user, confidence = predict_face(face_features)
-        
-        # Confidence threshold for recognition
-        confidence_threshold = 0.65  # 65% threshold for better user experience
-        
-        logger.info(f"Recognition attempt: user={predicted_user}, confidence={confidence:.3f}, threshold={confidence_threshold}")
-        
-        if predicted_user is None or confidence < confidence_threshold:
-            return {
-                "status": "unknown",
-                "message": f"Face not recognized (confidence: {confidence:.1%}). Please register as a new student first.",
-                "confidence": confidence
-            }
-        
-        # Check if attendance already marked today
-        attendance_records = load_json_file(ATTENDANCE_FILE, [])
-        today = datetime.now().date().isoformat()
-        
-        today_attendance = [
-            record for record in attendance_records 
-            if record.get('username') == predicted_user and record.get('date') == today
-        ]
-        
-        if today_attendance:
-            # Format username for display (replace underscores with spaces and capitalize)
-            display_name = predicted_user.replace('_', ' ').title()
-            return {
-                "status": "already_marked",
-                "user": predicted_user,
-                "message": f"Attendance already marked for {display_name} today!",
-                "confidence": confidence
-            }
-        
-        # Mark attendance
-        attendance_record = {
-            "username": predicted_user,
-            "timestamp": datetime.now().isoformat(),
-            "date": today,
-            "confidence": confidence,
-            "method": "face_recognition"
-        }
-        
-        attendance_records.append(attendance_record)
-        save_json_file(ATTENDANCE_FILE, attendance_records)
-        
-        logger.info(f"Attendance marked for {predicted_user} with {confidence:.1%} confidence")
-        
-        # Format username for display
-        display_name = predicted_user.replace('_', ' ').title()
-        
-        return {
-            "status": "success",
-            "user": predicted_user,
-            "message": f"Welcome {display_name}! Attendance marked successfully.",
-            "confidence": confidence,
-            "timestamp": attendance_record["timestamp"]
-        }
+        with stage_timer("read"):
+            contents = await file.read()
+        return await run_blocking(recognize_and_mark, contents)
     
     except HTTPException:
         raise
@@ -437,53 +1194,196 @@ async def recognize_face(file: UploadFile = File(...)):
         logger.error(f"Error recognizing face: {e}")
         raise HTTPException(status_code=500, detail="Face recognition failed")
 
+@app.post("/recognize_batch")
+async def recognize_batch(files: List[UploadFile] = File(...)):
+    """Recognize every face in a group photo (or several photos) and mark attendance"""
+    try:
+        if len(gallery) == 0:
+            raise HTTPException(status_code=400, detail="AI model not trained yet. Please register at least 1 user first.")
+        
+        with stage_timer("read"):
+            images = [await file.read() for file in files]
+        return await run_blocking(recognize_batch_and_mark, images)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in batch recognition: {e}")
+        raise HTTPException(status_code=500, detail="Batch face recognition failed")
+
+@app.websocket("/recognize_stream")
+async def recognize_stream(websocket: WebSocket, detect_every: int = STREAM_DETECT_EVERY, boxes: bool = False):
+    """Recognize faces in a stream of JPEG frames sent as binary messages, pushing JSON events back"""
+    await websocket.accept()
+    session = StreamSession(
+        identify=identify_stream_face,
+        mark=mark_stream_attendance,
+        detect_every=detect_every,
+        max_attempts=STREAM_MAX_ATTEMPTS,
+        send_boxes=boxes
+    )
+    try:
+        while True:
+            frame = await websocket.receive_bytes()
+            try:
+                events = await run_blocking(session.process_frame, frame)
+            except HTTPException:
+                # Recognition pool is saturated; drop this frame rather than queue behind it
+                session.skipped_frames += 1
+                continue
+            for event in events:
+                if event["type"] == "low_quality":
+                    RECOGNITIONS.inc(endpoint="recognize_stream", outcome="low_quality")
+                    record_quality_rejection("recognize_stream", event["quality"])
+                await websocket.send_json(event)
+    except WebSocketDisconnect:
+        logger.info(f"Stream closed: {session.stats()}")
+    except Exception as e:
+        logger.error(f"Error in recognition stream: {e}")
+        await websocket.close(code=1011)
+
 @app.get("/users")
-async def get_users():
+def get_users():
     """Get all registered users"""
-    users = load_json_file(USERS_FILE, [])
+    users = storage.list_users()
     return {"users": users, "total": len(users)}
 
+def attendance_filters(date_from: Optional[str], date_to: Optional[str], username: Optional[str],
+                       department: Optional[str], method: Optional[str]) -> dict:
+    """Validated storage filters from query parameters"""
+    for name, value in (("date_from", date_from), ("date_to", date_to)):
+        if value is not None:
+            try:
+                Date.fromisoformat(value)
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"{name} must be a YYYY-MM-DD date")
+    return {
+        "date_from": date_from,
+        "date_to": date_to,
+        "username": username.lower().replace(" ", "_") if username else None,
+        "department": department or None,
+        "method": method or None
+    }
+
+def attendance_page(filters: dict, cursor: Optional[str], limit: int) -> dict:
+    """One page of attendance records plus the cursor for the next page"""
+    after = None
+    if cursor:
+        try:
+            after = int(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    records, next_cursor = storage.query_attendance(filters, after, limit)
+    return {
+        "attendance": records,
+        "total": storage.count_attendance(filters),
+        "limit": limit,
+        "next_cursor": str(next_cursor) if next_cursor is not None else None
+    }
+
 @app.get("/attendance")
-async def get_attendance():
-    """Get all attendance records"""
-    attendance_records = load_json_file(ATTENDANCE_FILE, [])
-    return {"attendance": attendance_records, "total": len(attendance_records)}
+def get_attendance(
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    username: Optional[str] = None,
+    department: Optional[str] = None,
+    method: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(ATTENDANCE_PAGE_SIZE, ge=1, le=ATTENDANCE_MAX_PAGE_SIZE)
+):
+    """Get attendance records, oldest first, filtered and paginated (pass next_cursor back as cursor)"""
+    filters = attendance_filters(date_from, date_to, username, department, method)
+    return attendance_page(filters, cursor, limit)
 
 @app.get("/attendance/today")
-async def get_today_attendance():
+def get_today_attendance(
+    department: Optional[str] = None,
+    method: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(ATTENDANCE_PAGE_SIZE, ge=1, le=ATTENDANCE_MAX_PAGE_SIZE)
+):
     """Get today's attendance"""
-    attendance_records = load_json_file(ATTENDANCE_FILE, [])
     today = datetime.now().date().isoformat()
-    
-    today_attendance = [
-        record for record in attendance_records 
-        if record.get('date') == today
-    ]
-    
-    return {"attendance": today_attendance, "date": today, "total": len(today_attendance)}
+    filters = attendance_filters(today, today, None, department, method)
+    return {**attendance_page(filters, cursor, limit), "date": today}
+
+def export_rows(filters: dict, export_format: str):
+    """Encode matching attendance records incrementally as NDJSON lines or CSV rows"""
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=ATTENDANCE_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        count = 0
+        for record in storage.iter_attendance(filters, EXPORT_BATCH_SIZE):
+            writer.writerow(record)
+            count += 1
+            if count % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        lines = []
+        for record in storage.iter_attendance(filters, EXPORT_BATCH_SIZE):
+            lines.append(json.dumps(record, default=str) + "\n")
+            if len(lines) == EXPORT_BATCH_SIZE:
+                yield "".join(lines)
+                lines = []
+        yield "".join(lines)
+
+@app.get("/attendance/export")
+def export_attendance(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    username: Optional[str] = None,
+    department: Optional[str] = None,
+    method: Optional[str] = None
+):
+    """Stream matching attendance records as NDJSON or CSV without building the whole list"""
+    filters = attendance_filters(date_from, date_to, username, department, method)
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"attendance.{'csv' if format == 'csv' else 'ndjson'}"
+    return StreamingResponse(
+        export_rows(filters, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.delete("/attendance/today")
+def clear_today_attendance():
+    """Remove every attendance record for today (registered before /attendance/{username})"""
+    try:
+        today = datetime.now().date().isoformat()
+        usernames = {record["username"] for record in storage.attendance_for_date(today)}
+        removed_count = sum(storage.remove_attendance(username, today) for username in usernames)
+        
+        logger.info(f"Removed {removed_count} attendance records for {today}")
+        
+        return {
+            "message": f"Removed {removed_count} attendance records for today",
+            "removed": removed_count > 0,
+            "date": today,
+            "removed_count": removed_count,
+            "remaining_records": storage.count_attendance()
+        }
+        
+    except Exception as e:
+        logger.error(f"Error clearing today's attendance: {e}")
+        raise HTTPException(status_code=500, detail="Error removing attendance records")
 
 @app.delete("/attendance/{username}")
-async def remove_attendance(username: str, date: str = None):
+def remove_attendance(username: str, date: str = None):
     """Remove attendance record for a specific user and date"""
     try:
         username = username.lower().replace(" ", "_")
         
-        # Load attendance records
-        attendance_records = load_json_file(ATTENDANCE_FILE, [])
-        original_count = len(attendance_records)
-        
         # If no date specified, use today's date
         if not date:
             date = datetime.now().date().isoformat()
         
-        # Filter out the specific attendance record
-        updated_records = [
-            record for record in attendance_records 
-            if not (record.get('username') == username and record.get('date') == date)
-        ]
-        
-        # Check if any record was removed
-        removed_count = original_count - len(updated_records)
+        # Remove the specific attendance record
+        removed_count = storage.remove_attendance(username, date)
         
         if removed_count == 0:
             return {
@@ -493,9 +1393,6 @@ async def remove_attendance(username: str, date: str = None):
                 "username": username
             }
         
-        # Save updated records
-        save_json_file(ATTENDANCE_FILE, updated_records)
-        
         logger.info(f"Removed {removed_count} attendance record(s) for {username} on {date}")
         
         return {
@@ -503,7 +1400,7 @@ async def remove_attendance(username: str, date: str = None):
             "removed": True,
             "date": date,
             "username": username,
-            "remaining_records": len(updated_records)
+            "remaining_records": storage.count_attendance()
         }
         
     except Exception as e:
@@ -511,24 +1408,14 @@ async def remove_attendance(username: str, date: str = None):
         raise HTTPException(status_code=500, detail="Error removing attendance record")
 
 @app.delete("/attendance/today/{username}")
-async def remove_today_attendance(username: str):
+def remove_today_attendance(username: str):
     """Remove today's attendance record for a specific user"""
     try:
         username = username.lower().replace(" ", "_")
         today = datetime.now().date().isoformat()
         
-        # Load attendance records
-        attendance_records = load_json_file(ATTENDANCE_FILE, [])
-        original_count = len(attendance_records)
-        
-        # Filter out today's attendance for the user
-        updated_records = [
-            record for record in attendance_records 
-            if not (record.get('username') == username and record.get('date') == today)
-        ]
-        
-        # Check if any record was removed
-        removed_count = original_count - len(updated_records)
+        # Remove today's attendance for the user
+        removed_count = storage.remove_attendance(username, today)
         
         if removed_count == 0:
             return {
@@ -538,9 +1425,6 @@ async def remove_today_attendance(username: str):
                 "username": username
             }
         
-        # Save updated records
-        save_json_file(ATTENDANCE_FILE, updated_records)
-        
         logger.info(f"Removed today's attendance for {username}")
         
         return {
@@ -548,7 +1432,7 @@ async def remove_today_attendance(username: str):
             "removed": True,
             "date": today,
             "username": username,
-            "remaining_records": len(updated_records)
+            "remaining_records": storage.count_attendance()
         }
         
     except Exception as e:
@@ -556,23 +1440,13 @@ async def remove_today_attendance(username: str):
         raise HTTPException(status_code=500, detail="Error removing attendance record")
 
 @app.delete("/attendance/all/{username}")
-async def remove_all_attendance(username: str):
+def remove_all_attendance(username: str):
     """Remove all attendance records for a specific user"""
     try:
         username = username.lower().replace(" ", "_")
         
-        # Load attendance records
-        attendance_records = load_json_file(ATTENDANCE_FILE, [])
-        original_count = len(attendance_records)
-        
-        # Filter out all attendance records for the user
-        updated_records = [
-            record for record in attendance_records 
-            if record.get('username') != username
-        ]
-        
-        # Check if any records were removed
-        removed_count = original_count - len(updated_records)
+        # Remove all attendance records for the user
+        removed_count = storage.remove_attendance(username)
         
         if removed_count == 0:
             return {
@@ -582,9 +1456,6 @@ async def remove_all_attendance(username: str):
                 "removed_count": 0
             }
         
-        # Save updated records
-        save_json_file(ATTENDANCE_FILE, updated_records)
-        
         logger.info(f"Removed all {removed_count} attendance records for {username}")
         
         return {
@@ -592,7 +1463,7 @@ async def remove_all_attendance(username: str):
             "removed": True,
             "username": username,
             "removed_count": removed_count,
-            "remaining_records": len(updated_records)
+            "remaining_records": storage.count_attendance()
         }
         
     except Exception as e:
@@ -600,28 +1471,19 @@ async def remove_all_attendance(username: str):
         raise HTTPException(status_code=500, detail="Error removing attendance records")
 
 @app.get("/user/{username}")
-async def get_user_details(username: str):
+def get_user_details(username: str):
     """Get detailed information about a specific user"""
     try:
         username = username.lower().replace(" ", "_")
         
         # Get user info
-        users = load_json_file(USERS_FILE, [])
-        user_info = next((user for user in users if user['username'] == username), None)
+        user_info = storage.get_user(username)
         
         if not user_info:
             raise HTTPException(status_code=404, detail="User not found")
         
-        # Get user's attendance records
-        attendance_records = load_json_file(ATTENDANCE_FILE, [])
-        user_attendance = [
-            record for record in attendance_records 
-            if record.get('username') == username
-        ]
-        
-        # Calculate attendance statistics
-        total_days = len(set(record.get('date') for record in user_attendance))
-        latest_attendance = max(user_attendance, key=lambda x: x.get('timestamp', ''), default=None)
+        # Maintained attendance statistics; no scan of the user's records
+        summary = storage.attendance_summary(username)
         
         # Check if image file exists
         image_path = os.path.join(UPLOAD_DIR, f"{username}.jpg")
@@ -634,11 +1496,12 @@ async def get_user_details(username: str):
             "email": user_info.get('email', ''),
             "department": user_info.get('department', ''),
             "role": user_info.get('role', ''),
-            "total_attendance_days": total_days,
-            "total_attendance_records": len(user_attendance),
-            "latest_attendance": latest_attendance.get('date') if latest_attendance else None,
+            "total_attendance_days": summary["total_days"],
+            "total_attendance_records": summary["total_records"],
+            "latest_attendance": summary["latest_date"],
             "has_image": has_image,
-            "attendance_records": user_attendance[-10:]  # Last 10 records
+            "face_samples": len(gallery.templates(username)),
+            "attendance_records": storage.recent_attendance(username, 10)  # Last 10 records
         }
         
     except HTTPException:
@@ -648,24 +1511,17 @@ async def get_user_details(username: str):
         raise HTTPException(status_code=500, detail="Error retrieving user details")
 
 @app.get("/users/detailed")
-async def get_users_detailed():
+def get_users_detailed():
     """Get detailed information about all users"""
     try:
-        users = load_json_file(USERS_FILE, [])
-        attendance_records = load_json_file(ATTENDANCE_FILE, [])
+        users = storage.list_users()
+        # One read of the maintained per-user totals instead of a scan per user
+        summaries = storage.attendance_summaries()
         
         detailed_users = []
         for user in users:
             username = user['username']
-            
-            # Get user's attendance count
-            user_attendance = [
-                record for record in attendance_records 
-                if record.get('username') == username
-            ]
-            
-            total_days = len(set(record.get('date') for record in user_attendance))
-            latest_attendance = max(user_attendance, key=lambda x: x.get('timestamp', ''), default=None)
+            summary = summaries.get(username) or empty_summary()
             
             # Check if image exists
             image_path = os.path.join(UPLOAD_DIR, f"{username}.jpg")
@@ -674,10 +1530,10 @@ async def get_users_detailed():
                 "username": username,
                 "display_name": username.replace('_', ' ').title(),
                 "registered_date": user.get('registered_date'),
-                "total_attendance_days": total_days,
-                "total_attendance_records": len(user_attendance),
-                "latest_attendance": latest_attendance.get('date') if latest_attendance else None,
-                "latest_attendance_time": latest_attendance.get('timestamp') if latest_attendance else None,
+                "total_attendance_days": summary["total_days"],
+                "total_attendance_records": summary["total_records"],
+                "latest_attendance": summary["latest_date"],
+                "latest_attendance_time": summary["latest_timestamp"],
                 "has_image": os.path.exists(image_path)
             })
         
@@ -691,59 +1547,35 @@ async def get_users_detailed():
         raise HTTPException(status_code=500, detail="Error retrieving users")
 
 @app.delete("/user/{username}")
-async def delete_user(username: str):
+def delete_user(username: str):
     """Delete a user and all their data"""
     try:
         username = username.lower().replace(" ", "_")
         
-        # Check if user exists
-        users = load_json_file(USERS_FILE, [])
-        user_exists = any(user['username'] == username for user in users)
-        
-        if not user_exists:
+        # Remove from users table (404 if the user does not exist)
+        if not storage.remove_user(username):
             raise HTTPException(status_code=404, detail="User not found")
         
-        # Remove from users file
-        users = [user for user in users if user['username'] != username]
-        save_json_file(USERS_FILE, users)
-        
         # Remove from face encodings
-        global face_encodings_db
-        if username in face_encodings_db:
-            del face_encodings_db[username]
-            # Save updated encodings
-            save_json_file(ENCODINGS_FILE, face_encodings_db)
+        remove_encoding(username)
         
-        # Remove image file
+        # Remove image files
         image_path = os.path.join(UPLOAD_DIR, f"{username}.jpg")
         if os.path.exists(image_path):
             os.remove(image_path)
+        shutil.rmtree(os.path.join(SAMPLES_DIR, username), ignore_errors=True)
         
         # Remove all attendance records for this user
-        attendance_records = load_json_file(ATTENDANCE_FILE, [])
-        original_count = len(attendance_records)
-        attendance_records = [
-            record for record in attendance_records 
-            if record.get('username') != username
-        ]
-        removed_attendance = original_count - len(attendance_records)
-        save_json_file(ATTENDANCE_FILE, attendance_records)
-        
-        # Start model retraining if users remain
-        if len(users) >= 1:
-            global training_thread
-            if training_thread is None or not training_thread.is_alive():
-                training_thread = threading.Thread(target=train_model_async)
-                training_thread.start()
+        removed_attendance = storage.remove_attendance(username)
         
         logger.info(f"Deleted user {username}, removed {removed_attendance} attendance records")
         
         return {
             "message": f"User {username.replace('_', ' ').title()} deleted successfully",
             "username": username,
-            "remaining_users": len(users),
+            "remaining_users": storage.count_users(),
             "removed_attendance_records": removed_attendance,
-            "retraining_started": len(users) >= 1
+            "retraining_started": False
         }
     
     except HTTPException:
@@ -754,30 +1586,56 @@ async def delete_user(username: str):
 
 @app.post("/retrain")
 async def retrain_model():
-    """Manually trigger model retraining"""
-    global training_thread
-    
-    if is_training:
-        return {"message": "Model is already training", "status": "training"}
-    
-    if training_thread is None or not training_thread.is_alive():
-        training_thread = threading.Thread(target=train_model_async)
-        training_thread.start()
-        return {"message": "Model retraining started", "status": "started"}
-    
-    return {"message": "Training thread is still active", "status": "active"}
+    """Queue a full model retrain; one requested during a retrain runs after it"""
+    training = training_in_progress()
+    job = schedule_retrain()
+    if training or job.requests > 1:
+        return {
+            "message": "A retrain is already running or queued; this request is queued behind it",
+            "status": "queued",
+            "job": job.to_dict()
+        }
+    return {"message": "Model retraining started", "status": "started", "job": job.to_dict()}
+
+@app.get("/jobs")
+def get_jobs():
+    """Maintenance jobs: the running one, the queue and recent history"""
+    return job_scheduler.stats()
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: int):
+    """One maintenance job by id"""
+    job = job_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus metrics: pipeline stage timings, recognition outcomes, gallery and training"""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
 
 @app.get("/model_status")
-async def get_model_status():
+def get_model_status():
     """Get current model status"""
-    users = load_json_file(USERS_FILE, [])
-    
     return {
-        "model_trained": len(face_encodings_db) > 0,
-        "total_users": len(users),
-        "training_in_progress": is_training,
-        "last_trained": datetime.now().isoformat() if face_encodings_db else None,
-        "min_users_required": 1
+        "model_trained": len(gallery) > 0,
+        "total_users": storage.count_users(),
+        "total_templates": gallery.template_count,
+        "approximate_search": gallery.ann_active,
+        "gallery_dims": gallery.dim,
+        "gallery_dtype": gallery.dtype,
+        "training_in_progress": training_in_progress(),
+        "shared_gallery": SHARED_GALLERY,
+        "gallery_generation": gallery_generation,
+        "recognition_cache": recognition_cache.stats(),
+        "training_progress": {k: v for k, v in training_progress.items() if k != "started"},
+        "last_trained": datetime.now().isoformat() if len(gallery) > 0 else None,
+        "min_users_required": 1,
+        "feature_version": FEATURE_VERSION,
+        "encodings_error": encodings_load_error,
+        "quality_gate": QUALITY_GATE,
+        "retrain_required": encodings_outdated()
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,183 @@
+import argparse
+import json
+import logging
+import os
+from typing import List, Optional
+
+import numpy as np
+
+from features import FEATURE_VERSION, LEGACY_FEATURE_VERSION
+from gallery import GalleryIndex, template_owner
+from storage import open_storage
+
+logger = logging.getLogger(__name__)
+
+PROJECTION_FILE = "projection.npz"
+
+
+class Projection:
+    """Linear projection of raw face descriptors onto their top principal directions.
+
+    The basis comes from an SVD of the L2-normalized gallery *without*
+    centering. For these non-negative histogram descriptors that keeps
+    cosine similarity in the reduced space close to the raw cosine, so
+    the confidence threshold and top-2 gap rule keep their meaning. (A
+    centered PCA or LDA would rescale every similarity.)
+
+    Stored encodings stay raw; only the in-memory gallery and the queries
+    are projected, so the basis can be refitted without re-extraction.
+    """
+
+    def __init__(self, components: np.ndarray, feature_version: Optional[str] = None,
+                 retained_energy: Optional[float] = None):
+        self.components = np.ascontiguousarray(components, dtype=np.float32)  # (raw dim, dims)
+        self.feature_version = feature_version
+        self.retained_energy = retained_energy
+
+    @property
+    def input_dim(self) -> int:
+        return self.components.shape[0]
+
+    @property
+    def dims(self) -> int:
+        return self.components.shape[1]
+
+    @classmethod
+    def fit(cls, matrix: np.ndarray, dims: int, feature_version: Optional[str] = None) -> "Projection":
+        """Fit a dims-dimensional basis to the rows of matrix"""
+        matrix = np.asarray(matrix, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms > 0, norms, 1.0)
+        dims = min(dims, matrix.shape[1])
+
+        # Eigen-decomposition of the (dim x dim) second-moment matrix; cheap for any gallery size
+        moments = matrix.T.astype(np.float64) @ matrix
+        eigenvalues, eigenvectors = np.linalg.eigh(moments)
+        order = np.argsort(eigenvalues)[::-1]
+        eigenvalues = np.clip(eigenvalues[order], 0.0, None)
+        retained = float(eigenvalues[:dims].sum() / max(eigenvalues.sum(), 1e-12))
+        return cls(eigenvectors[:, order[:dims]], feature_version, retained)
+
+    def transform(self, vectors: np.ndarray) -> np.ndarray:
+        """Project raw descriptors (one per row, or a single vector)"""
+        return np.asarray(vectors, dtype=np.float32) @ self.components
+
+    def save(self, path: str) -> None:
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            components=self.components,
+            meta=np.array(json.dumps({
+                "feature_version": self.feature_version,
+                "retained_energy": self.retained_energy,
+            }))
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Projection":
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            return cls(data["components"], meta.get("feature_version"), meta.get("retained_energy"))
+
+
+def load_projection(dataset_dir: str, feature_version: str) -> Optional[Projection]:
+    """Load the dataset's projection if one was fitted for the current feature pipeline"""
+    path = os.path.join(dataset_dir, PROJECTION_FILE)
+    if not os.path.exists(path):
+        return None
+    projection = Projection.load(path)
+    if projection.feature_version != feature_version:
+        logger.warning(
+            f"Ignoring {path}: fitted for feature version {projection.feature_version}, current is {feature_version}"
+        )
+        return None
+    return projection
+
+
+def accuracy_report(keys: List[str], matrix: np.ndarray, projection: Optional[Projection],
+                    dtype: str = "float32", max_probes: int = 2000, seed: int = 0, **options) -> dict:
+    """Compare matching on the raw float32 gallery with a projected and/or quantized one.
+
+    Templates (up to max_probes, sampled) are used as probes against the
+    gallery without them, so users with several samples measure identity
+    accuracy, and every probe measures agreement of the best user and the
+    top-2 scores with raw.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    owners = [template_owner(key) for key in keys]
+    raw = GalleryIndex.from_matrix(keys, matrix, **options)
+    reduced = GalleryIndex.from_matrix(keys, matrix, projection=projection, dtype=dtype, **options)
+
+    probe_rows = np.arange(len(keys))
+    if len(keys) > max_probes:
+        probe_rows = np.random.default_rng(seed).choice(len(keys), max_probes, replace=False)
+
+    same_best = correct_raw = correct_reduced = identity_probes = 0
+    best_error = second_error = 0.0
+    for row in probe_rows:
+        key, owner, vector = keys[row], owners[row], matrix[row]
+        # Hold the probe template out of both galleries
+        raw.remove_template(key)
+        reduced.remove_template(key)
+        raw_name, raw_best, raw_second = raw.top2(vector)
+        name, best, second = reduced.top2(vector)
+        raw.add(key, vector)
+        reduced.add(key, vector)
+
+        same_best += name == raw_name
+        best_error += abs(best - raw_best)
+        second_error += abs(second - raw_second)
+        if len(raw.templates(owner)) > 1:
+            identity_probes += 1
+            correct_raw += raw_name == owner
+            correct_reduced += name == owner
+
+    probes = max(1, len(probe_rows))
+    return {
+        "templates": len(keys),
+        "probes": len(probe_rows),
+        "raw_dims": matrix.shape[1],
+        "dims": projection.dims if projection else matrix.shape[1],
+        "dtype": dtype,
+        "retained_energy": projection.retained_energy if projection else 1.0,
+        "bytes_per_template": reduced.bytes_per_template,
+        "raw_bytes_per_template": raw.bytes_per_template,
+        "same_best_user": same_best / probes,
+        "mean_abs_best_score_error": best_error / probes,
+        "mean_abs_second_score_error": second_error / probes,
+        "identity_probes": identity_probes,
+        "raw_identity_accuracy": correct_raw / identity_probes if identity_probes else None,
+        "identity_accuracy": correct_reduced / identity_probes if identity_probes else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit a projection for the enrolled gallery and report its accuracy")
+    parser.add_argument("--dataset-dir", default="dataset")
+    parser.add_argument("--storage", default=os.environ.get("ATTEND_STORAGE", "sqlite"))
+    parser.add_argument("--dims", type=int, default=128)
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16", "int8"],
+                        help="gallery dtype to evaluate alongside the projection")
+    parser.add_argument("--report-only", action="store_true", help="evaluate without writing the projection")
+    args = parser.parse_args()
+
+    storage = open_storage(args.storage, args.dataset_dir, FEATURE_VERSION, LEGACY_FEATURE_VERSION)
+    keys, matrix = storage.encodings.load()
+    feature_version = storage.encodings.stored_feature_version
+    storage.close()
+    if len(keys) < 2:
+        raise SystemExit("Need at least two enrolled templates to fit a projection")
+    if feature_version != FEATURE_VERSION:
+        raise SystemExit(f"Stored encodings use feature version {feature_version}; retrain before fitting")
+
+    projection = Projection.fit(matrix, args.dims, FEATURE_VERSION)
+    print(json.dumps(accuracy_report(keys, matrix, projection, args.dtype), indent=2))
+    if not args.report_only:
+        path = os.path.join(args.dataset_dir, PROJECTION_FILE)
+        projection.save(path)
+        print(f"Wrote {projection.dims}-d projection to {path}")
+
+
+if __name__ == "__main__":
+    main()
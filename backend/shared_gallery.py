@@ -0,0 +1,338 @@
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from gallery import GalleryIndex
+
+if os.name == "nt":
+    import msvcrt
+
+    def _lock_file(f, blocking: bool = True) -> bool:
+        """Lock the first byte of an open lock file; LK_LOCK gives up after 10 s, so poll instead"""
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                return True
+            except OSError:
+                if not blocking:
+                    return False
+                time.sleep(0.05)
+
+    def _unlock_file(f) -> None:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock_file(f, blocking: bool = True) -> bool:
+        """flock an open lock file; False if it is held elsewhere and blocking is off"""
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def _unlock_file(f) -> None:
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+SNAPSHOT_FORMAT = "attend-shared-gallery"
+SNAPSHOT_VERSION = 2
+CHANGE_LOG = "changes.log"
+
+# Superseded snapshots kept so a worker that just read the generation file can still open its files
+KEEP_SNAPSHOTS = 2
+
+
+class SharedGallery:
+    """Gallery snapshot and change log shared by every server worker process.
+
+    The directory holds one subdirectory per published generation with the
+    index's stored rows as ``.npy`` files (see GalleryIndex.state) plus
+    ``meta.json``, and a ``GENERATION`` file naming the live one. Workers
+    map the row files read-only, so the page cache holds one copy of the
+    gallery however many processes serve it. A publisher writes the new
+    generation's files first and then atomically replaces ``GENERATION``,
+    which is the commit point; readers notice the replaced file with one
+    ``stat`` call.
+
+    Enrollments and deletions do not republish the rows: each appends one
+    record to the live generation's ``changes.log`` (the changed keys and
+    their raw descriptors), which workers replay onto their index. Every
+    snapshot and record carries a sequence number that increases with each
+    change. Full snapshots are written by retrains, rebuilds and
+    compaction, which folds the log back into mapped rows.
+
+    Two lock files coordinate writers across processes: ``publish.lock``
+    serializes read-modify-publish cycles, and ``train.lock`` is held by
+    the single worker running a retrain.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.generation_path = os.path.join(directory, "GENERATION")
+        os.makedirs(directory, exist_ok=True)
+        self._loaded_stat = None
+        self._log_path: Optional[str] = None
+        # End of the last complete log record applied, and the sequence number it carried
+        self._log_offset = 0
+        self._sequence = 0
+        self._training_file = None
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.generation_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def current_generation(self) -> int:
+        """Generation of the live snapshot (0 before the first publish)"""
+        try:
+            with open(self.generation_path) as f:
+                return int(f.read())
+        except FileNotFoundError:
+            return 0
+
+    def snapshot_changed(self) -> bool:
+        """True when a snapshot was published since this process last loaded one"""
+        return self._stat() != self._loaded_stat
+
+    def changed(self) -> bool:
+        """True when a snapshot or change record was published since this process last read them"""
+        if self.snapshot_changed():
+            return True
+        if self._log_path is None:
+            return False
+        try:
+            return os.path.getsize(self._log_path) > self._log_offset
+        except FileNotFoundError:
+            return False
+
+    def _snapshot_dir(self, generation: int) -> str:
+        return os.path.join(self.directory, str(generation))
+
+    def load(self, **options) -> Optional[Tuple[int, GalleryIndex]]:
+        """Map the live snapshot and replay its change log, returning (sequence, index) or None if none was published"""
+        for _ in range(3):
+            stat = self._stat()
+            generation = self.current_generation()
+            if generation == 0:
+                return None
+            snapshot_dir = self._snapshot_dir(generation)
+            try:
+                with open(os.path.join(snapshot_dir, "meta.json")) as f:
+                    meta = json.load(f)
+                arrays = {
+                    name: np.load(os.path.join(snapshot_dir, f"{name}.npy"), mmap_mode="r")
+                    for name in meta["arrays"]
+                }
+            except FileNotFoundError:
+                # Pruned by a publisher that finished two generations meanwhile; read GENERATION again
+                continue
+            if meta.get("format") != SNAPSHOT_FORMAT or meta.get("version") != SNAPSHOT_VERSION:
+                raise ValueError(f"Unsupported shared gallery snapshot in {snapshot_dir}")
+            projection = options.get("projection")
+            if meta["projection_dims"] != (projection.dims if projection is not None else None):
+                raise ValueError(f"Shared gallery snapshot in {snapshot_dir} was built with another projection")
+            index = GalleryIndex.from_state(meta["keys"], arrays, **options)
+            self._loaded_stat = stat
+            self._log_path = os.path.join(snapshot_dir, CHANGE_LOG)
+            self._log_offset = 0
+            self._sequence = meta["sequence"]
+            return self.update(index), index
+        raise RuntimeError(f"Shared gallery in {self.directory} changed too often to load")
+
+    def update(self, index: GalleryIndex) -> int:
+        """Replay change records logged since the last load or update onto index; returns the sequence"""
+        records, self._log_offset = self._read_log(self._log_path, self._log_offset)
+        for sequence, changes in records:
+            self._apply(index, changes)
+            self._sequence = sequence
+        return self._sequence
+
+    def refresh(self, index: GalleryIndex, **options) -> Optional[Tuple[int, GalleryIndex]]:
+        """Bring index (from load) up to date: a new snapshot is loaded, new change records replayed"""
+        if self.snapshot_changed():
+            return self.load(**options)
+        return self.update(index), index
+
+    def append(self, index: GalleryIndex, changes: List[tuple]) -> int:
+        """Apply ("add", key, features) / ("remove", username, None) changes to index and log them.
+
+        index must be up to date (see refresh); call with locked() held.
+        Returns the sequence number of the new record.
+        """
+        self._apply(index, changes)
+        rows = [np.asarray(features, dtype=np.float32).ravel() for op, _, features in changes if op == "add"]
+        payload = np.stack(rows).tobytes() if rows else b""
+        header = {
+            "sequence": self._sequence + 1,
+            "changes": [[op, key] for op, key, _ in changes],
+            "dim": len(rows[0]) if rows else 0,
+            "bytes": len(payload),
+        }
+        record = json.dumps(header).encode() + b"\n" + payload
+        with open(self._log_path, "ab") as f:
+            # Drop a partial record left by a writer that died mid-append
+            f.truncate(self._log_offset)
+            f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+        self._log_offset += len(record)
+        self._sequence += 1
+        return self._sequence
+
+    def pending_changes(self) -> int:
+        """Bytes of change log behind the live snapshot, as of the last load or update"""
+        return self._log_offset
+
+    @staticmethod
+    def _read_log(path: Optional[str], offset: int) -> Tuple[List[Tuple[int, List[tuple]]], int]:
+        """Complete (sequence, changes) records of a change log after offset, and the offset past them"""
+        if path is None:
+            return [], offset
+        try:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], offset
+
+        records = []
+        position = 0
+        while True:
+            # A record still being written (or torn by a crash) ends the log for now
+            newline = data.find(b"\n", position)
+            if newline < 0:
+                break
+            header = json.loads(data[position:newline])
+            end = newline + 1 + header["bytes"]
+            if end > len(data):
+                break
+            rows = iter(np.frombuffer(data[newline + 1:end], dtype=np.float32).reshape(-1, header["dim"] or 1))
+            changes = [(op, key, next(rows) if op == "add" else None) for op, key in header["changes"]]
+            records.append((header["sequence"], changes))
+            position = end
+        return records, offset + position
+
+    @staticmethod
+    def _apply(index: GalleryIndex, changes: List[tuple]) -> None:
+        for op, key, features in changes:
+            if op == "add":
+                index.add(key, features)
+            else:
+                index.remove(key)
+
+    def _latest_sequence(self) -> int:
+        """Sequence of the newest snapshot or change record on disk"""
+        generation = self.current_generation()
+        if generation == 0:
+            return 0
+        snapshot_dir = self._snapshot_dir(generation)
+        with open(os.path.join(snapshot_dir, "meta.json")) as f:
+            sequence = json.load(f).get("sequence", 0)
+        records, _ = self._read_log(os.path.join(snapshot_dir, CHANGE_LOG), 0)
+        return records[-1][0] if records else sequence
+
+    def publish(self, index: GalleryIndex, feature_version: Optional[str] = None) -> int:
+        """Write index as the next generation with an empty change log and make it live; call with locked() held"""
+        generation = self.current_generation() + 1
+        sequence = self._latest_sequence() + 1
+        snapshot_dir = self._snapshot_dir(generation)
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+        os.makedirs(snapshot_dir)
+
+        keys, arrays = index.state()
+        for name, array in arrays.items():
+            with open(os.path.join(snapshot_dir, f"{name}.npy"), "wb") as f:
+                np.save(f, np.ascontiguousarray(array))
+                f.flush()
+                os.fsync(f.fileno())
+        meta = {
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "generation": generation,
+            "sequence": sequence,
+            "feature_version": feature_version,
+            "projection_dims": index.projection.dims if index.projection is not None else None,
+            "arrays": sorted(arrays),
+            "keys": keys,
+        }
+        with open(os.path.join(snapshot_dir, "meta.json"), "w") as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        tmp_path = self.generation_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(generation))
+            f.flush()
+            os.fsync(f.fileno())
+        self._replace(tmp_path, self.generation_path)
+
+        # Unlinked files stay readable by workers that still map them; Windows refuses to delete
+        # mapped files, so those are retried on the next publish
+        for name in os.listdir(self.directory):
+            if name.isdigit() and int(name) <= generation - KEEP_SNAPSHOTS:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+        return sequence
+
+    @staticmethod
+    def _replace(source: str, target: str) -> None:
+        """os.replace, retried while a reader on Windows briefly holds the target open"""
+        for attempt in range(50):
+            try:
+                os.replace(source, target)
+                return
+            except PermissionError:
+                if os.name != "nt" or attempt == 49:
+                    raise
+                time.sleep(0.01)
+
+    def stored_feature_version(self) -> Optional[str]:
+        """feature_version recorded with the live snapshot"""
+        generation = self.current_generation()
+        try:
+            with open(os.path.join(self._snapshot_dir(generation), "meta.json")) as f:
+                return json.load(f).get("feature_version")
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def locked(self):
+        """Exclusive publish lock across processes and threads"""
+        with open(os.path.join(self.directory, "publish.lock"), "a") as f:
+            _lock_file(f)
+            try:
+                yield
+            finally:
+                _unlock_file(f)
+
+    def acquire_training(self, blocking: bool = False) -> bool:
+        """Become the training owner, waiting for the current one if blocking"""
+        f = open(os.path.join(self.directory, "train.lock"), "a")
+        if not _lock_file(f, blocking):
+            f.close()
+            return False
+        self._training_file = f
+        return True
+
+    def release_training(self) -> None:
+        if self._training_file is not None:
+            _unlock_file(self._training_file)
+            self._training_file.close()
+            self._training_file = None
+
+    def training_active(self) -> bool:
+        """True while any worker (this one included) holds the training lock"""
+        with open(os.path.join(self.directory, "train.lock"), "a") as f:
+            if not _lock_file(f, blocking=False):
+                return True
+            _unlock_file(f)
+            return False
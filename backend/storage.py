@@ -0,0 +1,717 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from attendance_log import AttendanceLog, empty_summary
+from encoding_store import EncodingStore
+
+logger = logging.getLogger(__name__)
+
+USER_FIELDS = ("username", "registered_date", "image_path", "email", "department", "role")
+ATTENDANCE_FIELDS = ("username", "timestamp", "date", "confidence", "method")
+# Keys accepted in attendance query filters; dates are inclusive ISO dates
+ATTENDANCE_FILTERS = ("date_from", "date_to", "username", "department", "method")
+SUMMARY_FIELDS = ("total_days", "total_records", "latest_timestamp", "latest_date")
+
+
+class Storage:
+    """Persistence interface for users, attendance and face encodings.
+
+    Endpoints only talk to this interface. ``encodings`` is an EncodingStore
+    compatible object owned by the backend.
+    """
+
+    encodings = None
+
+    def list_users(self) -> List[dict]:
+        raise NotImplementedError
+
+    def get_user(self, username: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def count_users(self) -> int:
+        raise NotImplementedError
+
+    def add_user(self, user: dict) -> bool:
+        """Insert a user, returning False if the username is taken"""
+        raise NotImplementedError
+
+    def add_users(self, users: List[dict]) -> List[bool]:
+        """Insert several users in one batch; per-user results like add_user"""
+        return [self.add_user(user) for user in users]
+
+    def remove_user(self, username: str) -> bool:
+        raise NotImplementedError
+
+    def list_attendance(self) -> List[dict]:
+        raise NotImplementedError
+
+    def attendance_for_date(self, date: str) -> List[dict]:
+        raise NotImplementedError
+
+    def attendance_for_user(self, username: str) -> List[dict]:
+        raise NotImplementedError
+
+    def count_attendance(self, filters: Optional[dict] = None) -> int:
+        """Number of records, or of records matching filters"""
+        raise NotImplementedError
+
+    def query_attendance(self, filters: Optional[dict] = None, after: Optional[int] = None,
+                         limit: int = 100) -> Tuple[List[dict], Optional[int]]:
+        """One page of records matching filters, in insertion order.
+
+        after is the cursor returned with the previous page (None for the
+        first page). Returns (records, cursor of the next page or None).
+        """
+        raise NotImplementedError
+
+    def attendance_summary(self, username: str) -> dict:
+        """Maintained per-user totals: total_days, total_records, latest_timestamp, latest_date"""
+        raise NotImplementedError
+
+    def attendance_summaries(self) -> Dict[str, dict]:
+        """attendance_summary for every user with records"""
+        raise NotImplementedError
+
+    def recent_attendance(self, username: str, limit: int = 10) -> List[dict]:
+        """A user's last limit records, oldest first"""
+        raise NotImplementedError
+
+    def iter_attendance(self, filters: Optional[dict] = None, batch_size: int = 1000) -> Iterator[dict]:
+        """Stream every record matching filters, one page query at a time"""
+        cursor = None
+        while True:
+            records, cursor = self.query_attendance(filters, cursor, batch_size)
+            yield from records
+            if cursor is None:
+                return
+
+    def is_marked(self, username: str, date: str) -> bool:
+        raise NotImplementedError
+
+    def mark_attendance(self, record: dict) -> bool:
+        """Insert a record unless the user is already marked for its date"""
+        raise NotImplementedError
+
+    def mark_attendance_many(self, records: List[dict]) -> List[bool]:
+        """Mark several records at once; returns per-record results like mark_attendance"""
+        return [self.mark_attendance(record) for record in records]
+
+    def remove_attendance(self, username: str, date: Optional[str] = None) -> int:
+        """Remove a user's records for one date (or all dates), returning the count"""
+        raise NotImplementedError
+
+    def compact(self) -> dict:
+        """Reclaim space left behind by removals; run as a background job"""
+        return {}
+
+    def close(self) -> None:
+        pass
+
+
+class JsonStorage(Storage):
+    """Flat-file backend: users.json, the attendance journal and the binary encoding store"""
+
+    def __init__(self, dataset_dir: str, feature_version: Optional[str] = None):
+        self.users_file = os.path.join(dataset_dir, "users.json")
+        self.attendance = AttendanceLog(os.path.join(dataset_dir, "attendance.jsonl"))
+        self.encodings = EncodingStore(dataset_dir, feature_version=feature_version)
+        self._users_lock = threading.Lock()
+        self._users = self._read_users()
+        legacy_attendance = os.path.join(dataset_dir, "attendance.json")
+        if not self.attendance.exists() and os.path.exists(legacy_attendance):
+            with open(legacy_attendance, "r") as f:
+                imported = self.attendance.import_records(json.load(f))
+            logger.info(f"Migrated {imported} attendance records from {legacy_attendance}")
+        self.attendance.load()
+
+    def _read_users(self) -> List[dict]:
+        if not os.path.exists(self.users_file):
+            return []
+        try:
+            with open(self.users_file, "r") as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"Error loading {self.users_file}: {e}")
+            return []
+
+    def _write_users(self) -> None:
+        tmp_path = self.users_file + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._users, f, indent=2, default=str)
+        os.replace(tmp_path, self.users_file)
+
+    def list_users(self) -> List[dict]:
+        with self._users_lock:
+            return list(self._users)
+
+    def get_user(self, username: str) -> Optional[dict]:
+        with self._users_lock:
+            return next((user for user in self._users if user['username'] == username), None)
+
+    def count_users(self) -> int:
+        return len(self._users)
+
+    def add_user(self, user: dict) -> bool:
+        with self._users_lock:
+            if any(existing['username'] == user['username'] for existing in self._users):
+                return False
+            self._users.append(user)
+            self._write_users()
+            return True
+
+    def add_users(self, users: List[dict]) -> List[bool]:
+        with self._users_lock:
+            taken = {existing['username'] for existing in self._users}
+            added = []
+            for user in users:
+                added.append(user['username'] not in taken)
+                if added[-1]:
+                    taken.add(user['username'])
+                    self._users.append(user)
+            if any(added):
+                self._write_users()
+            return added
+
+    def remove_user(self, username: str) -> bool:
+        with self._users_lock:
+            remaining = [user for user in self._users if user['username'] != username]
+            if len(remaining) == len(self._users):
+                return False
+            self._users = remaining
+            self._write_users()
+            return True
+
+    def list_attendance(self) -> List[dict]:
+        return self.attendance.all()
+
+    def attendance_for_date(self, date: str) -> List[dict]:
+        return self.attendance.for_date(date)
+
+    def attendance_for_user(self, username: str) -> List[dict]:
+        return self.attendance.for_user(username)
+
+    def count_attendance(self, filters: Optional[dict] = None) -> int:
+        if not filters or all(value is None for value in filters.values()):
+            return len(self.attendance)
+        return self.attendance.count(**self._log_filters(filters))
+
+    def query_attendance(self, filters: Optional[dict] = None, after: Optional[int] = None,
+                         limit: int = 100) -> Tuple[List[dict], Optional[int]]:
+        return self.attendance.query(after=after, limit=limit, **self._log_filters(filters or {}))
+
+    def attendance_summary(self, username: str) -> dict:
+        return self.attendance.summary(username)
+
+    def attendance_summaries(self) -> Dict[str, dict]:
+        return self.attendance.summaries()
+
+    def recent_attendance(self, username: str, limit: int = 10) -> List[dict]:
+        return self.attendance.for_user(username)[-limit:]
+
+    def _log_filters(self, filters: dict) -> dict:
+        """AttendanceLog.query arguments for storage filters (department becomes a username set)"""
+        usernames = None
+        if filters.get("department") is not None:
+            with self._users_lock:
+                usernames = {user["username"] for user in self._users
+                             if user.get("department") == filters["department"]}
+        return {
+            "username": filters.get("username"),
+            "usernames": usernames,
+            "date_from": filters.get("date_from"),
+            "date_to": filters.get("date_to"),
+            "method": filters.get("method"),
+        }
+
+    def is_marked(self, username: str, date: str) -> bool:
+        return self.attendance.is_marked(username, date)
+
+    def mark_attendance(self, record: dict) -> bool:
+        return self.attendance.mark(record)
+
+    def mark_attendance_many(self, records: List[dict]) -> List[bool]:
+        return self.attendance.mark_many(records)
+
+    def remove_attendance(self, username: str, date: Optional[str] = None) -> int:
+        return self.attendance.remove(username, date)
+
+    def compact(self) -> dict:
+        self.encodings.compact()
+        self.attendance.compact()
+        return {"encodings": len(self.encodings), "attendance_records": len(self.attendance)}
+
+    def close(self) -> None:
+        self.attendance.close()
+
+
+# SQLite compaction runs VACUUM once free pages exceed this share of the file
+VACUUM_FREE_FRACTION = 0.25
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    registered_date TEXT,
+    image_path TEXT,
+    email TEXT NOT NULL DEFAULT '',
+    department TEXT NOT NULL DEFAULT '',
+    role TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_users_department ON users (department);
+
+CREATE TABLE IF NOT EXISTS attendance (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    timestamp TEXT,
+    date TEXT NOT NULL,
+    confidence REAL,
+    method TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_attendance_date_user ON attendance (date, username);
+CREATE INDEX IF NOT EXISTS idx_attendance_user_date ON attendance (username, date);
+CREATE INDEX IF NOT EXISTS idx_attendance_method_date ON attendance (method, date);
+
+-- Per-user attendance totals, kept in step with the attendance table by SQLiteStorage
+CREATE TABLE IF NOT EXISTS attendance_summary (
+    username TEXT PRIMARY KEY,
+    total_days INTEGER NOT NULL,
+    total_records INTEGER NOT NULL,
+    latest_timestamp TEXT,
+    latest_date TEXT
+);
+
+CREATE TABLE IF NOT EXISTS encodings (
+    username TEXT PRIMARY KEY,
+    vector BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class SQLiteDatabase:
+    """One SQLite file in WAL mode with a connection per thread"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self.connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class SQLiteEncodingStore:
+    """EncodingStore-compatible encodings table (one float32 BLOB per user)"""
+
+    def __init__(self, db: SQLiteDatabase, feature_version: Optional[str] = None):
+        self.db = db
+        self.feature_version = feature_version
+
+    def exists(self) -> bool:
+        row = self.db.connection().execute("SELECT value FROM meta WHERE key = 'feature_version'").fetchone()
+        return row is not None
+
+    @property
+    def stored_feature_version(self) -> Optional[str]:
+        row = self.db.connection().execute("SELECT value FROM meta WHERE key = 'feature_version'").fetchone()
+        return row["value"] if row else None
+
+    def __len__(self) -> int:
+        return self.db.connection().execute("SELECT COUNT(*) FROM encodings").fetchone()[0]
+
+    def load(self) -> Tuple[List[str], np.ndarray]:
+        rows = self.db.connection().execute("SELECT username, vector FROM encodings").fetchall()
+        if not rows:
+            return [], np.zeros((0, 0), dtype=np.float32)
+        usernames = [row["username"] for row in rows]
+        matrix = np.frombuffer(b"".join(row["vector"] for row in rows), dtype=np.float32)
+        return usernames, matrix.reshape(len(rows), -1)
+
+    def append(self, username: str, encoding) -> None:
+        self.append_many({username: encoding})
+
+    def append_many(self, encodings: Dict[str, np.ndarray]) -> None:
+        rows = [(u, np.asarray(v, dtype=np.float32).ravel().tobytes()) for u, v in encodings.items()]
+        with self.db.connection() as conn:
+            conn.executemany("INSERT OR REPLACE INTO encodings (username, vector) VALUES (?, ?)", rows)
+            if self.feature_version is not None:
+                conn.execute(
+                    "INSERT OR IGNORE INTO meta (key, value) VALUES ('feature_version', ?)",
+                    (self.feature_version,)
+                )
+
+    def remove(self, username: str) -> bool:
+        with self.db.connection() as conn:
+            return conn.execute("DELETE FROM encodings WHERE username = ?", (username,)).rowcount > 0
+
+    def replace_all(self, encodings: Dict[str, np.ndarray], feature_version: Optional[str] = None) -> None:
+        rows = [(u, np.asarray(v, dtype=np.float32).ravel().tobytes()) for u, v in encodings.items()]
+        with self.db.connection() as conn:
+            conn.execute("DELETE FROM encodings")
+            conn.executemany("INSERT INTO encodings (username, vector) VALUES (?, ?)", rows)
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('feature_version', ?)",
+                (feature_version or self.feature_version,)
+            )
+
+    def to_dict(self) -> Dict[str, list]:
+        usernames, matrix = self.load()
+        return {u: matrix[i].tolist() for i, u in enumerate(usernames)}
+
+    def export_json(self, json_path: str) -> int:
+        encodings = self.to_dict()
+        with open(json_path, "w") as f:
+            json.dump(encodings, f, indent=2)
+        return len(encodings)
+
+    def import_json(self, json_path: str, feature_version: Optional[str] = None) -> int:
+        with open(json_path, "r") as f:
+            encodings = json.load(f)
+        self.replace_all(encodings, feature_version)
+        return len(encodings)
+
+
+def _user_values(user: dict) -> tuple:
+    """Column values for a user dict; optional text fields default to ''"""
+    return tuple(user.get(field) or ("" if field in ("email", "department", "role") else None) for field in USER_FIELDS)
+
+
+def _attendance_row(row: sqlite3.Row) -> dict:
+    return {field: row[field] for field in ATTENDANCE_FIELDS}
+
+
+def _summary_row(row: sqlite3.Row) -> dict:
+    return {field: row[field] for field in SUMMARY_FIELDS}
+
+
+def _refresh_summary(conn: sqlite3.Connection, username: Optional[str] = None) -> None:
+    """Recompute attendance_summary rows from attendance for one user (or everyone)"""
+    condition = "WHERE username = ?" if username is not None else ""
+    params = (username,) if username is not None else ()
+    conn.execute(f"DELETE FROM attendance_summary {condition}", params)
+    conn.execute(
+        "INSERT INTO attendance_summary (username, total_days, total_records, latest_timestamp, latest_date) "
+        "SELECT username, COUNT(DISTINCT date), COUNT(*), MAX(timestamp), NULL "
+        f"FROM attendance {condition} GROUP BY username",
+        params
+    )
+    conn.execute(
+        "UPDATE attendance_summary SET latest_date = (SELECT date FROM attendance "
+        "WHERE attendance.username = attendance_summary.username ORDER BY timestamp DESC, id LIMIT 1) "
+        f"{condition}",
+        params
+    )
+
+
+def _attendance_where(filters: dict) -> Tuple[List[str], list]:
+    """SQL conditions and parameters for attendance filters"""
+    conditions, params = [], []
+    if filters.get("date_from") is not None:
+        conditions.append("date >= ?")
+        params.append(filters["date_from"])
+    if filters.get("date_to") is not None:
+        conditions.append("date <= ?")
+        params.append(filters["date_to"])
+    if filters.get("username") is not None:
+        conditions.append("username = ?")
+        params.append(filters["username"])
+    if filters.get("department") is not None:
+        conditions.append("username IN (SELECT username FROM users WHERE department = ?)")
+        params.append(filters["department"])
+    if filters.get("method") is not None:
+        conditions.append("method = ?")
+        params.append(filters["method"])
+    return conditions, params
+
+
+class SQLiteStorage(Storage):
+    """SQLite backend (WAL mode) with indexed users, attendance and encodings tables"""
+
+    def __init__(self, db_path: str, feature_version: Optional[str] = None):
+        self.db = SQLiteDatabase(db_path)
+        self.encodings = SQLiteEncodingStore(self.db, feature_version)
+        with self.db.connection() as conn:
+            # Databases created before the summary table existed are summarized once
+            if (conn.execute("SELECT 1 FROM attendance LIMIT 1").fetchone()
+                    and not conn.execute("SELECT 1 FROM attendance_summary LIMIT 1").fetchone()):
+                _refresh_summary(conn)
+
+    def _query(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        return self.db.connection().execute(sql, params).fetchall()
+
+    def list_users(self) -> List[dict]:
+        return [dict(row) for row in self._query("SELECT * FROM users ORDER BY rowid")]
+
+    def get_user(self, username: str) -> Optional[dict]:
+        rows = self._query("SELECT * FROM users WHERE username = ?", (username,))
+        return dict(rows[0]) if rows else None
+
+    def count_users(self) -> int:
+        return self._query("SELECT COUNT(*) FROM users")[0][0]
+
+    def add_user(self, user: dict) -> bool:
+        values = _user_values(user)
+        with self.db.connection() as conn:
+            cursor = conn.execute(
+                f"INSERT OR IGNORE INTO users ({', '.join(USER_FIELDS)}) VALUES ({', '.join('?' * len(USER_FIELDS))})",
+                values
+            )
+            return cursor.rowcount > 0
+
+    def add_users(self, users: List[dict]) -> List[bool]:
+        sql = f"INSERT OR IGNORE INTO users ({', '.join(USER_FIELDS)}) VALUES ({', '.join('?' * len(USER_FIELDS))})"
+        with self.db.connection() as conn:
+            return [conn.execute(sql, _user_values(user)).rowcount > 0 for user in users]
+
+    def remove_user(self, username: str) -> bool:
+        with self.db.connection() as conn:
+            return conn.execute("DELETE FROM users WHERE username = ?", (username,)).rowcount > 0
+
+    def list_attendance(self) -> List[dict]:
+        return [_attendance_row(row) for row in self._query("SELECT * FROM attendance ORDER BY id")]
+
+    def attendance_for_date(self, date: str) -> List[dict]:
+        rows = self._query("SELECT * FROM attendance WHERE date = ? ORDER BY id", (date,))
+        return [_attendance_row(row) for row in rows]
+
+    def attendance_for_user(self, username: str) -> List[dict]:
+        rows = self._query("SELECT * FROM attendance WHERE username = ? ORDER BY id", (username,))
+        return [_attendance_row(row) for row in rows]
+
+    def count_attendance(self, filters: Optional[dict] = None) -> int:
+        conditions, params = _attendance_where(filters or {})
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self._query(f"SELECT COUNT(*) FROM attendance{where}", tuple(params))[0][0]
+
+    def attendance_summary(self, username: str) -> dict:
+        rows = self._query("SELECT * FROM attendance_summary WHERE username = ?", (username,))
+        return _summary_row(rows[0]) if rows else empty_summary()
+
+    def attendance_summaries(self) -> Dict[str, dict]:
+        return {row["username"]: _summary_row(row) for row in self._query("SELECT * FROM attendance_summary")}
+
+    def recent_attendance(self, username: str, limit: int = 10) -> List[dict]:
+        rows = self._query("SELECT * FROM attendance WHERE username = ? ORDER BY id DESC LIMIT ?", (username, limit))
+        return [_attendance_row(row) for row in reversed(rows)]
+
+    def query_attendance(self, filters: Optional[dict] = None, after: Optional[int] = None,
+                         limit: int = 100) -> Tuple[List[dict], Optional[int]]:
+        # Keyset pagination on the rowid: each page is an index range scan, however deep
+        conditions, params = _attendance_where(filters or {})
+        if after is not None:
+            conditions.append("id > ?")
+            params.append(after)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._query(f"SELECT * FROM attendance{where} ORDER BY id LIMIT ?", tuple(params) + (limit + 1,))
+        next_cursor = rows[limit - 1]["id"] if len(rows) > limit else None
+        return [_attendance_row(row) for row in rows[:limit]], next_cursor
+
+    def is_marked(self, username: str, date: str) -> bool:
+        rows = self._query("SELECT 1 FROM attendance WHERE date = ? AND username = ? LIMIT 1", (date, username))
+        return bool(rows)
+
+    def mark_attendance(self, record: dict) -> bool:
+        return self.mark_attendance_many([record])[0]
+
+    def mark_attendance_many(self, records: List[dict]) -> List[bool]:
+        # Check and insert in one statement so concurrent requests cannot both mark;
+        # all records (and their summary updates) share one transaction
+        results = []
+        with self.db.connection() as conn:
+            for record in records:
+                marked = conn.execute(
+                    f"INSERT INTO attendance ({', '.join(ATTENDANCE_FIELDS)}) "
+                    f"SELECT {', '.join('?' * len(ATTENDANCE_FIELDS))} "
+                    "WHERE NOT EXISTS (SELECT 1 FROM attendance WHERE date = ? AND username = ?)",
+                    tuple(record.get(field) for field in ATTENDANCE_FIELDS) + (record["date"], record["username"])
+                ).rowcount > 0
+                if marked:
+                    # A marked record is always the user's first for its date, so it adds a day
+                    conn.execute(
+                        "INSERT INTO attendance_summary (username, total_days, total_records, latest_timestamp, "
+                        "latest_date) VALUES (?, 1, 1, ?, ?) "
+                        "ON CONFLICT (username) DO UPDATE SET "
+                        "total_days = total_days + 1, total_records = total_records + 1, "
+                        "latest_date = CASE WHEN latest_timestamp IS NULL OR excluded.latest_timestamp > latest_timestamp "
+                        "THEN excluded.latest_date ELSE latest_date END, "
+                        "latest_timestamp = CASE WHEN latest_timestamp IS NULL "
+                        "OR excluded.latest_timestamp > latest_timestamp "
+                        "THEN excluded.latest_timestamp ELSE latest_timestamp END",
+                        (record["username"], record.get("timestamp"), record["date"])
+                    )
+                results.append(marked)
+        return results
+
+    def remove_attendance(self, username: str, date: Optional[str] = None) -> int:
+        with self.db.connection() as conn:
+            if date is None:
+                cursor = conn.execute("DELETE FROM attendance WHERE username = ?", (username,))
+            else:
+                cursor = conn.execute("DELETE FROM attendance WHERE username = ? AND date = ?", (username, date))
+            if cursor.rowcount:
+                _refresh_summary(conn, username)
+            return cursor.rowcount
+
+    def import_records(self, users: List[dict], attendance: List[dict], encodings: Tuple[List[str], np.ndarray],
+                       feature_version: Optional[str]) -> None:
+        """Bulk-load users, attendance and encodings in one transaction"""
+        usernames, matrix = encodings
+        with self.db.connection() as conn:
+            conn.executemany(
+                f"INSERT OR IGNORE INTO users ({', '.join(USER_FIELDS)}) VALUES ({', '.join('?' * len(USER_FIELDS))})",
+                [_user_values(user) for user in users]
+            )
+            conn.executemany(
+                f"INSERT INTO attendance ({', '.join(ATTENDANCE_FIELDS)}) VALUES ({', '.join('?' * len(ATTENDANCE_FIELDS))})",
+                [tuple(record.get(field) for field in ATTENDANCE_FIELDS) for record in attendance]
+            )
+            _refresh_summary(conn)
+            conn.executemany(
+                "INSERT OR REPLACE INTO encodings (username, vector) VALUES (?, ?)",
+                [(u, np.asarray(matrix[i], dtype=np.float32).tobytes()) for i, u in enumerate(usernames)]
+            )
+            if feature_version is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('feature_version', ?)",
+                    (feature_version,)
+                )
+
+    def compact(self) -> dict:
+        conn = self.db.connection()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        # VACUUM rewrites the whole file; only worth it once a good share of it is free
+        vacuumed = free > VACUUM_FREE_FRACTION * pages
+        if vacuumed:
+            conn.execute("VACUUM")
+        return {"pages": pages, "free_pages": free, "vacuumed": vacuumed}
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def migrate_json_to_sqlite(dataset_dir: str, target: SQLiteStorage, legacy_feature_version: Optional[str] = None) -> dict:
+    """One-shot copy of the flat-file backend (users, attendance, encodings) into SQLite.
+
+    The flat files are only read, never converted in place; unreadable ones raise.
+    """
+    users = []
+    users_file = os.path.join(dataset_dir, "users.json")
+    if os.path.exists(users_file):
+        with open(users_file, "r") as f:
+            users = json.load(f)
+
+    journal = AttendanceLog(os.path.join(dataset_dir, "attendance.jsonl"))
+    legacy_attendance = os.path.join(dataset_dir, "attendance.json")
+    if journal.exists():
+        journal.load()
+        attendance = journal.all()
+    elif os.path.exists(legacy_attendance):
+        with open(legacy_attendance, "r") as f:
+            attendance = json.load(f)
+    else:
+        attendance = []
+
+    source_encodings = EncodingStore(dataset_dir)
+    if source_encodings.exists():
+        encodings = source_encodings.load()
+        feature_version = source_encodings.stored_feature_version or legacy_feature_version
+    else:
+        legacy_encodings = os.path.join(dataset_dir, "face_encodings.json")
+        encodings = ([], np.zeros((0, 0), dtype=np.float32))
+        feature_version = None
+        if os.path.exists(legacy_encodings):
+            with open(legacy_encodings, "r") as f:
+                data = json.load(f)
+            if data:
+                encodings = (list(data), np.array(list(data.values()), dtype=np.float32))
+                feature_version = legacy_feature_version
+
+    target.import_records(users, attendance, encodings, feature_version)
+    return {"users": len(users), "attendance": len(attendance), "encodings": len(encodings[0])}
+
+
+def migrate_to_new_database(dataset_dir: str, db_path: str, legacy_feature_version: Optional[str] = None) -> dict:
+    """Migrate the flat files into a database built beside db_path and moved into place when complete.
+
+    An interrupted migration leaves no database at db_path, so it is retried from scratch.
+    """
+    tmp_path = db_path + ".tmp"
+    _remove_database(tmp_path)
+    target = SQLiteStorage(tmp_path)
+    try:
+        counts = migrate_json_to_sqlite(dataset_dir, target, legacy_feature_version)
+        # Fold the WAL into the main file so the rename moves the whole database
+        target.db.connection().execute("PRAGMA journal_mode=DELETE")
+    except BaseException:
+        target.close()
+        _remove_database(tmp_path)
+        raise
+    target.close()
+    os.replace(tmp_path, db_path)
+    return counts
+
+
+def _remove_database(path: str) -> None:
+    for name in (path, path + "-wal", path + "-shm"):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+def open_storage(backend: str, dataset_dir: str, feature_version: Optional[str] = None,
+                 legacy_feature_version: Optional[str] = None) -> Storage:
+    """Open the configured backend, migrating flat files into a new SQLite database"""
+    if backend == "json":
+        return JsonStorage(dataset_dir, feature_version)
+    if backend != "sqlite":
+        raise ValueError(f"Unknown storage backend: {backend!r} (expected 'sqlite' or 'json')")
+
+    db_path = os.path.join(dataset_dir, "attend.db")
+    if not os.path.exists(db_path) and os.path.exists(os.path.join(dataset_dir, "users.json")):
+        counts = migrate_to_new_database(dataset_dir, db_path, legacy_feature_version)
+        logger.info(f"Migrated JSON dataset into {db_path}: {counts}")
+    return SQLiteStorage(db_path, feature_version)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate the flat-file dataset into SQLite")
+    parser.add_argument("--dataset-dir", default="dataset")
+    parser.add_argument("--db", default=None, help="target database (default: <dataset-dir>/attend.db)")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(args.dataset_dir, "attend.db")
+    if os.path.exists(db_path):
+        raise SystemExit(f"{db_path} already exists; refusing to migrate twice")
+    # Untagged encodings predate feature versioning, as in open_storage's automatic migration
+    from features import LEGACY_FEATURE_VERSION
+    counts = migrate_to_new_database(args.dataset_dir, db_path, LEGACY_FEATURE_VERSION)
+    print(f"Migrated into {db_path}: {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import itertools
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from features import QUALITY_GATE, assess_face_quality, crop_face, describe_crop, detect_faces, load_grayscale
+
+# identify(features) -> (username or None, confidence); mark(username, confidence) -> status
+IdentifyFn = Callable[[np.ndarray], Tuple[Optional[str], float]]
+MarkFn = Callable[[str, float], str]
+
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> float:
+    """Intersection over union of two x, y, w, h boxes"""
+    ax2, ay2 = a[0] + a[2], a[1] + a[3]
+    bx2, by2 = b[0] + b[2], b[1] + b[3]
+    inter_w = max(0, min(ax2, bx2) - max(a[0], b[0]))
+    inter_h = max(0, min(ay2, by2) - max(a[1], b[1]))
+    inter = inter_w * inter_h
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union > 0 else 0.0
+
+
+class Track:
+    """One face followed across frames; identified at most once"""
+
+    def __init__(self, track_id: int, box: np.ndarray, gray: np.ndarray):
+        self.track_id = track_id
+        self.box = np.asarray(box, dtype=np.int32)
+        self.template = self._crop(gray)
+        self.missed_detections = 0
+        self.attempts = 0
+        self.user: Optional[str] = None
+        self.confidence = 0.0
+        self.resolved = False
+        # Set while the latest crop failed the quality gate, so the rejection is reported once
+        self.low_quality = False
+
+    def _crop(self, gray: np.ndarray) -> np.ndarray:
+        x, y, w, h = self.box
+        return gray[y:y+h, x:x+w].copy()
+
+    def reset(self, box: np.ndarray, gray: np.ndarray) -> None:
+        """Snap to a fresh detection"""
+        self.box = np.asarray(box, dtype=np.int32)
+        self.template = self._crop(gray)
+        self.missed_detections = 0
+
+    def follow(self, gray: np.ndarray, min_score: float = 0.5) -> bool:
+        """Move the box by template matching in a window around it; cheap frame-to-frame tracking"""
+        x, y, w, h = self.box
+        if self.template.size == 0:
+            return False
+        margin_x, margin_y = w // 2, h // 2
+        x0, y0 = max(0, x - margin_x), max(0, y - margin_y)
+        x1, y1 = min(gray.shape[1], x + w + margin_x), min(gray.shape[0], y + h + margin_y)
+        window = gray[y0:y1, x0:x1]
+        if window.shape[0] < h or window.shape[1] < w:
+            return False
+
+        scores = cv2.matchTemplate(window, self.template, cv2.TM_CCOEFF_NORMED)
+        _, best, _, (dx, dy) = cv2.minMaxLoc(scores)
+        if best < min_score:
+            return False
+        self.box = np.array([x0 + dx, y0 + dy, w, h], dtype=np.int32)
+        return True
+
+
+class StreamSession:
+    """Per-connection state for streaming recognition.
+
+    Faces are detected only every detect_every frames and followed by
+    template matching in between. Each track runs feature extraction and
+    matching until it is identified (or max_attempts detection frames pass),
+    so a person standing in front of the camera is recognized once rather
+    than on every frame. With gate set, crops failing the face quality gate
+    are skipped without using up an attempt, and a track reports one
+    "low_quality" event until a good crop arrives. process_frame returns the
+    events to push back.
+    """
+
+    def __init__(self, identify: IdentifyFn, mark: MarkFn, detect_every: int = 5, max_attempts: int = 3,
+                 max_missed: int = 2, min_iou: float = 0.3, send_boxes: bool = False, gate: bool = QUALITY_GATE):
+        self.identify = identify
+        self.mark = mark
+        self.detect_every = max(1, detect_every)
+        self.max_attempts = max_attempts
+        self.max_missed = max_missed
+        self.min_iou = min_iou
+        self.send_boxes = send_boxes
+        self.gate = gate
+        self.tracks: Dict[int, Track] = {}
+        self.frame_index = -1
+        self.skipped_frames = 0
+        self.identifications = 0
+        self.quality_rejections = 0
+        self._track_ids = itertools.count(1)
+
+    def process_frame(self, frame) -> List[dict]:
+        gray = load_grayscale(frame)
+        self.frame_index += 1
+        if gray is None:
+            return [{"type": "error", "frame": self.frame_index, "message": "Could not decode frame"}]
+
+        if self.frame_index % self.detect_every == 0:
+            events = self._detect(gray)
+        else:
+            events = []
+            for track in self.tracks.values():
+                track.follow(gray)
+
+        if self.send_boxes:
+            events.append({
+                "type": "tracks",
+                "frame": self.frame_index,
+                "tracks": [
+                    {"track_id": t.track_id, "box": [int(v) for v in t.box], "user": t.user}
+                    for t in self.tracks.values()
+                ]
+            })
+        return events
+
+    def _detect(self, gray: np.ndarray) -> List[dict]:
+        events = []
+        detections = list(detect_faces(gray))
+        matched = set()
+
+        # Greedy IoU association of detections to existing tracks
+        pairs = sorted(
+            ((box_iou(track.box, box), track_id, i)
+             for track_id, track in self.tracks.items() for i, box in enumerate(detections)),
+            reverse=True
+        )
+        seen_tracks = set()
+        for iou, track_id, i in pairs:
+            if iou < self.min_iou:
+                break
+            if track_id in seen_tracks or i in matched:
+                continue
+            self.tracks[track_id].reset(detections[i], gray)
+            seen_tracks.add(track_id)
+            matched.add(i)
+
+        for track_id in list(self.tracks):
+            if track_id not in seen_tracks:
+                track = self.tracks[track_id]
+                track.missed_detections += 1
+                if track.missed_detections > self.max_missed:
+                    del self.tracks[track_id]
+                    events.append({"type": "track_lost", "frame": self.frame_index, "track_id": track_id,
+                                   "user": track.user})
+
+        for i, box in enumerate(detections):
+            if i not in matched:
+                track = Track(next(self._track_ids), box, gray)
+                self.tracks[track.track_id] = track
+                seen_tracks.add(track.track_id)
+                events.append({"type": "track_started", "frame": self.frame_index, "track_id": track.track_id,
+                               "box": [int(v) for v in box]})
+
+        # Extraction and matching only for tracks that are freshly detected and still unresolved
+        for track_id in seen_tracks:
+            track = self.tracks[track_id]
+            if not track.resolved:
+                events.extend(self._identify(track, gray))
+        return events
+
+    def _identify(self, track: Track, gray: np.ndarray) -> List[dict]:
+        crop = crop_face(gray, track.box)
+        quality = assess_face_quality(crop, min(track.box[2], track.box[3]))
+        if self.gate and not quality["passed"]:
+            self.quality_rejections += 1
+            if track.low_quality:
+                return []
+            track.low_quality = True
+            return [{"type": "low_quality", "frame": self.frame_index, "track_id": track.track_id,
+                     "box": [int(v) for v in track.box], "quality": quality}]
+        track.low_quality = False
+
+        track.attempts += 1
+        self.identifications += 1
+        user, confidence = self.identify(describe_crop(crop))
+        event = {"frame": self.frame_index, "track_id": track.track_id, "box": [int(v) for v in track.box],
+                 "confidence": confidence, "quality": quality}
+
+        if user is not None:
+            track.user, track.confidence, track.resolved = user, confidence, True
+            event.update({
+                "type": "recognized",
+                "user": user,
+                "display_name": user.replace('_', ' ').title(),
+                "status": self.mark(user, confidence)
+            })
+            return [event]
+
+        if track.attempts >= self.max_attempts:
+            track.resolved = True
+            event["type"] = "unknown"
+            return [event]
+        return []
+
+    def stats(self) -> dict:
+        return {
+            "frames": self.frame_index + 1,
+            "skipped_frames": self.skipped_frames,
+            "identifications": self.identifications,
+            "quality_rejections": self.quality_rejections,
+            "active_tracks": len(self.tracks)
+        }
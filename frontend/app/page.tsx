@@ -10,6 +10,16 @@ interface RecognitionResult {
   attendance?: string
   message?: string
   confidence?: number
+  quality?: FaceQuality
+}
+
+interface FaceQuality {
+  score: number
+  passed: boolean
+  issues: string[]
+  face_size: number
+  sharpness: number
+  brightness: number
 }
 
 interface ModelStatus {
@@ -412,9 +422,17 @@ function FaceRecognition() {
 
   const fetchTodayAttendance = useCallback(async () => {
     try {
-      const response = await fetch('http://localhost:8001/attendance/today')
-      const data = await response.json()
-      setTodayAttendance(data.attendance || [])
+      // The endpoint returns one page at a time; follow next_cursor until the whole day is loaded
+      const records: AttendanceRecord[] = []
+      let cursor: string | null = null
+      do {
+        const query: string = cursor ? `&cursor=${encodeURIComponent(cursor)}` : ''
+        const response = await fetch(`http://localhost:8001/attendance/today?limit=5000${query}`)
+        const data = await response.json()
+        records.push(...(data.attendance || []))
+        cursor = data.next_cursor ?? null
+      } while (cursor)
+      setTodayAttendance(records)
     } catch (error) {
       console.error('Failed to fetch attendance:', error)
     }
@@ -517,18 +535,18 @@ function FaceRecognition() {
     setIsRemoving('all')
 
     try {
-      // Remove attendance for each user today
-      const removePromises = todayAttendance.map(record => 
-        fetch(`http://localhost:8001/attendance/today/${record.username}`, {
-          method: 'DELETE',
-        })
-      )
-
-      await Promise.all(removePromises)
+      // Remove today's attendance on the server, including records not loaded here yet
+      const response = await fetch('http://localhost:8001/attendance/today', {
+        method: 'DELETE',
+      })
+      if (!response.ok) {
+        throw new Error('Failed to clear attendance')
+      }
+      const cleared = await response.json()
 
       setResult({ 
         status: 'success', 
-        message: `Cleared all ${todayAttendance.length} attendance records for today` 
+        message: `Cleared all ${cleared.removed_count} attendance records for today` 
       })
       
       // Refresh attendance data
@@ -632,6 +650,7 @@ function FaceRecognition() {
                 result.status === 'success' ? 'bg-green-50 border-green-300' :
                 result.status === 'already_marked' ? 'bg-yellow-50 border-yellow-300' :
                 result.status === 'unknown' ? 'bg-orange-50 border-orange-300' :
+                result.status === 'low_quality' ? 'bg-amber-50 border-amber-300' :
                 'bg-red-50 border-red-300'
               }`}>
                 <div className="flex items-center space-x-3">
@@ -640,16 +659,23 @@ function FaceRecognition() {
                     {result.status === 'unknown' && <AlertCircle className="text-orange-600" size={24} />}
                     {result.status === 'error' && <XCircle className="text-red-600" size={24} />}
                     {result.status === 'already_marked' && <Clock className="text-yellow-600" size={24} />}
+                    {result.status === 'low_quality' && <AlertTriangle className="text-amber-600" size={24} />}
                   </div>
                   <div className="flex-1">
                     <p className={`font-bold ${
                       result.status === 'success' ? 'text-green-800' :
                       result.status === 'already_marked' ? 'text-yellow-800' :
                       result.status === 'unknown' ? 'text-orange-800' :
+                      result.status === 'low_quality' ? 'text-amber-800' :
                       'text-red-800'
                     }`}>
                       {result.message}
                     </p>
+                    {result.status === 'low_quality' && result.quality && (
+                      <p className="text-sm opacity-75 mt-1">
+                        Quality score: {(result.quality.score * 100).toFixed(0)}%
+                      </p>
+                    )}
                     {result.user && (
                       <p className="text-sm opacity-75 mt-1">User: {result.user}</p>
                     )}